@@ -0,0 +1,84 @@
+import argparse
+import json
+import os
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from exceptions import MinechatException
+
+
+class Account(NamedTuple):
+    name: str
+    token: str
+    read_host: str
+    read_port: int
+    write_host: str
+    write_port: int
+    history_path: str
+    spool_path: str
+    output: Optional[str] = None  # received messages are only saved to the history when not set
+    input: Optional[str] = None  # nothing is sent when not set
+
+
+def wrong_accounts_file(path: str, reason: str) -> MinechatException:
+    return MinechatException(
+        title='Неверный файл аккаунтов',
+        message=f'Файл {path}: {reason}.',
+    )
+
+
+def is_file_name(name: str) -> bool:
+    """Checks that a name can be a file name in the current directory."""
+    separators = [separator for separator in (os.sep, os.altsep) if separator]
+    return name not in ('', '.', '..') and not any(separator in name for separator in separators)
+
+
+def parse_account(entry: Dict[str, Any], settings: argparse.Namespace) -> Account:
+    """
+    Makes an account from a JSON object, missing servers are taken from common settings.
+
+    History and spool files are named after the account unless they are set explicitly.
+    """
+    name = str(entry['name'])
+    return Account(
+        name=name,
+        token=str(entry['token']),
+        read_host=entry.get('read_host', settings.read_host),
+        read_port=int(entry.get('read_port', settings.read_port)),
+        write_host=entry.get('write_host', settings.write_host),
+        write_port=int(entry.get('write_port', settings.write_port)),
+        history_path=entry.get('history_path', f'{name}.history'),
+        spool_path=entry.get('spool_path', f'{name}.spool'),
+        output=entry.get('output'),
+        input=entry.get('input'),
+    )
+
+
+def load_accounts(path: str, settings: argparse.Namespace) -> List[Account]:
+    """
+    Reads a JSON list of accounts, every account must have its own files and streams.
+
+    Accounts sharing an input would take lines of each other and a shared output would mix their messages.
+    """
+    try:
+        with open(path, mode='r', encoding='utf-8') as f:
+            entries = json.load(f)
+    except (OSError, ValueError) as e:
+        raise wrong_accounts_file(path, f'не удаётся прочитать ({e})')
+    if not isinstance(entries, list) or not entries:
+        raise wrong_accounts_file(path, 'ожидается непустой список аккаунтов')
+
+    accounts = []
+    for number, entry in enumerate(entries, start=1):
+        try:
+            account = parse_account(entry, settings)
+        except (KeyError, TypeError, ValueError, AttributeError):
+            raise wrong_accounts_file(path, f'у аккаунта №{number} нет имени, токена или неверный порт')
+        if not is_file_name(account.name) and not ('history_path' in entry and 'spool_path' in entry):
+            raise wrong_accounts_file(path, f'имя аккаунта №{number} не годится для имени файла, укажите history_path и spool_path')
+        accounts.append(account)
+
+    for field in ('name', 'history_path', 'spool_path', 'input', 'output'):
+        values = [getattr(account, field) for account in accounts if getattr(account, field) is not None]
+        if len(set(values)) != len(values):
+            raise wrong_accounts_file(path, f'значения {field} у аккаунтов должны различаться')
+    return accounts
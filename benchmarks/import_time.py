@@ -0,0 +1,106 @@
+"""
+Measures cold-start import time of the chat core with `python -X importtime`.
+
+Every run imports the modules in a fresh interpreter. The script reports the median
+total and the slowest dependencies, and fails if the core pulls in Tk
+or is slower than the budget.
+
+    $ python benchmarks/import_time.py --runs 20 --budget-ms 150
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List, NamedTuple, Sequence
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CORE_MODULES = (
+    'common_tools',
+    'read_client',
+    'write_client',
+    'watchdog',
+    'history_client',
+    'message_bus',
+    'spool',
+    'headless',
+    'settings',
+)
+FORBIDDEN_MODULES = ('tkinter', '_tkinter')
+
+
+class ImportRun(NamedTuple):
+    wall_time: float  # seconds, including interpreter start
+    total: int  # microseconds spent in imports of requested modules
+    cumulative: Dict[str, int]  # microseconds per imported module
+
+
+def parse_importtime(output: str) -> Dict[str, int]:
+    """Cumulative import time of every module from `-X importtime` output."""
+    cumulative = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, name = line[len('import time:'):].split('|')
+        cumulative[name.strip()] = int(cumulative_us)
+    return cumulative
+
+
+def measure_once(modules: Sequence[str]) -> ImportRun:
+    started_at = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {", ".join(modules)}'],
+        cwd=ROOT,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    wall_time = time.perf_counter() - started_at
+    cumulative = parse_importtime(result.stderr)
+    return ImportRun(wall_time, sum(cumulative.get(module, 0) for module in modules), cumulative)
+
+
+def create_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser('Import time benchmark of the chat core')
+    parser.add_argument('--runs', type=int, default=10, help='How many fresh interpreters to start')
+    parser.add_argument('--top', type=int, default=15, help='How many slowest modules to show')
+    parser.add_argument('--budget-ms', type=float, default=0, help='Fail when the median import time is bigger, 0 disables the check')
+    parser.add_argument('modules', nargs='*', default=CORE_MODULES, help='Modules to import')
+    return parser
+
+
+def main() -> None:
+    args = create_parser().parse_args()
+    runs: List[ImportRun] = [measure_once(args.modules) for _ in range(args.runs)]
+
+    per_module: Dict[str, List[int]] = defaultdict(list)
+    for run in runs:
+        for module, cumulative in run.cumulative.items():
+            per_module[module].append(cumulative)
+    median_total_ms = statistics.median(run.total for run in runs) / 1000
+
+    print(f'{len(runs)} runs of: import {", ".join(args.modules)}')
+    print(f'imports median {median_total_ms:.1f} ms, min {min(run.total for run in runs) / 1000:.1f} ms')
+    print(f'process median {statistics.median(run.wall_time for run in runs) * 1000:.1f} ms including interpreter start')
+    print(f'{"module":<40} {"median ms":>10}')
+    slowest = sorted(per_module.items(), key=lambda item: statistics.median(item[1]), reverse=True)
+    for module, timings in slowest[:args.top]:
+        print(f'{module:<40} {statistics.median(timings) / 1000:>10.1f}')
+
+    failed = False
+    forbidden = sorted(module for module in FORBIDDEN_MODULES if module in per_module)
+    if forbidden:
+        print(f'FAIL: {", ".join(forbidden)} imported, a display may be needed')
+        failed = True
+    if args.budget_ms and median_total_ms > args.budget_ms:
+        print(f'FAIL: {median_total_ms:.1f} ms is over the budget of {args.budget_ms} ms')
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
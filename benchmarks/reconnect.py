@@ -0,0 +1,368 @@
+"""
+Measures how the client notices broken connections and recovers from them.
+
+A local stand-in server is put behind fault injection proxies, one per channel,
+which drop, stall, half-close or slow down connections on a schedule.
+The client runs headless in the main thread, the servers run in another thread,
+so CPU time of the client is measured apart from them.
+
+For every fault the report has detection latency, time to reconnect after the fault
+is over and CPU used while disconnected. Lost and duplicated messages are counted
+in both directions. The JSON report can be compared with a report of another version:
+
+    $ python benchmarks/reconnect.py --report new.json --compare old.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from anyio import create_task_group
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import defaults  # noqa: E402
+from fake_server import FakeChatServer, format_load_message, generate_load, parse_load_message  # noqa: E402
+from fault_proxy import AppliedFault, FaultProxy, FaultStep, parse_fault_step, run_schedule  # noqa: E402
+from liveness import READ_CHANNEL, WRITE_CHANNEL, Healthcheck, LivenessMonitor  # noqa: E402
+from message_bus import MessageBus, Subscription  # noqa: E402
+from queues import BoundedQueue, OverflowPolicy  # noqa: E402
+from spool import OutgoingSpool  # noqa: E402
+from watchdog import ReconnectStats, handle_connection  # noqa: E402
+
+TOKEN = 'benchmark'
+NICKNAME = 'bench'
+LOAD_NICKNAME = 'Steve'
+CHANNELS = (READ_CHANNEL, WRITE_CHANNEL)
+# the client keeps running after the load has stopped, so messages on the way are not counted as lost
+DRAIN_TIME = 1.0
+DEFAULT_SCHEDULE = (
+    '2:read:drop:2',
+    '7:write:drop:2',
+    '12:read:half_close:2',
+    '17:write:half_close:2',
+    '22:write:stall:20',
+    '45:read:stall:20',
+    '68:slow:5',
+)
+
+
+class Outage(NamedTuple):
+    channel: str
+    detected_at: float  # time.monotonic()
+    recovered_at: Optional[float]
+    attempts: int
+    cpu_time: float  # seconds of client CPU while the channel was down
+
+
+class ServerSide(threading.Thread):
+    """
+    Chat server, proxies and load generator running in their own event loop.
+
+    Messages posted by the client are watched on the server side, bypassing the proxies.
+    """
+
+    def __init__(self, steps: List[FaultStep], rate: float, run_time: float) -> None:
+        super().__init__(name='servers', daemon=True)
+        self.steps = steps
+        self.rate = rate
+        self.run_time = run_time
+        self.ready = threading.Event()
+        self.done = threading.Event()
+        self.ports: Dict[str, int] = {}
+        self.applied: List[AppliedFault] = []
+        self.incoming_sent = 0
+        self.outgoing_seen: List[int] = []
+
+    def run(self) -> None:
+        asyncio.run(self.serve())
+
+    async def serve(self) -> None:
+        async with FakeChatServer(tokens={TOKEN: NICKNAME}) as server:
+            async with FaultProxy(server.host, server.read_port) as read_proxy, \
+                    FaultProxy(server.host, server.write_port) as write_proxy:
+                self.ports = {READ_CHANNEL: read_proxy.port, WRITE_CHANNEL: write_proxy.port}
+                watcher = asyncio.ensure_future(self.watch_outgoing(server))
+                await asyncio.sleep(0.1)
+                self.ready.set()
+                proxies = {READ_CHANNEL: read_proxy, WRITE_CHANNEL: write_proxy}
+                schedule = asyncio.ensure_future(run_schedule(proxies, self.steps, self.applied))
+                self.incoming_sent = await generate_load(server, self.rate, self.run_time, nicknames=[LOAD_NICKNAME])
+                await schedule
+                # posted messages still on the way are given time to arrive
+                while not self.done.is_set():
+                    await asyncio.sleep(0.05)
+                watcher.cancel()
+
+    async def watch_outgoing(self, server: FakeChatServer) -> None:
+        reader, writer = await asyncio.open_connection(server.host, server.read_port)
+        try:
+            prefix = f'{NICKNAME}: '.encode('utf-8')
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return
+                if line.startswith(prefix):
+                    posted = parse_load_message(line.decode('utf-8', errors='replace'))
+                    if posted:
+                        self.outgoing_seen.append(posted[0])
+        finally:
+            writer.close()
+
+
+async def consume_messages(messages_queue: Subscription, received: List[int]) -> None:
+    while True:
+        message = await messages_queue.get()
+        # messages posted by the client come back too, they are counted on the server side
+        load_message = parse_load_message(message.body) if message.nickname == LOAD_NICKNAME else None
+        if load_message:
+            received.append(load_message[0])
+
+
+async def post_messages(spool: OutgoingSpool, rate: float, run_time: float, posted: List[int]) -> None:
+    started_at = time.monotonic()
+    number = 0
+    while time.monotonic() - started_at < run_time:
+        spool.append(format_load_message(number, time.time()))
+        posted.append(number)
+        number += 1
+        await asyncio.sleep(1 / rate)
+
+
+async def track_outages(reconnect_stats: Dict[str, ReconnectStats], outages: List[Outage], interval: float = 0.01) -> None:
+    """Samples reconnect stats and notes when every outage started, ended and how much CPU it took."""
+    current: Dict[str, Optional[Outage]] = {channel: None for channel in CHANNELS}
+    recoveries = {channel: 0 for channel in CHANNELS}
+    while True:
+        await asyncio.sleep(interval)
+        for channel in CHANNELS:
+            stats = reconnect_stats[channel]
+            outage = current[channel]
+            if outage is None and stats.outage_started_at is not None:
+                current[channel] = Outage(channel, stats.outage_started_at, None, 0, time.thread_time())
+            elif outage is not None and stats.recoveries > recoveries[channel]:
+                outages.append(outage._replace(
+                    recovered_at=outage.detected_at + (stats.last_recovery_time or 0),
+                    attempts=stats.outage_attempts,
+                    cpu_time=time.thread_time() - outage.cpu_time,
+                ))
+                current[channel] = None
+            recoveries[channel] = stats.recoveries
+
+
+async def run_client(
+        ports: Dict[str, int],
+        settings: argparse.Namespace,
+        run_time: float,
+        received: List[int],
+        posted: List[int],
+        outages: List[Outage],
+) -> None:
+    reconnect_stats = {channel: ReconnectStats() for channel in CHANNELS}
+    message_bus = MessageBus()
+    messages_queue = message_bus.subscribe('messages')
+    status_queue = BoundedQueue('status', 100, OverflowPolicy.COALESCE)
+    healthcheck = Healthcheck(settings.healthcheck_idle, settings.healthcheck_min_timeout, settings.healthcheck_max_timeout)
+    with tempfile.TemporaryDirectory() as directory:
+        spool = OutgoingSpool(os.path.join(directory, 'benchmark.spool'))
+        try:
+            async with create_task_group() as tg:
+                await tg.spawn(handle_connection,
+                               '127.0.0.1',
+                               ports[READ_CHANNEL],
+                               '127.0.0.1',
+                               ports[WRITE_CHANNEL],
+                               TOKEN,
+                               message_bus,
+                               spool,
+                               status_queue,
+                               LivenessMonitor(),
+                               settings.reconnect_min_delay,
+                               settings.reconnect_max_delay,
+                               settings.read_timeout,
+                               healthcheck,
+                               None,
+                               None,
+                               reconnect_stats,
+                               )
+                await tg.spawn(consume_messages, messages_queue, received)
+                await tg.spawn(post_messages, spool, settings.outgoing_rate, run_time, posted)
+                await tg.spawn(track_outages, reconnect_stats, outages)
+                await asyncio.sleep(run_time + DRAIN_TIME)
+                await tg.cancel_scope.cancel()
+        finally:
+            spool.close()
+    for channel, stats in reconnect_stats.items():
+        if stats.outage_started_at is not None:
+            outages.append(Outage(channel, stats.outage_started_at, None, stats.outage_attempts, float('nan')))
+
+
+def count_messages(sent: int, received: List[int]) -> Dict[str, int]:
+    counts = Counter(received)
+    return {
+        'sent': sent,
+        'received': len(received),
+        'lost': len(set(range(sent)) - set(counts)),
+        'duplicated': sum(count - 1 for count in counts.values()),
+    }
+
+
+def describe_faults(applied: List[AppliedFault], outages: List[Outage]) -> List[Dict[str, Any]]:
+    """Matches every fault with the first outage of a broken channel which started during or after it."""
+    results = []
+    for number, fault in enumerate(applied):
+        next_started_at = applied[number + 1].started_at if number + 1 < len(applied) else float('inf')
+        for channel in CHANNELS:
+            if fault.step.channel and fault.step.channel != channel:
+                continue
+            outage = next(
+                (outage for outage in sorted(outages, key=lambda outage: outage.detected_at)
+                 if outage.channel == channel and fault.started_at <= outage.detected_at < next_started_at),
+                None,
+            )
+            result: Dict[str, Any] = {
+                'fault': fault.step.fault.value,
+                'channel': channel,
+                'at': fault.step.at,
+                'duration': fault.step.duration,
+                'detected_after': None,
+                'reconnected_after_fault': None,
+                'outage': None,
+                'reconnect_attempts': None,
+                'cpu_while_disconnected': None,
+            }
+            if outage:
+                result['detected_after'] = round(outage.detected_at - fault.started_at, 3)
+                result['reconnect_attempts'] = outage.attempts
+                if outage.recovered_at is not None:
+                    result['reconnected_after_fault'] = round(outage.recovered_at - fault.ended_at, 3)
+                    result['outage'] = round(outage.recovered_at - outage.detected_at, 3)
+                    result['cpu_while_disconnected'] = round(outage.cpu_time, 4)
+            results.append(result)
+    return results
+
+
+def get_version() -> Optional[str]:
+    try:
+        result = subprocess.run(
+            ['git', 'describe', '--always', '--dirty'],
+            cwd=ROOT,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+
+def format_seconds(value: Optional[float]) -> str:
+    return '-' if value is None else f'{value:.2f}'
+
+
+def print_report(report: Dict[str, Any], previous: Optional[Dict[str, Any]] = None) -> None:
+    """Prints faults of the report, values of a previous report are shown in brackets."""
+    previous_faults = {
+        (fault['at'], fault['channel'], fault['fault']): fault
+        for fault in (previous or {}).get('faults', [])
+    }
+
+    def column(fault: Dict[str, Any], key: str) -> str:
+        value = format_seconds(fault[key])
+        old_fault = previous_faults.get((fault['at'], fault['channel'], fault['fault']))
+        if old_fault is None:
+            return value
+        return f'{value} ({format_seconds(old_fault.get(key))})'
+
+    print(f'version {report["version"]}' + (f', compared with {previous["version"]} in brackets' if previous else ''))
+    print(f'{"at":>5} {"channel":<7} {"fault":<11} {"detected":>16} {"reconnected":>16} {"cpu":>16}')
+    for fault in report['faults']:
+        print(
+            f'{fault["at"]:>5g} {fault["channel"]:<7} {fault["fault"]:<11} '
+            f'{column(fault, "detected_after"):>16} {column(fault, "reconnected_after_fault"):>16} '
+            f'{column(fault, "cpu_while_disconnected"):>16}'
+        )
+    for direction in ('incoming', 'outgoing'):
+        counts = report[direction]
+        line = f'{direction}: {counts["sent"]} sent, {counts["lost"]} lost, {counts["duplicated"]} duplicated'
+        if previous:
+            old_counts = previous[direction]
+            line += f' ({old_counts["sent"]} sent, {old_counts["lost"]} lost, {old_counts["duplicated"]} duplicated)'
+        print(line)
+    print('Times are in seconds, `-` means that the client has not noticed the fault or has not recovered.')
+
+
+def create_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser('Reconnect benchmark of the chat client')
+    parser.add_argument('--schedule', metavar='AT:CHANNEL:FAULT:DURATION', type=parse_fault_step, nargs='+', default=[parse_fault_step(step) for step in DEFAULT_SCHEDULE], help='Faults to apply, a fault without a channel breaks both')
+    parser.add_argument('--incoming-rate', metavar='MSG/S', type=float, default=20, help='Messages broadcast by the server')
+    parser.add_argument('--outgoing-rate', metavar='MSG/S', type=float, default=2, help='Messages posted by the client')
+    parser.add_argument('--settle-time', metavar='SECONDS', type=float, default=5, help='How long the load and the client go on after the last fault')
+    parser.add_argument('--read-timeout', metavar='SECONDS', type=float, default=defaults.READ_TIMEOUT)
+    parser.add_argument('--reconnect-min-delay', metavar='SECONDS', type=float, default=defaults.RECONNECT_MIN_DELAY)
+    parser.add_argument('--reconnect-max-delay', metavar='SECONDS', type=float, default=defaults.RECONNECT_MAX_DELAY)
+    parser.add_argument('--healthcheck-idle', metavar='SECONDS', type=float, default=defaults.HEALTHCHECK_IDLE)
+    parser.add_argument('--healthcheck-min-timeout', metavar='SECONDS', type=float, default=defaults.HEALTHCHECK_MIN_TIMEOUT)
+    parser.add_argument('--healthcheck-max-timeout', metavar='SECONDS', type=float, default=defaults.HEALTHCHECK_MAX_TIMEOUT)
+    parser.add_argument('--report', metavar='FILEPATH', type=str, help='Where to write the JSON report')
+    parser.add_argument('--compare', metavar='FILEPATH', type=str, help='JSON report of another version to compare with')
+    return parser
+
+
+def main() -> None:
+    # reconnects are reported in the table instead
+    logging.basicConfig(level=logging.ERROR)
+    args = create_parser().parse_args()
+    previous = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            previous = json.load(f)
+
+    run_time = max(step.at + step.duration for step in args.schedule) + args.settle_time
+    servers = ServerSide(args.schedule, args.incoming_rate, run_time)
+    servers.start()
+    servers.ready.wait()
+    received: List[int] = []
+    posted: List[int] = []
+    outages: List[Outage] = []
+    print(f'Running for {run_time + DRAIN_TIME:g} s')
+    asyncio.run(run_client(servers.ports, args, run_time, received, posted, outages))
+    servers.done.set()
+    servers.join()
+
+    report = {
+        'version': get_version(),
+        'python': platform.python_version(),
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'settings': {
+            key: value for key, value in vars(args).items() if key not in ('schedule', 'report', 'compare')
+        },
+        'schedule': [
+            ':'.join(f'{part:g}' if isinstance(part, float) else str(part) for part in (step.at, step.channel, step.fault.value, step.duration) if part != '')
+            for step in args.schedule
+        ],
+        'faults': describe_faults(servers.applied, outages),
+        'incoming': count_messages(servers.incoming_sent, received),
+        'outgoing': count_messages(len(posted), servers.outgoing_seen),
+    }
+    print_report(report, previous)
+    if args.report:
+        with open(args.report, mode='w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f'Report is saved to {args.report}')
+
+
+if __name__ == '__main__':
+    main()
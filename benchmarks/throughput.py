@@ -0,0 +1,189 @@
+"""
+Measures how fast the client takes messages from the socket to the window queue and the history file.
+
+A local stand-in server broadcasts generated messages at the given rates, the client
+runs headless: messages are read, published to the bus and consumed the same way
+the window and the history writer consume them.
+
+    $ python benchmarks/throughput.py --rates 100 1000 10000 --duration 10
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+from typing import List, NamedTuple, Sequence
+
+from anyio import create_task_group
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import defaults  # noqa: E402
+from fake_server import FakeChatServer, generate_load, parse_load_message  # noqa: E402
+from history_client import save_history  # noqa: E402
+from liveness import LivenessMonitor  # noqa: E402
+from message_bus import MessageBus, Subscription  # noqa: E402
+from queues import BoundedQueue, OverflowPolicy, QueueLimit, parse_queue_limit  # noqa: E402
+from read_client import read_messages  # noqa: E402
+
+
+class RunResult(NamedTuple):
+    rate: float
+    sent: int
+    shown: int
+    saved: int
+    dropped: int  # skipped by the window queue because it was full
+    duration: float  # from the start till the last saved message
+    queue_latencies: List[float]
+    history_latencies: List[float]
+
+
+def percentile(values: Sequence[float], fraction: float) -> float:
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def consume_window_queue(messages_queue: Subscription, latencies: List[float]) -> None:
+    """Takes messages like the window does and records how long they have been on the way."""
+    while True:
+        message = await messages_queue.get()
+        received_at = time.time()
+        load_message = parse_load_message(message.body)
+        if load_message:
+            latencies.append(received_at - load_message[1])
+
+
+async def follow_history(path: str, latencies: List[float], poll_interval: float) -> None:
+    """Reads lines appended to the history file and records when each of them appeared."""
+    offset = 0
+    tail = b''
+    while True:
+        await asyncio.sleep(poll_interval)
+        try:
+            with open(path, mode='rb') as f:
+                f.seek(offset)
+                chunk = f.read()
+        except FileNotFoundError:
+            continue
+        if not chunk:
+            continue
+        found_at = time.time()
+        offset += len(chunk)
+        *lines, tail = (tail + chunk).split(b'\n')
+        for line in lines:
+            load_message = parse_load_message(line.decode('utf-8', errors='replace'))
+            if load_message:
+                latencies.append(found_at - load_message[1])
+
+
+async def wait_for_history(history_latencies: List[float], sent: int, started_at: float, settle_time: float) -> float:
+    """
+    Waits until every sent message is saved or the history stops growing for `settle_time`.
+
+    Returns seconds from the start till the last saved message.
+    """
+    saved, saved_at = len(history_latencies), time.monotonic()
+    while saved < sent and time.monotonic() - saved_at < settle_time:
+        await asyncio.sleep(0.01)
+        if len(history_latencies) > saved:
+            saved, saved_at = len(history_latencies), time.monotonic()
+    return saved_at - started_at
+
+
+async def run_once(
+        rate: float,
+        duration: float,
+        padding: int,
+        messages_limit: QueueLimit,
+        history_limit: QueueLimit,
+        flush_interval: float,
+        poll_interval: float,
+        settle_time: float,
+) -> RunResult:
+    queue_latencies: List[float] = []
+    history_latencies: List[float] = []
+    with tempfile.TemporaryDirectory() as directory:
+        history_path = os.path.join(directory, 'benchmark.history')
+        async with FakeChatServer() as server:
+            message_bus = MessageBus()
+            messages_queue = message_bus.subscribe('messages', messages_limit)
+            history_queue = message_bus.subscribe('history', history_limit)
+            status_queue = BoundedQueue('status', 100, OverflowPolicy.COALESCE)
+            started_at = time.monotonic()
+            async with create_task_group() as tg:
+                await tg.spawn(read_messages, server.host, server.read_port, status_queue, message_bus, LivenessMonitor())
+                await tg.spawn(consume_window_queue, messages_queue, queue_latencies)
+                await tg.spawn(save_history, history_path, history_queue, flush_interval, 0, False, 'none')
+                await tg.spawn(follow_history, history_path, history_latencies, poll_interval)
+                while not server.readers:
+                    await asyncio.sleep(0.01)
+                sent = await generate_load(server, rate, duration, padding=padding)
+                elapsed = await wait_for_history(history_latencies, sent, started_at, settle_time + flush_interval)
+                await tg.cancel_scope.cancel()
+    return RunResult(
+        rate=rate,
+        sent=sent,
+        shown=len(queue_latencies),
+        saved=len(history_latencies),
+        dropped=messages_queue.dropped,
+        duration=elapsed,
+        queue_latencies=queue_latencies,
+        history_latencies=history_latencies,
+    )
+
+
+def format_result(result: RunResult) -> str:
+    def milliseconds(values: List[float], fraction: float) -> str:
+        return f'{percentile(values, fraction) * 1000:>8.1f}'
+
+    return (
+        f'{result.rate:>9.0f} {result.sent:>8} {result.saved / result.duration:>10.0f} '
+        f'{milliseconds(result.queue_latencies, 0.5)} {milliseconds(result.queue_latencies, 0.99)} '
+        f'{milliseconds(result.history_latencies, 0.5)} {milliseconds(result.history_latencies, 0.99)} '
+        f'{result.sent - result.saved:>6} {result.dropped:>7}'
+    )
+
+
+def create_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser('Throughput benchmark of the chat client')
+    parser.add_argument('--rates', metavar='MSG/S', type=float, nargs='+', default=[100, 1000, 10000], help='Message rates to try')
+    parser.add_argument('--duration', metavar='SECONDS', type=float, default=5, help='How long every rate is kept')
+    parser.add_argument('--padding', type=int, default=40, help='Extra characters added to every message')
+    parser.add_argument('--messages-queue', metavar='SIZE:POLICY', type=parse_queue_limit, default=defaults.MESSAGES_QUEUE, help='Limit of the window queue')
+    parser.add_argument('--history-queue', metavar='SIZE:POLICY', type=parse_queue_limit, default=defaults.HISTORY_QUEUE, help='Limit of the history queue')
+    parser.add_argument('--history-flush-interval', metavar='SECONDS', type=float, default=defaults.HISTORY_FLUSH_INTERVAL, help='How long messages are collected before they are saved')
+    parser.add_argument('--poll-interval', metavar='SECONDS', type=float, default=0.005, help='How often the history file is checked for new lines')
+    parser.add_argument('--settle-time', metavar='SECONDS', type=float, default=1, help='How long to wait for the history to grow before the rest is counted as lost')
+    return parser
+
+
+def main() -> None:
+    # the window queue reports skipped messages itself, they are counted in the table instead
+    logging.basicConfig(level=logging.ERROR)
+    args = create_parser().parse_args()
+    print(f'{args.duration:g} s per rate, history flushed every {args.history_flush_interval:g} s, '
+          f'history latency is accurate to {args.poll_interval * 1000:g} ms')
+    print(f'{"rate":>9} {"sent":>8} {"saved/s":>10} {"queue p50":>8} {"p99":>8} {"file p50":>8} {"p99":>8} {"lost":>6} {"dropped":>7}')
+    for rate in args.rates:
+        result = asyncio.run(run_once(
+            rate,
+            args.duration,
+            args.padding,
+            args.messages_queue,
+            args.history_queue,
+            args.history_flush_interval,
+            args.poll_interval,
+            args.settle_time,
+        ))
+        print(format_result(result))
+    print('Latencies are in milliseconds. Lost messages are not found in the history file, '
+          'dropped ones were skipped by the window queue.')
+
+
+if __name__ == '__main__':
+    main()
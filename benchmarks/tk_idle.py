@@ -0,0 +1,177 @@
+"""
+Measures what polling of Tk events costs while the window is idle and how late input is handled.
+
+`gui.update_tk` is run for every idle interval. The idle phase counts wakeups per second and
+CPU used by the polling loop. Then single events arrive after pauses, like a first keystroke
+after idling, followed by bursts of events, like typing, and the delay from an event to its
+handling is reported. With a display a real Tk window gets virtual events. Without a display
+a stub with the same calls is used, so the numbers cover the loop only and not Tk itself.
+
+    $ python benchmarks/tk_idle.py --idle-intervals 0.0083 0.02 0.05 --idle-time 10
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+from collections import deque
+from typing import Any, Deque, List, NamedTuple, Sequence
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import gui  # noqa: E402
+
+FRAME_INTERVAL = 1 / 120
+ACTIVE_TIME = 1.0
+
+
+class IdleReport(NamedTuple):
+    idle_interval: float
+    wakeups_per_second: float
+    cpu_percent: float
+    first_event_delays: List[float]  # seconds from an event after a pause to its handling
+    burst_event_delays: List[float]
+
+
+class StubApp:
+    """Stands for a Tk root when there is no display, events are handled in `dooneevent`."""
+
+    def __init__(self) -> None:
+        self.tk = self
+        self.polls = 0
+        self.delays: List[float] = []
+        self._events: Deque[float] = deque()
+
+    def post_event(self) -> None:
+        self._events.append(time.perf_counter())
+
+    def dooneevent(self, flags: int) -> bool:
+        self.polls += 1
+        if not self._events:
+            return False
+        self.delays.append(time.perf_counter() - self._events.popleft())
+        return True
+
+    def update_idletasks(self) -> None:
+        pass
+
+    def destroy(self) -> None:
+        pass
+
+
+class TkApp:
+    """Real Tk root which counts polls and handles virtual events."""
+
+    def __init__(self) -> None:
+        import tkinter as tk
+        self.root = tk.Tk()
+        self.root.withdraw()
+        self.polls = 0
+        self.delays: List[float] = []
+        self._posted_at: Deque[float] = deque()
+        self.root.bind('<<Ping>>', self._on_event)
+        self.tk = self
+
+    def _on_event(self, event: Any) -> None:
+        self.delays.append(time.perf_counter() - self._posted_at.popleft())
+
+    def post_event(self) -> None:
+        self._posted_at.append(time.perf_counter())
+        self.root.event_generate('<<Ping>>', when='tail')
+
+    def dooneevent(self, flags: int) -> int:
+        self.polls += 1
+        return self.root.tk.dooneevent(flags)
+
+    def update_idletasks(self) -> None:
+        self.root.update_idletasks()
+
+    def destroy(self) -> None:
+        self.root.destroy()
+
+
+async def post_events(app: Any, count: int, pause: float, burst: int, burst_gap: float) -> List[int]:
+    """Posts events after pauses, each one is followed by a burst, returns indexes of the first events."""
+    first_events = []
+    posted = 0
+    for _ in range(count):
+        await asyncio.sleep(pause * random.uniform(1, 1.5))
+        first_events.append(posted)
+        for _ in range(burst + 1):
+            app.post_event()
+            posted += 1
+            await asyncio.sleep(burst_gap)
+    await asyncio.sleep(pause)
+    return first_events
+
+
+async def measure(
+        app: Any,
+        idle_interval: float,
+        idle_time: float,
+        events: int,
+        pause: float,
+        typing_gap: float,
+) -> IdleReport:
+    poller = asyncio.ensure_future(gui.update_tk(app, FRAME_INTERVAL, idle_interval, ACTIVE_TIME))
+    try:
+        # the loop backs off to the idle interval first
+        await asyncio.sleep(ACTIVE_TIME + 1)
+        polls, cpu_started_at, started_at = app.polls, time.process_time(), time.perf_counter()
+        await asyncio.sleep(idle_time)
+        elapsed = time.perf_counter() - started_at
+        wakeups_per_second = (app.polls - polls) / elapsed
+        cpu_percent = (time.process_time() - cpu_started_at) / elapsed * 100
+        app.delays.clear()
+        first_events = await post_events(app, events, pause, burst=5, burst_gap=typing_gap)
+    finally:
+        poller.cancel()
+    first_event_delays = [app.delays[index] for index in first_events]
+    burst_event_delays = [delay for index, delay in enumerate(app.delays) if index not in set(first_events)]
+    return IdleReport(idle_interval, wakeups_per_second, cpu_percent, first_event_delays, burst_event_delays)
+
+
+def percentile(values: Sequence[float], share: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+
+def format_delays(delays: Sequence[float]) -> str:
+    if not delays:
+        return 'n/a'
+    return f'{statistics.median(delays) * 1000:.1f}/{percentile(delays, 0.99) * 1000:.1f}'
+
+
+def create_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser('Idle cost and input delay of Tk polling')
+    parser.add_argument('--idle-intervals', metavar='SECONDS', type=float, nargs='+', default=[FRAME_INTERVAL, 0.02, 0.05], help='Longest pauses between polls to compare')
+    parser.add_argument('--idle-time', metavar='SECONDS', type=float, default=10, help='How long the idle window is watched')
+    parser.add_argument('--events', type=int, default=30, help='How many events arrive after a pause')
+    parser.add_argument('--pause', metavar='SECONDS', type=float, default=2, help='Shortest pause before an event, longer than the active time of polling')
+    parser.add_argument('--typing-gap', metavar='SECONDS', type=float, default=0.15, help='Time between events of a burst')
+    parser.add_argument('--stub', action='store_true', help='Do not use Tk even if there is a display')
+    return parser
+
+
+def main() -> None:
+    args = create_parser().parse_args()
+    use_tk = not args.stub and bool(os.environ.get('DISPLAY'))
+    print(f'{"real Tk window" if use_tk else "stub without Tk, the cost of Tk itself is not included"}')
+    print(f'{"idle interval ms":>16} {"wakeups/s":>10} {"idle CPU %":>10} {"first event p50/p99 ms":>23} {"burst p50/p99 ms":>17}')
+    for idle_interval in args.idle_intervals:
+        app = TkApp() if use_tk else StubApp()
+        try:
+            report = asyncio.run(measure(app, idle_interval, args.idle_time, args.events, args.pause, args.typing_gap))
+        finally:
+            app.destroy()
+        print(
+            f'{report.idle_interval * 1000:>16.1f} {report.wakeups_per_second:>10.1f} {report.cpu_percent:>10.2f} '
+            f'{format_delays(report.first_event_delays):>23} {format_delays(report.burst_event_delays):>17}'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+"""
+Registers many chat accounts at once without a window.
+
+    $ python bulk_register.py nicknames.txt --output accounts.json --concurrency 20
+
+The JSON output can be passed to `main.py --accounts` as is.
+"""
+import argparse
+import asyncio
+import csv
+import io
+import json
+import logging
+import os
+import sys
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+import defaults
+from common_tools import connect, parse_server
+from exceptions import MinechatException
+from queues import BoundedQueue, OverflowPolicy
+from settings import parse_non_negative_int, parse_positive_int
+from states import SendingConnectionStateChanged
+from watchdog import Backoff
+from write_client import register
+
+OUTPUT_FORMATS = ('json', 'csv')
+
+
+class Registration(NamedTuple):
+    nickname: str
+    token: Optional[str] = None
+    server_nickname: Optional[str] = None  # the server may change a requested nickname
+    error: Optional[str] = None
+
+
+def read_nicknames(path: str) -> List[str]:
+    """Reads one nickname per line, empty lines, comments and repeated nicknames are skipped."""
+    try:
+        with open(path, mode='r', encoding='utf-8') as f:
+            nicknames = [line.strip() for line in f]
+    except OSError:
+        raise MinechatException(
+            title='Не удаётся открыть файл',
+            message=f'Не могу прочитать ники из файла {path}.',
+        )
+    return list(dict.fromkeys(nickname for nickname in nicknames if nickname and not nickname.startswith('#')))
+
+
+async def register_nickname(
+        host: str,
+        port: int,
+        nickname: str,
+        retries: int = 3,
+        timeout: float = 10.0,
+        backoff: Optional[Backoff] = None,
+        connections: Optional[asyncio.Semaphore] = None,
+) -> Registration:
+    """
+    Registers a nickname, failed attempts are repeated with growing delays.
+
+    Every attempt holds a slot of `connections`, so other nicknames use it while this one waits to retry.
+    """
+    if backoff is None:
+        backoff = Backoff(initial_delay=0.5, max_delay=10.0)
+    if connections is None:
+        connections = asyncio.Semaphore()
+    # connection states are not shown anywhere, so only the latest one is kept
+    status_queue = BoundedQueue('status', 1, OverflowPolicy.DROP_OLDEST)
+    # a nickname without a single attempt is not registered either
+    error = 'no attempts made'
+    for attempt in range(retries + 1):
+        if attempt:
+            await asyncio.sleep(backoff.next_delay())
+        try:
+            async with connections:
+                async with connect(host, port, status_queue, SendingConnectionStateChanged, timeout) as (reader, writer):
+                    response = await asyncio.wait_for(register(reader, writer, nickname), timeout)
+            return Registration(nickname, response['account_hash'], response.get('nickname'))
+        except (ConnectionError, asyncio.TimeoutError) as e:
+            error = f'connection failed: {e!r}'
+        except MinechatException as e:
+            error = e.title
+        except (KeyError, TypeError):
+            error = 'server has not sent a token'
+        logging.debug(f'Attempt {attempt + 1} to register {nickname} failed: {error}')
+    return Registration(nickname, error=error)
+
+
+async def register_nicknames(
+        host: str,
+        port: int,
+        nicknames: Iterable[str],
+        concurrency: int = 10,
+        retries: int = 3,
+        timeout: float = 10.0,
+) -> List[Registration]:
+    """Registers nicknames concurrently, no more than `concurrency` connections are open at once."""
+    connections = asyncio.Semaphore(concurrency)
+
+    async def register_with_limit(nickname: str) -> Registration:
+        try:
+            registration = await register_nickname(host, port, nickname, retries, timeout, None, connections)
+        except asyncio.CancelledError:
+            # it is an Exception before Python 3.8
+            raise
+        except Exception as e:
+            # one broken registration must not lose tokens of the others
+            logging.exception(f'Unexpected error while registering {nickname}')
+            registration = Registration(nickname, error=f'unexpected error: {e!r}')
+        if registration.error:
+            logging.warning(f'Can not register {nickname}: {registration.error}')
+        else:
+            logging.info(f'Registered {nickname}')
+        return registration
+
+    return list(await asyncio.gather(*(register_with_limit(nickname) for nickname in nicknames)))
+
+
+def format_registrations(registrations: Iterable[Registration], output_format: str) -> str:
+    """Formats successful registrations, JSON entries look like entries of an accounts file."""
+    succeeded = [registration for registration in registrations if registration.token]
+    if output_format == 'json':
+        entries: List[Dict[str, Optional[str]]] = [
+            {'name': registration.nickname, 'nickname': registration.server_nickname, 'token': registration.token}
+            for registration in succeeded
+        ]
+        return json.dumps(entries, ensure_ascii=False, indent=2) + '\n'
+    output = io.StringIO()
+    writer = csv.writer(output, lineterminator='\n')
+    writer.writerow(['nickname', 'server_nickname', 'token'])
+    writer.writerows(
+        [registration.nickname, registration.server_nickname or '', registration.token]
+        for registration in succeeded
+    )
+    return output.getvalue()
+
+
+def write_registrations(path: str, registrations: Iterable[Registration], output_format: str) -> None:
+    """Writes all tokens with a single atomic replace, so a crash never leaves a half-written file."""
+    tmp_path = f'{path}.tmp'
+    try:
+        with open(tmp_path, mode='w', encoding='utf-8', newline='') as f:
+            f.write(format_registrations(registrations, output_format))
+        os.replace(tmp_path, path)
+    except OSError:
+        raise MinechatException(
+            title='Не удаётся открыть файл',
+            message=f'Не могу записать токены в файл {path}.',
+        )
+
+
+def create_bulk_register_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser('Minechat bulk registration')
+    parser.add_argument('nicknames', metavar='FILEPATH', type=str, help='File with one nickname per line')
+    parser.add_argument('--output', metavar='FILEPATH', type=str, default='accounts.json', help='Where to write tokens')
+    parser.add_argument('--format', type=str, choices=OUTPUT_FORMATS, help='Output format, guessed from the output file extension by default')
+    parser.add_argument('--server', metavar='HOST:PORT', type=parse_server, default=parse_server(f'{defaults.WRITE_HOST}:{defaults.WRITE_PORT}'), help='Chat write address')
+    parser.add_argument('--concurrency', type=parse_positive_int, default=10, help='How many registrations run at once')
+    parser.add_argument('--retries', type=parse_non_negative_int, default=3, help='How many times to repeat a failed registration')
+    parser.add_argument('--timeout', metavar='SECONDS', type=float, default=10.0, help='Longest wait for a server during one attempt')
+    return parser
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    settings = create_bulk_register_parser().parse_args()
+    output_format = settings.format or ('csv' if settings.output.endswith('.csv') else 'json')
+    try:
+        nicknames = read_nicknames(settings.nicknames)
+        registrations = asyncio.run(register_nicknames(
+            settings.server.host,
+            settings.server.port,
+            nicknames,
+            settings.concurrency,
+            settings.retries,
+            settings.timeout,
+        ))
+        write_registrations(settings.output, registrations, output_format)
+    except MinechatException as e:
+        print(f'{e.title}. {e.message}', file=sys.stderr)
+        sys.exit(1)
+    failed = [registration.nickname for registration in registrations if registration.error]
+    print(f'{len(registrations) - len(failed)} of {len(registrations)} nicknames registered, tokens are saved to {settings.output}')
+    if failed:
+        print(f'Not registered: {", ".join(failed)}', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
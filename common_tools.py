@@ -1,18 +1,31 @@
+import argparse
 import asyncio
 import contextlib
+import logging
 import socket
 from asyncio.streams import StreamReader, StreamWriter
-from typing import AsyncGenerator, Tuple, TypeVar, Type
+from typing import AsyncGenerator, List, NamedTuple, Optional, Tuple, TypeVar, Type
 
 import async_timeout
 
-from gui import (
+from exceptions import MinechatException
+from metrics import Metrics
+from states import (
     ReadConnectionStateChanged,
     SendingConnectionStateChanged,
     NicknameReceived,
 )
 
 
+def parse_server(value: str) -> argparse.Namespace:
+    """Parses a `host:port` address."""
+    host, _, port = value.rpartition(':')
+    try:
+        return argparse.Namespace(host=host, port=int(port))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'Expected host:port, got {value}')
+
+
 def sanitize_message(message: str) -> str:
     """
     Clears message from the new line symbols.
@@ -24,18 +37,200 @@ def sanitize_message(message: str) -> str:
     return f'{cleared}\n'
 
 
+def check_eof(chat_data: bytes) -> None:
+    """Empty bytes string from `readline` means that server has closed the connection."""
+    if not chat_data:
+        raise ConnectionError('Connection closed by server')
+
+
+def check_writable(writer: StreamWriter) -> None:
+    """Raises ConnectionError instead of writing into a closed connection."""
+    if writer.is_closing():
+        raise ConnectionError('Connection is closed')
+
+
 async def read_line_from_chat(reader: StreamReader) -> str:
-    """Grabs bytes string from connection and decode it into text."""
+    """Grabs bytes string from connection and decode it into text, invalid UTF-8 is replaced."""
     chat_data = await reader.readline()
-    return chat_data.decode(encoding='utf-8').strip()
+    check_eof(chat_data)
+    return chat_data.decode(encoding='utf-8', errors='replace').strip()
+
+
+class ChatLineParser:
+    """
+    Splits a byte stream into decoded lines, many lines are decoded at once.
+
+    Bytes after the last newline stay in the buffer until the next chunk.
+    Invalid UTF-8 is replaced with U+FFFD instead of breaking the connection.
+    A line longer than `max_line_size` is cut, so a peer without newlines can not exhaust memory.
+    """
+
+    def __init__(self, max_line_size: int = 64 * 1024) -> None:
+        self.max_line_size = max_line_size
+        self.decode_errors = 0
+        self._buffer = bytearray()
+
+    def feed(self, data: bytes) -> List[str]:
+        """Adds a chunk of data and returns lines completed by it, without surrounding whitespace."""
+        self._buffer += data
+        end = self._buffer.rfind(b'\n') + 1
+        if not end:
+            if len(self._buffer) < self.max_line_size:
+                return []
+            end = len(self._buffer)
+        with memoryview(self._buffer) as view, view[:end] as complete:
+            text = self._decode(complete)
+        del self._buffer[:end]
+        lines = text.split('\n')
+        if lines[-1] == '':
+            lines.pop()
+        return [line.strip() for line in lines]
+
+    def _decode(self, data: memoryview) -> str:
+        try:
+            return str(data, encoding='utf-8')
+        except UnicodeDecodeError:
+            self.decode_errors += 1
+            if self.decode_errors == 1 or self.decode_errors % 1000 == 0:
+                logging.warning(f'Got invalid UTF-8 from chat {self.decode_errors} times, bad bytes are replaced')
+            return str(data, encoding='utf-8', errors='replace')
+
+
+async def read_lines_from_chat(
+        reader: StreamReader,
+        parser: ChatLineParser,
+        chunk_size: int = 64 * 1024,
+        metrics: Optional[Metrics] = None,
+) -> List[str]:
+    """Waits for data and returns all lines which have been received completely, possibly none."""
+    chat_data = await reader.read(chunk_size)
+    check_eof(chat_data)
+    if metrics:
+        metrics.bytes_received.inc(len(chat_data))
+    return parser.feed(chat_data)
 
 
 async def write_line_to_chat(writer: StreamWriter, message: str):
     """Encode message and send it to the server."""
     message = sanitize_message(message).encode(encoding='utf-8')
+    check_writable(writer)
     writer.write(message)
     await writer.drain()
 
+
+class CoalescingWriter:
+    """
+    Combines everything written during one event loop tick into a single write and drain.
+
+    Several coroutines may share one writer. Data written before a flush forms a batch
+    with data of other flushes of the same tick, every flush of the batch returns when
+    it has been drained and raises the error of the write or the drain if they have failed.
+    """
+
+    def __init__(self, writer: StreamWriter, metrics: Optional[Metrics] = None) -> None:
+        self.writer = writer
+        self.metrics = metrics
+        self._buffer = bytearray()
+        self._lock = asyncio.Lock()
+        # resolved when the data which is in the buffer now has been drained
+        self._batch: Optional[asyncio.Future] = None
+
+    def write_line(self, message: str) -> None:
+        self._buffer += sanitize_message(message).encode(encoding='utf-8')
+
+    def write_raw(self, data: bytes) -> None:
+        self._buffer += data
+
+    async def flush(self) -> None:
+        if self._batch is None:
+            self._batch = asyncio.get_running_loop().create_future()
+        batch = self._batch
+        # let other coroutines add their lines during this tick
+        await asyncio.sleep(0)
+        async with self._lock:
+            if batch is self._batch:
+                # nobody has written the batch yet
+                self._batch = None
+                await self._write_batch(batch)
+        await batch
+
+    async def _write_batch(self, batch: asyncio.Future) -> None:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        try:
+            if data:
+                check_writable(self.writer)
+                self.writer.write(data)
+                if self.metrics:
+                    self.metrics.bytes_sent.inc(len(data))
+                await self.writer.drain()
+        except Exception as e:
+            batch.set_exception(e)
+        except BaseException:
+            # cancelled while draining, other flushes of the batch must not take it as sent
+            batch.set_exception(ConnectionError('Write has been cancelled'))
+            # the error is retrieved here, as nobody may wait for the batch
+            batch.exception()
+            raise
+        else:
+            batch.set_result(None)
+
+
+class SocketOptions(NamedTuple):
+    """
+    TCP tuning of chat connections.
+
+    Keepalive lets the kernel find a dead peer on the read channel which has no pings.
+    Zero values keep system defaults. `user_timeout` is in milliseconds.
+    """
+    nodelay: bool = True
+    keepalive: bool = True
+    keepidle: int = 30
+    keepintvl: int = 10
+    keepcnt: int = 3
+    user_timeout: int = 0
+    rcvbuf: int = 0
+    sndbuf: int = 0
+
+
+def _set_socket_option(sock: socket.socket, level: int, option: int, value: int, setting: str) -> None:
+    try:
+        sock.setsockopt(level, option, value)
+    except OSError as e:
+        raise MinechatException(
+            title='Неверная настройка сокета',
+            message=f'Система не приняла значение {value} настройки {setting}: {e.strerror}.',
+        )
+
+
+def apply_socket_options(sock: socket.socket, options: SocketOptions) -> None:
+    """
+    Sets socket options, the ones unknown to the platform are skipped.
+
+    A value refused by the system raises MinechatException naming the setting.
+    """
+    if options.nodelay:
+        _set_socket_option(sock, socket.IPPROTO_TCP, socket.TCP_NODELAY, 1, '--tcp-nodelay')
+    if options.keepalive:
+        _set_socket_option(sock, socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1, '--tcp-keepalive')
+        tcp_options = (
+            # macOS calls idle time option TCP_KEEPALIVE
+            (getattr(socket, 'TCP_KEEPIDLE', getattr(socket, 'TCP_KEEPALIVE', None)), options.keepidle, '--tcp-keepidle'),
+            (getattr(socket, 'TCP_KEEPINTVL', None), options.keepintvl, '--tcp-keepintvl'),
+            (getattr(socket, 'TCP_KEEPCNT', None), options.keepcnt, '--tcp-keepcnt'),
+        )
+        for option, value, setting in tcp_options:
+            if option is not None and value:
+                _set_socket_option(sock, socket.IPPROTO_TCP, option, value, setting)
+    user_timeout_option = getattr(socket, 'TCP_USER_TIMEOUT', None)
+    if user_timeout_option is not None and options.user_timeout:
+        _set_socket_option(sock, socket.IPPROTO_TCP, user_timeout_option, options.user_timeout, '--tcp-user-timeout')
+    if options.rcvbuf:
+        _set_socket_option(sock, socket.SOL_SOCKET, socket.SO_RCVBUF, options.rcvbuf, '--socket-rcvbuf')
+    if options.sndbuf:
+        _set_socket_option(sock, socket.SOL_SOCKET, socket.SO_SNDBUF, options.sndbuf, '--socket-sndbuf')
+
+
 StateChangeEnum = TypeVar('StateChangeEnum', ReadConnectionStateChanged, SendingConnectionStateChanged)
 
 @contextlib.asynccontextmanager
@@ -45,6 +240,7 @@ async def connect(
         status_update_queue: asyncio.Queue,
         gui_state_class: Type[StateChangeEnum],
         timeout: float = 1.0,
+        socket_options: Optional[SocketOptions] = None,
 ) -> AsyncGenerator[Tuple[StreamReader, StreamWriter], None]:
     """Create connection and send status into queue."""
     try:
@@ -53,9 +249,16 @@ async def connect(
         try:
             async with async_timeout.timeout(timeout):
                 reader, writer = await asyncio.open_connection(host, port)
-        except (asyncio.TimeoutError, ConnectionRefusedError, socket.gaierror):
+        except (asyncio.TimeoutError, OSError):
             raise ConnectionError
 
+        if socket_options:
+            try:
+                apply_socket_options(writer.get_extra_info('socket'), socket_options)
+            except MinechatException:
+                writer.close()
+                raise
+
         await status_update_queue.put(gui_state_class.ESTABLISHED)
 
         try:
@@ -65,4 +268,5 @@ async def connect(
             await writer.wait_closed()
     finally:
         await status_update_queue.put(gui_state_class.CLOSED)
-        await status_update_queue.put(NicknameReceived('неизвестно'))
+        if gui_state_class is SendingConnectionStateChanged:
+            await status_update_queue.put(NicknameReceived('неизвестно'))
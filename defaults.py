@@ -4,6 +4,47 @@ READ_PORT = 5000
 WRITE_HOST = 'minechat.dvmn.org'
 WRITE_PORT = 5050
 HISTORY_PATH = 'minechat.history'
+HISTORY_RESTORE_LINES = 100
+HISTORY_FLUSH_INTERVAL = 0.5
+HISTORY_ROTATE_SIZE = 0  # bytes, 0 means no size limit
+HISTORY_ROTATE_DAILY = False
+HISTORY_COMPRESSION = 'gzip'
 TOKEN_PATH = 'my-token.txt'
+SPOOL_PATH = 'minechat.spool'
+# a silent write channel is noticed within idle + min timeout + 0.25 s check, about 2 s
+HEALTHCHECK_IDLE = 1.5
+HEALTHCHECK_MIN_TIMEOUT = 0.5
+HEALTHCHECK_MAX_TIMEOUT = 10.0
+RECONNECT_MIN_DELAY = 0.5
+RECONNECT_MAX_DELAY = 30.0
+READ_TIMEOUT = 0  # seconds without messages before reconnect, 0 disables the check
+# queue limits in SIZE:POLICY format, policies are block, drop_oldest, drop_newest, coalesce,
+# messages and history queues support only block and drop_oldest
+MESSAGES_QUEUE = '1000:drop_oldest'
+SENDING_QUEUE = '100:block'
+STATUS_QUEUE = '100:coalesce'
+HISTORY_QUEUE = '10000:block'
+TCP_NODELAY = True
+TCP_KEEPALIVE = True
+TCP_KEEPIDLE = 30
+TCP_KEEPINTVL = 10
+TCP_KEEPCNT = 3
+TCP_USER_TIMEOUT = 0  # milliseconds, 0 keeps system default
+SOCKET_RCVBUF = 0  # bytes, 0 keeps system default
+SOCKET_SNDBUF = 0
+BLOCK_NICKNAMES = ['Vlad', 'Eva']  # chat bots
+ALLOW_NICKNAMES: list = []
+BLOCK_PATTERNS: list = []
+BLOCK_KEYWORDS: list = []
+HEADLESS = False
+HEADLESS_OUTPUT = '-'  # standard output
+HEADLESS_INPUT = '-'  # standard input
+RENDER_LINES_PER_FRAME = 100
+SCROLLBACK_LINES = 1000
+TK_IDLE_INTERVAL = 0.05
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 0  # 0 disables the endpoint
+METRICS_DUMP_PATH = ''  # empty path disables the dump
+METRICS_DUMP_INTERVAL = 10.0
 LOGLEVEL = 'INFO'
 POSSIBLE_LOGLEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR')
\ No newline at end of file
@@ -14,3 +14,7 @@ class InvalidToken(MinechatException):
 
 class UnknownError(MinechatException):
     pass
+
+
+class TkAppClosed(Exception):
+    pass
@@ -0,0 +1,235 @@
+"""
+Local stand-in for minechat servers, used for load tests and benchmarks.
+
+The read port broadcasts chat messages, the write port authenticates, registers
+and accepts messages the same way as the real chat does.
+
+    $ python fake_server.py --read-port 5000 --write-port 5050 --token secret --rate 100
+    $ python main.py --read-host localhost --write-host localhost --token secret
+"""
+import argparse
+import asyncio
+import json
+import logging
+import re
+import time
+import uuid
+from asyncio.streams import StreamReader, StreamWriter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+GREETING = b'Hello %username%! Enter your personal hash or leave it empty to create new account.\n'
+ASK_NICKNAME = b'Enter preferred nickname below:\n'
+WELCOME = b'Welcome to chat! Post your message below. End it with an empty line.\n'
+MESSAGE_SENT = b'Message send. Write more, end message with an empty line.\n'
+
+# generated messages carry a number and a send time, so a receiver can measure latency
+LOAD_MESSAGE_PATTERN = re.compile(r'load (\d+) (\d+\.\d+)')
+
+
+def format_load_message(number: int, sent_at: float, padding: int = 0) -> str:
+    return f'load {number} {sent_at:.6f}{" " + "x" * padding if padding else ""}'
+
+
+def parse_load_message(text: str) -> Optional[Tuple[int, float]]:
+    """Finds a number and a send time of a generated message in any line containing it."""
+    match = LOAD_MESSAGE_PATTERN.search(text)
+    if not match:
+        return None
+    return int(match.group(1)), float(match.group(2))
+
+
+class FakeChatServer:
+    """
+    Serves both chat ports in the current event loop.
+
+    Messages posted to the write port are broadcast to every reader like in the real chat.
+    Ports are picked by the system when they are 0, actual ports are known after `start`.
+    """
+
+    def __init__(
+            self,
+            host: str = '127.0.0.1',
+            read_port: int = 0,
+            write_port: int = 0,
+            tokens: Optional[Dict[str, str]] = None,
+    ) -> None:
+        self.host = host
+        self.read_port = read_port
+        self.write_port = write_port
+        self.tokens: Dict[str, str] = dict(tokens or {})  # token -> nickname
+        self.readers: Set[StreamWriter] = set()
+        self.broadcast_lines = 0
+        self.posted_messages = 0
+        self._servers: List[asyncio.AbstractServer] = []
+        self._connections: Dict[StreamWriter, asyncio.Task] = {}
+
+    async def start(self) -> None:
+        read_server = await asyncio.start_server(self.handle_reader, self.host, self.read_port)
+        write_server = await asyncio.start_server(self.handle_writer, self.host, self.write_port)
+        self._servers = [read_server, write_server]
+        self.read_port = read_server.sockets[0].getsockname()[1]
+        self.write_port = write_server.sockets[0].getsockname()[1]
+
+    async def close(self) -> None:
+        """Stops listening and waits until every connection is closed."""
+        for server in self._servers:
+            server.close()
+        handlers = list(self._connections.values())
+        for writer in list(self._connections):
+            writer.close()
+        await asyncio.gather(*handlers, return_exceptions=True)
+        for server in self._servers:
+            await server.wait_closed()
+        self._servers = []
+
+    def _track_connection(self, writer: StreamWriter) -> None:
+        task = asyncio.current_task()
+        # connection handlers always run in a task of the server
+        assert task is not None
+        self._connections[writer] = task
+
+    async def __aenter__(self) -> 'FakeChatServer':
+        await self.start()
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.close()
+
+    def register(self, nickname: str) -> Dict[str, str]:
+        token = uuid.uuid4().hex
+        self.tokens[token] = nickname
+        return {'nickname': nickname, 'account_hash': token}
+
+    async def broadcast(self, lines: Iterable[str]) -> None:
+        """Sends lines to every reader and waits until slow readers catch up."""
+        lines = list(lines)
+        if not lines:
+            return
+        data = ''.join(f'{line}\n' for line in lines).encode('utf-8')
+        readers = list(self.readers)
+        for writer in readers:
+            writer.write(data)
+        self.broadcast_lines += len(lines)
+        await asyncio.gather(*(writer.drain() for writer in readers), return_exceptions=True)
+
+    async def handle_reader(self, reader: StreamReader, writer: StreamWriter) -> None:
+        self._track_connection(writer)
+        self.readers.add(writer)
+        try:
+            # readers never send anything, the end of input means the client is gone
+            while await reader.read(1024):
+                pass
+        except ConnectionError:
+            pass
+        finally:
+            self.readers.discard(writer)
+            self._connections.pop(writer, None)
+            writer.close()
+
+    async def handle_writer(self, reader: StreamReader, writer: StreamWriter) -> None:
+        self._track_connection(writer)
+        try:
+            writer.write(GREETING)
+            token = (await reader.readline()).decode('utf-8', errors='replace').strip()
+            if not token:
+                writer.write(ASK_NICKNAME)
+                nickname = (await reader.readline()).decode('utf-8', errors='replace').strip()
+                writer.write(json.dumps(self.register(nickname or 'anonymous')).encode('utf-8') + b'\n')
+                await writer.drain()
+                return
+            if token not in self.tokens:
+                writer.write(b'null\n')
+                await writer.drain()
+                return
+            nickname = self.tokens[token]
+            writer.write(json.dumps({'nickname': nickname, 'account_hash': token}).encode('utf-8') + b'\n')
+            writer.write(WELCOME)
+            await self.receive_messages(nickname, reader, writer)
+        except ConnectionError:
+            pass
+        finally:
+            self._connections.pop(writer, None)
+            writer.close()
+
+    async def receive_messages(self, nickname: str, reader: StreamReader, writer: StreamWriter) -> None:
+        """Collects lines until an empty one, every empty line is answered, so it works as a ping."""
+        message_lines: List[str] = []
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            text = line.decode('utf-8', errors='replace').strip()
+            if text:
+                message_lines.append(text)
+                continue
+            if message_lines:
+                self.posted_messages += 1
+                await self.broadcast([f'{nickname}: {" ".join(message_lines)}'])
+                message_lines = []
+            writer.write(MESSAGE_SENT)
+            await writer.drain()
+
+
+async def generate_load(
+        server: FakeChatServer,
+        rate: float,
+        duration: float,
+        nicknames: Iterable[str] = ('Steve', 'Alex'),
+        padding: int = 0,
+        tick: float = 0.01,
+) -> int:
+    """
+    Broadcasts generated messages at `rate` messages per second for `duration` seconds, 0 means forever.
+
+    Messages due since the previous tick are sent in one write, so high rates are reachable.
+    Returns how many messages have been sent.
+    """
+    nicknames = list(nicknames)
+    started_at = time.monotonic()
+    sent = 0
+    while True:
+        elapsed = time.monotonic() - started_at
+        if duration and elapsed >= duration:
+            return sent
+        due = int(elapsed * rate) + 1 - sent
+        if due > 0:
+            now = time.time()
+            await server.broadcast(
+                f'{nicknames[number % len(nicknames)]}: {format_load_message(number, now, padding)}'
+                for number in range(sent, sent + due)
+            )
+            sent += due
+        await asyncio.sleep(tick)
+
+
+def create_fake_server_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser('Local minechat server')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--read-port', type=int, default=5000, help='Port of the read server')
+    parser.add_argument('--write-port', type=int, default=5050, help='Port of the write server')
+    parser.add_argument('--token', type=str, action='append', default=[], help='Token which is accepted without registration, may be repeated')
+    parser.add_argument('--rate', type=float, default=0, help='Generated messages per second, 0 disables generation')
+    parser.add_argument('--padding', type=int, default=0, help='Extra characters added to every generated message')
+    return parser
+
+
+async def serve(settings: argparse.Namespace) -> None:
+    tokens = {token: f'user{number}' for number, token in enumerate(settings.token, start=1)}
+    async with FakeChatServer(settings.host, settings.read_port, settings.write_port, tokens) as server:
+        logging.info(f'Reading on {server.host}:{server.read_port}, writing on {server.host}:{server.write_port}')
+        if settings.rate:
+            await generate_load(server, settings.rate, duration=0, padding=settings.padding)
+        else:
+            await asyncio.Event().wait()
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    try:
+        asyncio.run(serve(create_fake_server_parser().parse_args()))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,280 @@
+"""
+TCP proxy which breaks a chat connection on purpose, used to test reconnects.
+
+Faults are applied to all connections going through the proxy:
+
+* `drop` closes connections, new ones are closed right after they are accepted;
+* `stall` stops forwarding data in both directions, sockets stay open;
+* `half_close` sends the end of data to the client, data from the client is still forwarded;
+* `slow` forwards data with a limited bandwidth and a delay.
+
+    $ python fault_proxy.py --target minechat.dvmn.org:5000 --port 15000 --schedule 10:stall:20 40:drop:5
+"""
+import argparse
+import asyncio
+import enum
+import logging
+import time
+from asyncio.streams import StreamReader, StreamWriter
+from typing import TYPE_CHECKING, Iterable, List, Mapping, NamedTuple, Optional, Set
+
+from common_tools import parse_server
+
+if TYPE_CHECKING:
+    from typing import Protocol
+else:
+    # typing.Protocol appeared in Python 3.8, it is needed only for type checks
+    Protocol = object
+
+CHUNK_SIZE = 16 * 1024
+
+
+class Fault(enum.Enum):
+    NONE = 'none'
+    DROP = 'drop'
+    STALL = 'stall'
+    HALF_CLOSE = 'half_close'
+    SLOW = 'slow'
+
+
+class FaultStep(NamedTuple):
+    at: float  # seconds since the schedule start
+    fault: Fault
+    duration: float
+    channel: str = ''  # name of a broken proxy, all proxies are broken when it is empty
+
+
+def parse_fault_step(value: str) -> FaultStep:
+    """Parses `AT:FAULT:DURATION` or `AT:CHANNEL:FAULT:DURATION`, e.g. `5:read:stall:10`."""
+    parts = value.split(':')
+    try:
+        if len(parts) == 3:
+            at, fault, duration = parts
+            channel = ''
+        else:
+            at, channel, fault, duration = parts
+        return FaultStep(float(at), Fault(fault), float(duration), channel)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f'Expected AT:FAULT:DURATION or AT:CHANNEL:FAULT:DURATION with a fault one of '
+            f'{", ".join(fault.value for fault in Fault)}, got {value}'
+        )
+
+
+class FaultProxy:
+    """
+    Forwards connections to `target_host:target_port` until a fault is set.
+
+    The listening port is picked by the system when it is 0, the actual port is known after `start`.
+    Must be created inside a running event loop.
+    """
+
+    def __init__(
+            self,
+            target_host: str,
+            target_port: int,
+            host: str = '127.0.0.1',
+            port: int = 0,
+            slow_bandwidth: int = 1024,
+            slow_delay: float = 0.5,
+    ) -> None:
+        self.target_host = target_host
+        self.target_port = target_port
+        self.host = host
+        self.port = port
+        self.slow_bandwidth = slow_bandwidth  # bytes per second
+        self.slow_delay = slow_delay  # seconds added to every forwarded chunk
+        self.fault = Fault.NONE
+        self.connections = 0
+        self.forwarded_bytes = 0
+        self._clients: Set[StreamWriter] = set()
+        self._upstreams: Set[StreamWriter] = set()
+        self._half_closed: Set[StreamWriter] = set()
+        self._handlers: Set[asyncio.Task] = set()
+        self._flowing = asyncio.Event()
+        self._flowing.set()
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def close(self) -> None:
+        """Stops listening and waits until every connection is closed."""
+        if self._server is None:
+            return
+        self._server.close()
+        self._close_connections()
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+        await self._server.wait_closed()
+        self._server = None
+
+    async def __aenter__(self) -> 'FaultProxy':
+        await self.start()
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.close()
+
+    def set_fault(self, fault: Fault) -> None:
+        logging.debug(f'Proxy to {self.target_host}:{self.target_port}: {fault.value}')
+        self.fault = fault
+        if fault == Fault.STALL:
+            self._flowing.clear()
+        else:
+            self._flowing.set()
+        if fault == Fault.DROP:
+            self._close_connections()
+        elif fault == Fault.HALF_CLOSE:
+            for writer in self._clients:
+                self._write_eof(writer)
+
+    def clear_fault(self) -> None:
+        self.set_fault(Fault.NONE)
+
+    def _close_connections(self) -> None:
+        for writer in self._clients | self._upstreams:
+            writer.close()
+
+    def _write_eof(self, writer: StreamWriter) -> None:
+        if writer not in self._half_closed and writer.can_write_eof() and not writer.is_closing():
+            writer.write_eof()
+            self._half_closed.add(writer)
+
+    async def handle_client(self, client_reader: StreamReader, client_writer: StreamWriter) -> None:
+        try:
+            upstream_reader, upstream_writer = await asyncio.open_connection(self.target_host, self.target_port)
+        except OSError:
+            client_writer.close()
+            return
+        # the fault may have been set while the target was being connected
+        if self.fault == Fault.DROP:
+            client_writer.close()
+            upstream_writer.close()
+            return
+        self.connections += 1
+        handler = asyncio.current_task()
+        # connection handlers always run in a task of the server
+        assert handler is not None
+        self._handlers.add(handler)
+        self._clients.add(client_writer)
+        self._upstreams.add(upstream_writer)
+        if self.fault == Fault.HALF_CLOSE:
+            self._write_eof(client_writer)
+        try:
+            await asyncio.gather(
+                self.forward(client_reader, upstream_writer),
+                self.forward(upstream_reader, client_writer),
+            )
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self._clients.discard(client_writer)
+            self._upstreams.discard(upstream_writer)
+            self._half_closed.difference_update((client_writer, upstream_writer))
+            self._handlers.discard(handler)
+            client_writer.close()
+            upstream_writer.close()
+
+    async def forward(self, reader: StreamReader, writer: StreamWriter) -> None:
+        while True:
+            chunk_size = CHUNK_SIZE if self.fault != Fault.SLOW else max(1, self.slow_bandwidth // 10)
+            data = await reader.read(chunk_size)
+            if not data:
+                self._write_eof(writer)
+                return
+            await self._flowing.wait()
+            if self.fault == Fault.SLOW:
+                await asyncio.sleep(self.slow_delay + len(data) / self.slow_bandwidth)
+            if writer in self._half_closed:
+                # the peer has already got the end of data, the rest is thrown away
+                continue
+            if writer.is_closing():
+                return
+            writer.write(data)
+            self.forwarded_bytes += len(data)
+            await writer.drain()
+
+
+class Breakable(Protocol):
+    """Anything a schedule can break, like FaultProxy."""
+
+    def set_fault(self, fault: Fault) -> None:
+        ...
+
+    def clear_fault(self) -> None:
+        ...
+
+
+class AppliedFault(NamedTuple):
+    step: FaultStep
+    started_at: float  # time.monotonic()
+    ended_at: float
+
+
+async def run_schedule(
+        proxies: Mapping[str, Breakable],
+        steps: Iterable[FaultStep],
+        applied: Optional[List[AppliedFault]] = None,
+) -> List[AppliedFault]:
+    """
+    Applies faults to named proxies at the scheduled moments and clears them after their duration.
+
+    Steps are applied one after another, a step starting before the previous one ends waits for it.
+    Applied faults are appended to `applied` as soon as they end, so they are known after cancellation.
+    """
+    if applied is None:
+        applied = []
+    started_at = time.monotonic()
+    for step in sorted(steps, key=lambda step: step.at):
+        await asyncio.sleep(max(0.0, started_at + step.at - time.monotonic()))
+        broken = [proxy for name, proxy in proxies.items() if not step.channel or step.channel == name]
+        fault_started_at = time.monotonic()
+        for proxy in broken:
+            proxy.set_fault(step.fault)
+        try:
+            await asyncio.sleep(step.duration)
+        finally:
+            for proxy in broken:
+                proxy.clear_fault()
+        applied.append(AppliedFault(step, fault_started_at, time.monotonic()))
+    return applied
+
+
+def create_fault_proxy_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser('Minechat fault injection proxy')
+    parser.add_argument('--target', metavar='HOST:PORT', type=parse_server, required=True, help='Address connections are forwarded to')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, required=True, help='Port to listen on')
+    parser.add_argument('--schedule', metavar='AT:FAULT:DURATION', type=parse_fault_step, nargs='*', default=[], help='Faults to apply, time is in seconds since the start')
+    parser.add_argument('--slow-bandwidth', metavar='BYTES', type=int, default=1024, help='Bytes per second forwarded during a slow fault')
+    parser.add_argument('--slow-delay', metavar='SECONDS', type=float, default=0.5, help='Delay of every chunk during a slow fault')
+    return parser
+
+
+async def serve(settings: argparse.Namespace) -> None:
+    proxy = FaultProxy(
+        settings.target.host,
+        settings.target.port,
+        settings.host,
+        settings.port,
+        settings.slow_bandwidth,
+        settings.slow_delay,
+    )
+    async with proxy:
+        logging.info(f'Forwarding {proxy.host}:{proxy.port} to {proxy.target_host}:{proxy.target_port}')
+        for applied in await run_schedule({'': proxy}, settings.schedule):
+            logging.info(f'{applied.step.fault.value} lasted {applied.ended_at - applied.started_at:.1f} s')
+        await asyncio.Event().wait()
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    try:
+        asyncio.run(serve(create_fault_proxy_parser().parse_args()))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
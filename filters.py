@@ -0,0 +1,88 @@
+import argparse
+import logging
+import re
+from collections import Counter
+from typing import Iterable, List, Optional, Pattern
+
+from message_bus import Message
+
+
+def parse_pattern(value: str) -> str:
+    """Checks that a filter rule is a valid regular expression."""
+    try:
+        re.compile(value)
+    except re.error as e:
+        raise argparse.ArgumentTypeError(f'Wrong regular expression {value}: {e}')
+    return value
+
+
+class MessageFilter:
+    """
+    Drops unwanted chat messages before they reach the GUI and the history.
+
+    Nickname lists are compared case-insensitively. When `allow_nicknames` is not empty,
+    only these users are shown, messages without a nickname always pass the allowlist.
+    Patterns and keywords are searched in the whole line `Nickname: text`, they are compiled
+    once into a single regular expression, keywords match whole words in any case.
+    Every rule counts how many messages it has dropped.
+    """
+
+    def __init__(
+            self,
+            block_nicknames: Iterable[str] = (),
+            allow_nicknames: Iterable[str] = (),
+            block_patterns: Iterable[str] = (),
+            block_keywords: Iterable[str] = (),
+    ) -> None:
+        self.block_nicknames = {nickname.casefold() for nickname in block_nicknames}
+        self.allow_nicknames = {nickname.casefold() for nickname in allow_nicknames}
+        self.hits: Counter = Counter()
+        self.dropped = 0
+        self._rules: List[str] = []
+        alternatives = []
+        for pattern in block_patterns:
+            alternatives.append(self._add_rule(f'pattern:{pattern}', pattern))
+        for keyword in block_keywords:
+            alternatives.append(self._add_rule(f'keyword:{keyword}', rf'(?i:\b{re.escape(keyword)}\b)'))
+        self._matcher: Optional[Pattern] = re.compile('|'.join(alternatives)) if alternatives else None
+
+    def _add_rule(self, name: str, pattern: str) -> str:
+        group = f'rule{len(self._rules)}'
+        self._rules.append(name)
+        return f'(?P<{group}>{pattern})'
+
+    def __bool__(self) -> bool:
+        return bool(self.block_nicknames or self.allow_nicknames or self._matcher)
+
+    def match(self, message: Message) -> Optional[str]:
+        """Returns a name of the rule which drops the message, the one matched earliest in the line wins."""
+        if message.nickname:
+            nickname = message.nickname.casefold()
+            if nickname in self.block_nicknames:
+                return f'nickname:{nickname}'
+            if self.allow_nicknames and nickname not in self.allow_nicknames:
+                return 'allowlist'
+        if self._matcher:
+            found = self._matcher.search(message.text)
+            if found:
+                # every rule is a named group, so the match always has one
+                assert found.lastgroup is not None
+                return self._rules[int(found.lastgroup[len('rule'):])]
+        return None
+
+    def apply(self, messages: Iterable[Message]) -> List[Message]:
+        """Returns messages which pass all rules."""
+        passed = []
+        for message in messages:
+            rule = self.match(message)
+            if rule is None:
+                passed.append(message)
+                continue
+            self.hits[rule] += 1
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                logging.debug(f'{self.dropped} messages filtered out: {self.format_hits()}')
+        return passed
+
+    def format_hits(self) -> str:
+        return ', '.join(f'{rule} {hits}' for rule, hits in self.hits.most_common())
@@ -1,65 +1,169 @@
+import _tkinter
 import asyncio
 import tkinter as tk
-from enum import Enum
+from collections import deque
+from typing import Deque
 from tkinter.scrolledtext import ScrolledText
 
 from anyio import create_task_group
 
-
-class TkAppClosed(Exception):
-    pass
-
-
-class ReadConnectionStateChanged(Enum):
-    INITIATED = 'устанавливаем соединение'
-    ESTABLISHED = 'соединение установлено'
-    CLOSED = 'соединение закрыто'
-
-    def __str__(self):
-        return str(self.value)
-
-
-class SendingConnectionStateChanged(Enum):
-    INITIATED = 'устанавливаем соединение'
-    ESTABLISHED = 'соединение установлено'
-    CLOSED = 'соединение закрыто'
-
-    def __str__(self):
-        return str(self.value)
-
-
-class NicknameReceived:
-    def __init__(self, nickname):
-        self.nickname = nickname
+from exceptions import TkAppClosed
+from states import NicknameReceived, ReadConnectionStateChanged, SendingConnectionStateChanged
 
 
 def process_new_message(input_field, sending_queue):
     text = input_field.get()
-    sending_queue.put_nowait(text)
+    try:
+        sending_queue.put_nowait(text)
+    except asyncio.QueueFull:
+        # keep the text in the field, so user can try to send it later
+        return
     input_field.delete(0, tk.END)
 
 
-async def update_tk(root_frame, interval=1 / 120):
+async def update_tk(root_frame, interval=1 / 120, idle_interval=1 / 20, active_time=1.0):
+    """
+    Processes Tk events from the asyncio event loop.
+
+    Events are polled every `interval` seconds until `active_time` passes without events,
+    then the interval doubles after every empty poll up to `idle_interval`. Typing is handled
+    as fast as with constant polling, only the first event after a pause waits up to `idle_interval`.
+    """
+    loop = asyncio.get_running_loop()
+    current_interval = interval
+    last_event_at = loop.time()
     while True:
         try:
-            root_frame.update()
+            has_events = False
+            while root_frame.tk.dooneevent(_tkinter.DONT_WAIT):
+                has_events = True
+            # raises TclError if application has been destroyed/closed
+            root_frame.update_idletasks()
         except tk.TclError:
-            # if application has been destroyed/closed
             raise TkAppClosed()
-        await asyncio.sleep(interval)
-
-
-async def update_conversation_history(panel: ScrolledText, messages_queue):
+        if has_events:
+            current_interval = interval
+            last_event_at = loop.time()
+        elif loop.time() - last_event_at > active_time:
+            current_interval = min(current_interval * 2, idle_interval)
+        await asyncio.sleep(current_interval)
+
+
+def count_lines(panel: ScrolledText) -> int:
+    return int(panel.index('end-1c').split('.')[0])
+
+
+class PanelContents:
+    """
+    Lines of the conversation panel: pages loaded from the history go first, then shown messages.
+
+    Every message takes one line, seqs of shown messages let the history pager find the top one.
+    """
+
+    def __init__(self):
+        self.page_lines = 0
+        self.seqs: Deque[int] = deque()
+        self.trims = 0
+
+    def top_seq(self):
+        """Seq of a message at the top of the panel, None when the top line is a page line."""
+        if self.page_lines or not self.seqs:
+            return None
+        return self.seqs[0]
+
+    def trim(self, lines_count):
+        """Forgets lines dropped from the top of the panel, returns how many of them were page lines."""
+        self.trims += 1
+        page_lines = min(lines_count, self.page_lines)
+        self.page_lines -= page_lines
+        for _ in range(lines_count - page_lines):
+            self.seqs.popleft()
+        return page_lines
+
+
+async def update_conversation_history(
+        panel: ScrolledText,
+        messages_queue,
+        max_lines_per_frame=100,
+        frame_interval=1 / 120,
+        max_lines=1000,
+        history_pager=None,
+        metrics=None,
+        panel_contents=None,
+):
     while True:
-        msg = await messages_queue.get()
+        messages = [await messages_queue.get()]
+        while len(messages) < max_lines_per_frame and not messages_queue.empty():
+            messages.append(messages_queue.get_nowait())
 
         panel['state'] = 'normal'
         if panel.index('end-1c') != '1.0':
             panel.insert('end', '\n')
-        panel.insert('end', msg)
-        if panel.vbar.get()[1] == 1.0:
+        panel.insert('end', '\n'.join(str(message) for message in messages))
+        if panel_contents:
+            panel_contents.seqs.extend(message.seq for message in messages)
+        following = panel.vbar.get()[1] == 1.0
+        if following:
             panel.yview(tk.END)
+
+        # old lines are dropped while user follows the chat, pages loaded from history
+        # are kept until user scrolls back down, but never more than twice the limit
+        excess = count_lines(panel) - max_lines
+        if excess > 0 and (following or excess > max_lines):
+            panel.delete('1.0', f'{excess + 1}.0')
+            if panel_contents:
+                page_lines = panel_contents.trim(excess)
+                top_seq = panel_contents.top_seq()
+                if history_pager:
+                    history_pager.skip(page_lines)
+                    if top_seq is not None:
+                        history_pager.forget_before(top_seq)
         panel['state'] = 'disabled'
+        # draw right away instead of waiting for the next poll of Tk events
+        panel.update_idletasks()
+        if metrics:
+            metrics.messages_shown(messages)
+
+        if not messages_queue.empty():
+            # let Tk draw this frame before the next batch
+            await asyncio.sleep(frame_interval)
+
+
+async def load_older_messages(panel: ScrolledText, history_pager, panel_contents, page_size=100, retry_interval=0.5):
+    """
+    Loads a page of older messages from the history when user scrolls to the top.
+
+    The panel reports scrolling itself, so nothing is polled until its top is shown.
+    While the top stays shown, a page is requested again every `retry_interval` seconds:
+    the top message may be not written to the history yet.
+    """
+    at_top = asyncio.Event()
+
+    def on_scroll(first, last):
+        panel.vbar.set(first, last)
+        if float(first) == 0.0:
+            at_top.set()
+        else:
+            at_top.clear()
+
+    panel['yscrollcommand'] = on_scroll
+    while True:
+        await at_top.wait()
+        trims = panel_contents.trims
+        lines = await history_pager.load_older(page_size, panel_contents.top_seq())
+        if not lines or panel_contents.trims != trims:
+            # nothing to show yet or the top of the panel has changed while the page was loading
+            await asyncio.sleep(retry_interval)
+            continue
+        panel_contents.page_lines += len(lines)
+        text = '\n'.join(lines)
+        panel['state'] = 'normal'
+        if panel.index('end-1c') != '1.0':
+            text += '\n'
+        panel.insert('1.0', text)
+        panel['state'] = 'disabled'
+        # keep the line which user has been looking at in place
+        panel.yview_scroll(len(lines), 'units')
 
 
 async def update_status_panel(status_labels, status_updates_queue):
@@ -80,6 +184,8 @@ async def update_status_panel(status_labels, status_updates_queue):
         if isinstance(msg, NicknameReceived):
             nickname_label['text'] = f'Имя пользователя: {msg.nickname}'
 
+        nickname_label.update_idletasks()
+
 
 def create_status_panel(root_frame):
     status_frame = tk.Frame(root_frame)
@@ -100,7 +206,17 @@ def create_status_panel(root_frame):
     return (nickname_label, status_read_label, status_write_label)
 
 
-async def draw(messages_queue, sending_queue, status_updates_queue):
+async def draw(
+        messages_queue,
+        sending_queue,
+        status_updates_queue,
+        max_lines_per_frame=100,
+        max_lines=1000,
+        history_pager=None,
+        history_page_size=100,
+        tk_idle_interval=1 / 20,
+        metrics=None,
+):
     root = tk.Tk()
 
     root.title('Чат Майнкрафтера')
@@ -125,8 +241,21 @@ async def draw(messages_queue, sending_queue, status_updates_queue):
 
     conversation_panel = ScrolledText(root_frame, wrap='none')
     conversation_panel.pack(side="top", fill="both", expand=True)
+    panel_contents = PanelContents()
 
     async with create_task_group() as nursery:
-        await nursery.spawn(update_tk, root_frame)
-        await nursery.spawn(update_conversation_history, conversation_panel, messages_queue)
+        await nursery.spawn(update_tk, root_frame, 1 / 120, tk_idle_interval)
+        await nursery.spawn(
+            update_conversation_history,
+            conversation_panel,
+            messages_queue,
+            max_lines_per_frame,
+            1 / 120,
+            max_lines,
+            history_pager,
+            metrics,
+            panel_contents,
+        )
+        if history_pager:
+            await nursery.spawn(load_older_messages, conversation_panel, history_pager, panel_contents, history_page_size)
         await nursery.spawn(update_status_panel, status_labels, status_updates_queue)
@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import os
+import stat
+import sys
+from contextlib import contextmanager
+from typing import AsyncIterator, Iterator, Optional, TextIO
+
+from exceptions import MinechatException
+from message_bus import Subscription
+from metrics import Metrics
+from states import NicknameReceived, ReadConnectionStateChanged, SendingConnectionStateChanged
+
+# path which means standard input or output
+STANDARD_STREAM = '-'
+
+
+@contextmanager
+def open_output(path: str) -> Iterator[TextIO]:
+    if path == STANDARD_STREAM:
+        yield sys.stdout
+        return
+    try:
+        f = open(path, mode='a', encoding='utf-8')
+    except (PermissionError, IsADirectoryError, FileNotFoundError):
+        raise MinechatException(
+            title='Не удаётся открыть файл',
+            message=f'Не могу открыть файл {path} для вывода сообщений.',
+        )
+    with f:
+        yield f
+
+
+async def print_messages(
+        messages_queue: Subscription,
+        output_path: str = STANDARD_STREAM,
+        metrics: Optional[Metrics] = None,
+) -> None:
+    """Writes received messages with their time, a batch of messages is flushed at once."""
+    with open_output(output_path) as output:
+        while True:
+            messages = [await messages_queue.get()]
+            while not messages_queue.empty():
+                messages.append(messages_queue.get_nowait())
+            output.write(''.join(f'{message.history_line()}\n' for message in messages))
+            output.flush()
+            if metrics:
+                metrics.messages_shown(messages)
+
+
+def open_input(path: str) -> int:
+    """
+    Opens a file descriptor to read outgoing messages from.
+
+    A FIFO is opened for reading and writing, so it stays open when a writer goes away.
+    """
+    if path == STANDARD_STREAM:
+        return os.dup(sys.stdin.fileno())
+    try:
+        if stat.S_ISFIFO(os.stat(path).st_mode):
+            return os.open(path, os.O_RDWR | os.O_NONBLOCK)
+        return os.open(path, os.O_RDONLY)
+    except OSError:
+        raise MinechatException(
+            title='Не удаётся открыть файл',
+            message=f'Не могу открыть файл {path} для чтения сообщений.',
+        )
+
+
+async def iter_input_lines(fd: int) -> AsyncIterator[bytes]:
+    """Yields lines until the end of input, regular files are read in a thread because they can not be polled."""
+    loop = asyncio.get_running_loop()
+    with open(fd, mode='rb', buffering=0) as f:
+        if stat.S_ISREG(os.fstat(fd).st_mode):
+            lines = await loop.run_in_executor(None, f.readlines)
+            for line in lines:
+                yield line
+            return
+        reader = asyncio.StreamReader()
+        transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), f)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return
+                yield line
+        finally:
+            transport.close()
+
+
+async def read_outgoing_messages(sending_queue: asyncio.Queue, input_path: str = STANDARD_STREAM) -> None:
+    """Sends every non-empty line of input, the client keeps receiving messages when input ends."""
+    async for line in iter_input_lines(open_input(input_path)):
+        message = line.decode(encoding='utf-8', errors='replace').strip()
+        if message:
+            await sending_queue.put(message)
+    logging.info('Input is closed, no more messages will be sent')
+
+
+async def log_status_updates(status_updates_queue: asyncio.Queue, account_name: str = '') -> None:
+    prefix = f'{account_name}: ' if account_name else ''
+    while True:
+        update = await status_updates_queue.get()
+        if isinstance(update, ReadConnectionStateChanged):
+            logging.info(f'{prefix}Read connection {update.name.lower()}')
+        elif isinstance(update, SendingConnectionStateChanged):
+            logging.info(f'{prefix}Sending connection {update.name.lower()}')
+        elif isinstance(update, NicknameReceived):
+            logging.info(f'{prefix}Logged in as {update.nickname}')
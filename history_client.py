@@ -1,37 +1,471 @@
+import argparse
 import asyncio
+import logging
+import os
+import sqlite3
+import time
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from typing import BinaryIO, Deque, Iterator, List, NamedTuple, Optional, Tuple
 
-import aiofiles
-
+import defaults
 from exceptions import MinechatException
+from history_index import HistoryIndex
+from history_rotation import (
+    HistoryFile,
+    compress_segment,
+    finish_rotation,
+    next_segment_number,
+    open_segment,
+    read_manifest,
+    uncompressed_segments,
+)
+from message_bus import Message, MessageBus, Subscription
+from metrics import Metrics
 
+READ_BLOCK_SIZE = 64 * 1024
 
-async def restore_history(
+
+def read_lines_before(
+        f: BinaryIO,
+        lines_count: int,
+        end_offset: Optional[int] = None,
+) -> Tuple[List[str], int]:
+    """
+    Reads up to `lines_count` lines located right before `end_offset`.
+
+    The file is scanned backwards block by block so only the requested tail
+    is read no matter how big the file is.
+    Returns lines (the oldest first) and an offset of the first returned line.
+    """
+    if end_offset is None:
+        end_offset = f.seek(0, os.SEEK_END)
+    if lines_count <= 0 or end_offset <= 0:
+        return [], end_offset
+
+    position = end_offset
+    content = b''
+    while position > 0:
+        step = min(READ_BLOCK_SIZE, position)
+        position -= step
+        f.seek(position)
+        content = f.read(step) + content
+        # one more separator than needed guarantees that the first line is complete
+        if content.rstrip(b'\n').count(b'\n') >= lines_count:
+            break
+
+    content = content.rstrip(b'\n')
+    lines = content.split(b'\n')
+    if position > 0:
+        # the first piece can be a tail of a line which starts before `position`
+        lines = lines[1:]
+    selected = lines[-lines_count:]
+    first_line_offset = position + len(content) - len(b'\n'.join(selected))
+    return [line.decode(encoding='utf-8', errors='replace').strip() for line in selected], first_line_offset
+
+
+def read_history_tail(
         path: str,
-        messages_queue: asyncio.Queue,
-) -> None:
-    """Restore messages from history file."""
+        lines_count: int,
+        end_offset: Optional[int] = None,
+) -> Tuple[List[str], int]:
+    """Reads last lines of a history file. Missing file means empty history."""
     try:
-        async with aiofiles.open(path, mode='r', encoding='utf-8') as f:
-            async for message in f:
-                await messages_queue.put(message.strip())
+        with open(path, mode='rb') as f:
+            return read_lines_before(f, lines_count, end_offset)
     except (FileNotFoundError, PermissionError):
-        pass
+        return [], 0
+
+
+class HistoryPosition(NamedTuple):
+    """
+    Place in the history where older messages start.
+
+    The active file is addressed by the number of a segment it becomes after rotation,
+    so a position stays valid when the file is rotated.
+    """
+    segment: int
+    offset: Optional[int]
+
+
+def read_history_before(
+        path: str,
+        lines_count: int,
+        position: Optional[HistoryPosition] = None,
+) -> Tuple[List[str], HistoryPosition]:
+    """
+    Reads up to `lines_count` lines older than `position` (the end of history by default).
+
+    Closed segments are visited from the newest to the oldest when the active file is too short.
+    """
+    active_segment = next_segment_number(path)
+    segment, end_offset = position or HistoryPosition(active_segment, None)
+    collected: List[str] = []
+    while True:
+        wanted = lines_count - len(collected)
+        if segment >= active_segment:
+            lines, offset = read_history_tail(path, wanted, end_offset)
+        else:
+            f = open_segment(path, segment)
+            if f is None:
+                return collected, HistoryPosition(segment, 0)
+            with f:
+                lines, offset = read_lines_before(f, wanted, end_offset)
+        collected = lines + collected
+        if len(collected) >= lines_count or segment <= 1:
+            return collected, HistoryPosition(segment, offset)
+        segment, end_offset = segment - 1, None
+
+
+def advance_history_position(
+        path: str,
+        position: HistoryPosition,
+        lines_count: int,
+) -> HistoryPosition:
+    """Moves the position `lines_count` lines forward, into newer segments if needed."""
+    active_segment = next_segment_number(path)
+    segment, offset = position.segment, position.offset or 0
+    while lines_count > 0:
+        if segment >= active_segment:
+            try:
+                f: Optional[BinaryIO] = open(path, mode='rb')
+            except FileNotFoundError:
+                f = None
+        else:
+            f = open_segment(path, segment)
+        if f is None:
+            break
+        with f:
+            f.seek(offset)
+            for line in f:
+                offset += len(line)
+                lines_count -= 1
+                if not lines_count:
+                    break
+        if not lines_count or segment >= active_segment:
+            break
+        segment, offset = segment + 1, 0
+    return HistoryPosition(segment, offset)
+
+
+class HistoryMark(NamedTuple):
+    """Messages written to the history with one chunk, their seqs go in the order of lines."""
+    position: HistoryPosition  # where the first line of the chunk starts
+    seqs: List[int]
+
+
+class HistoryPager:
+    """
+    Loads pages of history which are older than the top line of the conversation panel.
+
+    The top line is either a line of a loaded page or a message. Page lines are the lines
+    which follow `position` in the history, those dropped from the panel are counted and skipped.
+    A message is found by its seq in marks left by the history writer, so messages which
+    are not shown or not written yet do not shift pages.
+    """
+
+    def __init__(self, path: str, position: Optional[HistoryPosition] = None) -> None:
+        self.path = path
+        self.position = position
+        self.skipped = 0
+        self.exhausted = False
+        self._marks: Deque[HistoryMark] = deque()
+        self._top_seq: Optional[int] = None
+
+    def mark(self, position: HistoryPosition, seqs: List[int]) -> None:
+        """Records that messages with `seqs` have been written to the history starting at `position`."""
+        if seqs:
+            self._marks.append(HistoryMark(position, seqs))
+
+    def forget_before(self, seq: int) -> None:
+        """Drops marks of messages older than `seq`, they have left the panel."""
+        while self._marks and self._marks[0].seqs[-1] < seq:
+            self._marks.popleft()
+
+    def find(self, seq: int) -> Optional[Tuple[HistoryPosition, int]]:
+        """
+        Finds the oldest written message which is not older than `seq`.
+
+        Returns a position of its chunk and a number of lines before it in the chunk.
+        """
+        for mark in self._marks:
+            if mark.seqs[-1] >= seq:
+                return mark.position, bisect_left(mark.seqs, seq)
+        return None
+
+    def skip(self, lines_count: int) -> None:
+        """Counts page lines dropped from the top of the panel."""
+        self.skipped += lines_count
+        self.exhausted = False
+
+    def _read_page(self, position: HistoryPosition, skipped: int, lines_count: int) -> Tuple[List[str], HistoryPosition]:
+        if skipped:
+            position = advance_history_position(self.path, position, skipped)
+        return read_history_before(self.path, lines_count, position)
+
+    async def load_older(self, lines_count: int, top_seq: Optional[int] = None) -> List[str]:
+        """
+        Returns lines placed right before the top line of the panel, the oldest first.
+
+        `top_seq` is a seq of a message at the top of the panel, without it the top line is a page line.
+        Nothing is returned while the top message is not written to the history.
+        """
+        if top_seq is None:
+            if self.position is None or self.exhausted:
+                return []
+            position, skipped = self.position, self.skipped
+        else:
+            if self.exhausted and top_seq == self._top_seq:
+                return []
+            found = self.find(top_seq)
+            if found is None:
+                return []
+            position, skipped = found
+        loop = asyncio.get_running_loop()
+        lines, page_position = await loop.run_in_executor(None, self._read_page, position, skipped, lines_count)
+        if top_seq is None and self.skipped != skipped:
+            # the panel has been trimmed while the page was loading, the page is requested again later
+            return []
+        self.position, self.skipped = page_position, 0
+        self.exhausted = not lines
+        self._top_seq = top_seq
+        return lines
+
+
+def iter_history_lines(path: str) -> Iterator[str]:
+    """Yields every line of the history, closed segments first."""
+    for segment in read_manifest(path):
+        f = open_segment(path, segment['number'])
+        if f is None:
+            continue
+        with f:
+            for line in f:
+                yield line.decode(encoding='utf-8', errors='replace').strip()
+    try:
+        with open(path, mode='rb') as f:
+            for line in f:
+                yield line.decode(encoding='utf-8', errors='replace').strip()
+    except FileNotFoundError:
+        return
+
+
+async def load_older_history(
+        path: str,
+        position: HistoryPosition,
+        lines_count: int,
+) -> Tuple[List[str], HistoryPosition]:
+    """Fetches history lines which are older than `position` without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, read_history_before, path, lines_count, position)
+
+
+async def restore_history(
+        path: str,
+        message_bus: MessageBus,
+        lines_count: int = 100,
+        history_pager: Optional[HistoryPager] = None,
+) -> HistoryPosition:
+    """
+    Restore last messages from history file and publish them.
+
+    Returns a position of the oldest restored message,
+    older messages can be fetched later with `load_older_history`.
+    Every line becomes a message, so the pager can find restored messages by their seqs.
+    """
+    loop = asyncio.get_running_loop()
+    # positions of restored lines must not change when the history file is opened for writing
+    await loop.run_in_executor(None, finish_rotation, path)
+    lines, position = await loop.run_in_executor(None, read_history_before, path, lines_count)
+    first_seq = message_bus.next_seq
+    await message_bus.publish(Message.from_history_line(line) for line in lines)
+    if history_pager:
+        history_pager.mark(position, list(range(first_seq, message_bus.next_seq)))
+    return position
+
+
+class MinuteTimestamp:
+    """Time with a minute resolution, every minute is formatted only once."""
+
+    def __init__(self, time_format: str = '%d.%m.%y %H:%M') -> None:
+        self._time_format = time_format
+        self._minute: Optional[int] = None
+        self._formatted = ''
+
+    def __call__(self, timestamp: Optional[float] = None) -> str:
+        minute = int((time.time() if timestamp is None else timestamp) // 60)
+        if minute != self._minute:
+            self._minute = minute
+            self._formatted = datetime.fromtimestamp(minute * 60).strftime(self._time_format)
+        return self._formatted
+
+
+def format_history_lines(messages: List[Message], timestamp: MinuteTimestamp) -> str:
+    """Formats a batch of messages into a chunk of history file, each line gets its receive time."""
+    return ''.join(f'[{timestamp(message.received_at)}] {message.text}\n' for message in messages)
+
+
+class HistoryStorage:
+    """
+    History file together with its search index.
+
+    Both are used from a single writer thread because sqlite connections are bound to a thread.
+    """
+
+    def __init__(self, path: str, rotate_size: int = 0, rotate_daily: bool = False) -> None:
+        self.file = HistoryFile(path, rotate_size, rotate_daily)
+        self.timestamp = MinuteTimestamp()
+        try:
+            self.index: Optional[HistoryIndex] = HistoryIndex(path)
+        except sqlite3.Error:
+            logging.exception(f'Can not open search index of {path}, history is saved without it')
+            self.index = None
+
+    def write(self, messages: List[Message]) -> Tuple[Optional[int], HistoryPosition]:
+        """
+        Appends messages to the history.
+
+        Returns a number of a closed segment, if any, and a position of the first written line.
+        """
+        now = datetime.now()
+        closed_segment = self.file.write(format_history_lines(messages, self.timestamp), len(messages), now)
+        position = HistoryPosition(self.file.segment, self.file.chunk_offset)
+        if self.index:
+            try:
+                self.index.add_messages(messages)
+            except sqlite3.Error:
+                logging.exception('Can not update search index')
+        return closed_segment, position
+
+    def close(self) -> None:
+        self.file.close()
+        if self.index:
+            self.index.close()
+
+
+def compress_closed_segment(path: str, number: int) -> None:
+    try:
+        compress_segment(path, number)
+    except OSError:
+        logging.exception(f'Can not compress history segment {number} of {path}')
 
 
 async def save_history(
         path: str,
-        history_queue: asyncio.Queue,
+        history_queue: Subscription,
+        flush_interval: float = 0.5,
+        rotate_size: int = 0,
+        rotate_daily: bool = False,
+        compression: str = 'gzip',
+        metrics: Optional[Metrics] = None,
+        history_pager: Optional[HistoryPager] = None,
 ) -> None:
-    """Dumps incoming messages into a file."""
+    """
+    Dumps incoming messages into a file.
+
+    Messages are collected for `flush_interval` seconds and written with a single call.
+    Everything left in the queue is written when the coroutine is cancelled.
+    The file is rotated by size or by day, closed segments are compressed in background.
+    The pager gets a mark of every written chunk.
+    """
+    loop = asyncio.get_running_loop()
+    # single worker keeps chunks in order and never writes the file concurrently
+    executor = ThreadPoolExecutor(max_workers=1)
     try:
-        async with aiofiles.open(path, mode='a', encoding='utf-8') as f:
-            while True:
-                message = await history_queue.get()
-                current_datetime = datetime.now().strftime('%d.%m.%y %H:%M')
-                await f.write(f'[{current_datetime}] {message}\n')
-    except PermissionError:
+        storage = await loop.run_in_executor(executor, HistoryStorage, path, rotate_size, rotate_daily)
+    except (PermissionError, IsADirectoryError):
+        executor.shutdown(wait=False)
         raise MinechatException(
             title='Не удаётся открыть файл',
             message=f'Не могу открыть файл {path} для записи истории.',
         )
+    compressor = ThreadPoolExecutor(max_workers=1)
+
+    def on_segment_closed(number: Optional[int]) -> None:
+        if number and compression != 'none':
+            compressor.submit(compress_closed_segment, path, number)
+
+    if compression != 'none':
+        for number in uncompressed_segments(path):
+            on_segment_closed(number)
+
+    pending: List[Message] = []
+    write_future = None
+    try:
+        while True:
+            pending.append(await history_queue.get())
+            await asyncio.sleep(flush_interval)
+            while not history_queue.empty():
+                pending.append(history_queue.get_nowait())
+            write_started_at = time.perf_counter()
+            write_future = executor.submit(storage.write, pending)
+            written, pending = pending, []
+            # shielded, cancellation would also cancel a chunk which the thread has not started yet
+            closed_segment, position = await asyncio.shield(asyncio.wrap_future(write_future))
+            write_future = None
+            if metrics:
+                metrics.history_write_seconds.observe(time.perf_counter() - write_started_at)
+            if history_pager:
+                history_pager.mark(position, [message.seq for message in written])
+            on_segment_closed(closed_segment)
+    finally:
+        if write_future is not None:
+            # wait for a chunk which can be still in progress after cancellation
+            on_segment_closed(write_future.result()[0])
+        while not history_queue.empty():
+            pending.append(history_queue.get_nowait())
+        if pending:
+            # the writer thread is idle here, so the storage is safe to use
+            on_segment_closed(executor.submit(storage.write, pending).result()[0])
+        executor.submit(storage.close).result()
+        executor.shutdown(wait=False)
+        # pending compressions are finished in background, the interpreter waits for them on exit
+        compressor.shutdown(wait=False)
+
+
+def parse_datetime(value: str) -> datetime:
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'Expected a date like 2020-04-30 or 2020-04-30 12:00, got {value}')
+
+
+def create_history_parser() -> argparse.ArgumentParser:
+    """Creates a parser for history command line tools."""
+    parser = argparse.ArgumentParser('Minechat history tools')
+    parser.add_argument('--history-path', metavar='FILEPATH', type=str, default=defaults.HISTORY_PATH, help='Path to a history file')
+    commands = parser.add_subparsers(dest='command', required=True)
+    search_parser = commands.add_parser('search', help='Find messages in the history')
+    search_parser.add_argument('--user', type=str, help='Nickname of an author')
+    search_parser.add_argument('--text', type=str, help='Words which must be present in a message')
+    search_parser.add_argument('--since', type=parse_datetime, help='Show messages not older than this time')
+    search_parser.add_argument('--until', type=parse_datetime, help='Show messages not newer than this time')
+    search_parser.add_argument('--limit', type=int, default=50, help='Maximum number of messages to show')
+    commands.add_parser('reindex', help='Build the search index from scratch')
+    return parser
+
+
+def main() -> None:
+    settings = create_history_parser().parse_args()
+    index = HistoryIndex(settings.history_path)
+    try:
+        if settings.command == 'reindex':
+            index.clear()
+            index.add_history_lines(iter_history_lines(settings.history_path))
+            return
+        found = index.search(
+            user=settings.user,
+            text=settings.text,
+            since=settings.since,
+            until=settings.until,
+            limit=settings.limit,
+        )
+        for message in found:
+            print(message)
+    finally:
+        index.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+import re
+import sqlite3
+from datetime import datetime
+from typing import Iterable, List, NamedTuple, Optional
+
+from message_bus import HISTORY_TIME_FORMAT, Message, split_history_line, split_message
+
+WORD_PATTERN = re.compile(r'\w+')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    nickname TEXT NOT NULL,
+    body TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_nickname ON messages (nickname COLLATE NOCASE, id);
+CREATE INDEX IF NOT EXISTS messages_created_at ON messages (created_at);
+CREATE TABLE IF NOT EXISTS postings (
+    token TEXT NOT NULL,
+    message_id INTEGER NOT NULL,
+    PRIMARY KEY (token, message_id)
+) WITHOUT ROWID;
+'''
+
+
+class FoundMessage(NamedTuple):
+    created_at: datetime
+    nickname: str
+    body: str
+
+    def __str__(self) -> str:
+        text = f'{self.nickname}: {self.body}' if self.nickname else self.body
+        return f'[{self.created_at.strftime(HISTORY_TIME_FORMAT)}] {text}'
+
+
+def index_path(path: str) -> str:
+    return f'{path}.index.sqlite'
+
+
+def tokenize(text: str) -> List[str]:
+    return list({word.lower() for word in WORD_PATTERN.findall(text)})
+
+
+class HistoryIndex:
+    """
+    Inverted index over chat history stored in sqlite next to the history file.
+
+    A connection can be used only from a thread which has created the index.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.connection = sqlite3.connect(index_path(path))
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+
+    def add_messages(self, messages: Iterable[Message]) -> None:
+        """Indexes a batch of parsed messages, each of them has its own receive time."""
+        with self.connection:
+            for message in messages:
+                created_at = datetime.fromtimestamp(message.received_at).isoformat(timespec='minutes')
+                self._insert(message.nickname, message.body, created_at)
+
+    def add_history_lines(self, lines: Iterable[str]) -> None:
+        """Indexes lines read from a history file, each of them has its own timestamp."""
+        with self.connection:
+            for line in lines:
+                created_at, message = split_history_line(line)
+                if created_at:
+                    nickname, body = split_message(message)
+                    self._insert(nickname, body, created_at.isoformat(timespec='minutes'))
+
+    def _insert(self, nickname: str, body: str, timestamp: str) -> None:
+        cursor = self.connection.execute(
+            'INSERT INTO messages (created_at, nickname, body) VALUES (?, ?, ?)',
+            (timestamp, nickname, body),
+        )
+        self.connection.executemany(
+            'INSERT OR IGNORE INTO postings (token, message_id) VALUES (?, ?)',
+            [(token, cursor.lastrowid) for token in tokenize(body)],
+        )
+
+    def clear(self) -> None:
+        with self.connection:
+            self.connection.execute('DELETE FROM postings')
+            self.connection.execute('DELETE FROM messages')
+
+    def search(
+            self,
+            user: Optional[str] = None,
+            text: Optional[str] = None,
+            since: Optional[datetime] = None,
+            until: Optional[datetime] = None,
+            limit: int = 50,
+    ) -> List[FoundMessage]:
+        """
+        Finds messages matching all given conditions, the newest are returned last.
+
+        Every word of `text` must be present in a message, words are compared case-insensitively.
+        """
+        conditions = []
+        params: list = []
+        if user:
+            conditions.append('nickname = ? COLLATE NOCASE')
+            params.append(user)
+        if since:
+            conditions.append('created_at >= ?')
+            params.append(since.isoformat(timespec='minutes'))
+        if until:
+            conditions.append('created_at <= ?')
+            params.append(until.isoformat(timespec='minutes'))
+        for token in tokenize(text or ''):
+            conditions.append('id IN (SELECT message_id FROM postings WHERE token = ?)')
+            params.append(token)
+        where = f'WHERE {" AND ".join(conditions)}' if conditions else ''
+        rows = self.connection.execute(
+            f'SELECT created_at, nickname, body FROM messages {where} ORDER BY id DESC LIMIT ?',
+            params + [limit],
+        ).fetchall()
+        return [
+            FoundMessage(datetime.fromisoformat(created_at), nickname, body)
+            for created_at, nickname, body in reversed(rows)
+        ]
+
+    def close(self) -> None:
+        self.connection.close()
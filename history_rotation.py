@@ -0,0 +1,184 @@
+import gzip
+import io
+import json
+import os
+import shutil
+from datetime import datetime
+from typing import Any, BinaryIO, Dict, List, Optional
+
+from message_bus import parse_history_timestamp
+
+COMPRESSIONS = ('gzip', 'none')
+
+
+def manifest_path(path: str) -> str:
+    return f'{path}.manifest.json'
+
+
+def segment_path(path: str, number: int, compressed: bool = False) -> str:
+    suffix = '.gz' if compressed else ''
+    return f'{path}.{number:06d}{suffix}'
+
+
+def read_manifest(path: str) -> List[Dict[str, Any]]:
+    """Returns descriptions of closed segments, the oldest first."""
+    try:
+        with open(manifest_path(path), mode='r', encoding='utf-8') as f:
+            return json.load(f)['segments']
+    except (FileNotFoundError, ValueError, KeyError):
+        return []
+
+
+def write_manifest(path: str, segments: List[Dict[str, Any]]) -> None:
+    """Replaces the manifest atomically so readers never see a half-written file."""
+    tmp_path = f'{manifest_path(path)}.tmp'
+    with open(tmp_path, mode='w', encoding='utf-8') as f:
+        json.dump({'segments': segments}, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, manifest_path(path))
+
+
+def next_segment_number(path: str) -> int:
+    """Number which the active history file gets when it is rotated."""
+    segments = read_manifest(path)
+    return segments[-1]['number'] + 1 if segments else 1
+
+
+def open_segment(path: str, number: int) -> Optional[BinaryIO]:
+    """Opens a closed segment for reading, compressed segments are unpacked into memory."""
+    compressed_path = segment_path(path, number, compressed=True)
+    if os.path.isfile(compressed_path):
+        with gzip.open(compressed_path, mode='rb') as f:
+            return io.BytesIO(f.read())
+    try:
+        return open(segment_path(path, number), mode='rb')
+    except FileNotFoundError:
+        # the compressor thread may have packed the segment after the check above
+        if not os.path.isfile(compressed_path):
+            return None
+    with gzip.open(compressed_path, mode='rb') as f:
+        return io.BytesIO(f.read())
+
+
+def finish_rotation(path: str) -> None:
+    """
+    Completes a rotation interrupted by a crash after the manifest has been written.
+
+    The last segment of the manifest has no file then and its lines are still in the active file.
+    """
+    segments = read_manifest(path)
+    if not segments:
+        return
+    number = segments[-1]['number']
+    if os.path.isfile(segment_path(path, number)) or os.path.isfile(segment_path(path, number, compressed=True)):
+        return
+    if os.path.isfile(path) and os.path.getsize(path):
+        os.replace(path, segment_path(path, number))
+
+
+def compress_segment(path: str, number: int) -> None:
+    """Packs a closed segment with gzip and removes the uncompressed copy."""
+    raw_path = segment_path(path, number)
+    compressed_path = segment_path(path, number, compressed=True)
+    tmp_path = f'{compressed_path}.tmp'
+    with open(raw_path, mode='rb') as source, gzip.open(tmp_path, mode='wb') as target:
+        shutil.copyfileobj(source, target)
+    os.replace(tmp_path, compressed_path)
+    os.remove(raw_path)
+
+
+def uncompressed_segments(path: str) -> List[int]:
+    """Closed segments which were not compressed yet, e.g. because of a crash."""
+    return [
+        segment['number'] for segment in read_manifest(path)
+        if os.path.isfile(segment_path(path, segment['number']))
+    ]
+
+
+class HistoryFile:
+    """
+    Active history file which is rotated into numbered segments.
+
+    The file is rotated before a write which makes it bigger than `rotate_size` bytes
+    or when a new day starts (if `rotate_daily` is set). Zero `rotate_size` disables size limit.
+    Every closed segment is recorded in the manifest with its time range and line count.
+    `segment` is a number the active file gets when it is rotated, `chunk_offset` is an offset
+    in the active file where the last written chunk starts.
+    """
+
+    def __init__(self, path: str, rotate_size: int = 0, rotate_daily: bool = False) -> None:
+        self.path = path
+        self.rotate_size = rotate_size
+        self.rotate_daily = rotate_daily
+        finish_rotation(path)
+        self.segment = next_segment_number(path)
+        self.chunk_offset = 0
+        self._file = open(path, mode='ab')
+        self._size = self._file.tell()
+        self._lines = 0
+        self._first: Optional[datetime] = None
+        self._last: Optional[datetime] = None
+        if self._size and (rotate_size or rotate_daily):
+            self._scan_existing()
+
+    def _scan_existing(self) -> None:
+        with open(self.path, mode='rb') as f:
+            for line in f:
+                self._lines += 1
+                timestamp = parse_history_timestamp(line.decode(encoding='utf-8', errors='replace'))
+                if timestamp:
+                    self._first = self._first or timestamp
+                    self._last = timestamp
+
+    def _should_rotate(self, chunk_size: int, now: datetime) -> bool:
+        if not self._lines:
+            return False
+        if self.rotate_size and self._size + chunk_size > self.rotate_size:
+            return True
+        if self.rotate_daily and self._first and self._first.date() != now.date():
+            return True
+        return False
+
+    def write(self, chunk: str, lines_count: int, now: datetime) -> Optional[int]:
+        """
+        Appends a chunk of formatted lines.
+
+        Returns a number of a segment which has been closed before the write, if any.
+        """
+        data = chunk.encode(encoding='utf-8')
+        closed_segment = None
+        if self._should_rotate(len(data), now):
+            closed_segment = self.rotate()
+        self.chunk_offset = self._size
+        self._file.write(data)
+        self._file.flush()
+        self._size += len(data)
+        self._lines += lines_count
+        self._first = self._first or now
+        self._last = now
+        return closed_segment
+
+    def rotate(self) -> int:
+        """Closes the active file as a new segment and starts an empty one."""
+        self._file.close()
+        segments = read_manifest(self.path)
+        number = segments[-1]['number'] + 1 if segments else 1
+        segments.append({
+            'number': number,
+            'first': self._first.isoformat() if self._first else None,
+            'last': self._last.isoformat() if self._last else None,
+            'lines': self._lines,
+        })
+        # the manifest goes first: a crash between these two calls must not let
+        # the next rotation reuse the number and overwrite the segment
+        write_manifest(self.path, segments)
+        os.replace(self.path, segment_path(self.path, number))
+        self._file = open(self.path, mode='ab')
+        self.segment = number + 1
+        self._size = 0
+        self._lines = 0
+        self._first = self._last = None
+        return number
+
+    def close(self) -> None:
+        self._file.close()
+
@@ -0,0 +1,109 @@
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, Optional
+
+READ_CHANNEL = 'read'
+WRITE_CHANNEL = 'write'
+
+
+class LivenessMonitor:
+    """
+    Remembers when every connection channel has shown signs of life.
+
+    `touch` is a cheap synchronous call made on every received or sent line,
+    the watchdog checks idle time on its own timer.
+    """
+
+    def __init__(self) -> None:
+        self.last_seen: Dict[str, float] = {}
+        self.events: Dict[str, int] = defaultdict(int)
+        self._reported_at = time.monotonic()
+        self._reported_events: Dict[str, int] = {}
+
+    def touch(self, channel: str) -> None:
+        self.last_seen[channel] = time.monotonic()
+        self.events[channel] += 1
+
+    def idle_time(self, channels: Iterable[str], since: Optional[float] = None) -> float:
+        """Seconds since the latest event on any of the channels, but not more than since `since`."""
+        now = time.monotonic()
+        latest = max((self.last_seen.get(channel, 0.0) for channel in channels), default=0.0)
+        if since is not None:
+            latest = max(latest, since)
+        return now - latest
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        """Idle time and events rate of every channel since the previous report."""
+        now = time.monotonic()
+        elapsed = max(now - self._reported_at, 1e-9)
+        report = {
+            channel: {
+                'idle': now - self.last_seen.get(channel, now),
+                'rate': (events - self._reported_events.get(channel, 0)) / elapsed,
+                'events': events,
+            }
+            for channel, events in self.events.items()
+        }
+        self._reported_at = now
+        self._reported_events = dict(self.events)
+        return report
+
+
+def format_report(report: Dict[str, Dict[str, float]]) -> str:
+    return '; '.join(
+        f'{channel}: idle {stats["idle"]:.1f} s, {stats["rate"]:.1f} events/s'
+        for channel, stats in sorted(report.items())
+    )
+
+
+class Healthcheck:
+    """
+    Tracks replies to lines sent over the write channel and estimates round trip time.
+
+    The server answers every line, so a line without an answer for longer than
+    the retransmission-like timeout (smoothed RTT plus four deviations, as in TCP)
+    means that the connection is dead. Pings are needed only after `idle_interval`
+    seconds without other traffic.
+    """
+
+    def __init__(
+            self,
+            idle_interval: float = 1.5,
+            min_timeout: float = 0.5,
+            max_timeout: float = 10.0,
+    ) -> None:
+        self.idle_interval = idle_interval
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.srtt: Optional[float] = None
+        self.rttvar = 0.0
+        self.waiting_since: Optional[float] = None
+
+    def reset(self) -> None:
+        """Forgets unanswered lines of a previous connection, RTT estimate is kept."""
+        self.waiting_since = None
+
+    def line_sent(self) -> None:
+        if self.waiting_since is None:
+            self.waiting_since = time.monotonic()
+
+    def reply_received(self) -> Optional[float]:
+        """Returns round trip time if the reply answers a sent line."""
+        if self.waiting_since is None:
+            return None
+        rtt = time.monotonic() - self.waiting_since
+        self.waiting_since = None
+        if self.srtt is None:
+            self.srtt, self.rttvar = rtt, rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        return rtt
+
+    def timeout(self) -> float:
+        if self.srtt is None:
+            return self.max_timeout
+        return min(self.max_timeout, max(self.min_timeout, self.srtt + 4 * self.rttvar))
+
+    def is_overdue(self) -> bool:
+        return self.waiting_since is not None and time.monotonic() - self.waiting_since > self.timeout()
@@ -1,14 +1,24 @@
+import argparse
 import asyncio
+import copy
 import logging.config
-from tkinter import messagebox
+import sys
+from typing import Any, Awaitable, Dict, List, Optional
 
 from anyio import create_task_group
 
-import gui
-from exceptions import MinechatException
-from gui import TkAppClosed
-from history_client import restore_history, save_history
+import headless
+from accounts import Account, load_accounts
+from common_tools import SocketOptions
+from exceptions import MinechatException, TkAppClosed
+from filters import MessageFilter
+from history_client import HistoryPager, restore_history, save_history
+from liveness import Healthcheck, LivenessMonitor
+from message_bus import MessageBus
+from metrics import Metrics, dump_metrics, serve_metrics
+from queues import BoundedQueue, QueueLimit
 from settings import read_settings, get_logging_settings
+from spool import OutgoingSpool, spool_outgoing_messages
 from watchdog import handle_connection
 
 
@@ -19,58 +29,258 @@ async def run_chat_internals(
         writer_port: int,
         access_token: str,
         history_path: str,
+        history_restore_lines: int,
+        history_flush_interval: float,
+        history_rotate_size: int,
+        history_rotate_daily: bool,
+        history_compression: str,
+        queue_limits: Dict[str, QueueLimit],
+        render_lines_per_frame: int,
+        scrollback_lines: int,
+        tk_idle_interval: float,
+        reconnect_min_delay: float,
+        reconnect_max_delay: float,
+        read_timeout: float,
+        spool_path: str,
+        healthcheck_idle: float,
+        healthcheck_min_timeout: float,
+        healthcheck_max_timeout: float,
+        socket_options: SocketOptions,
+        message_filter: MessageFilter,
+        headless_mode: bool = False,
+        headless_output: Optional[str] = headless.STANDARD_STREAM,
+        headless_input: Optional[str] = headless.STANDARD_STREAM,
+        account_name: str = '',
+        metrics: Optional[Metrics] = None,
 ) -> None:
-    """Runs all coroutines."""
-    messages_queue = asyncio.Queue()
-    sending_queue = asyncio.Queue()
-    status_updates_queue = asyncio.Queue()
-    history_queue = asyncio.Queue()
-    watchdog_queue = asyncio.Queue()
+    """
+    Runs all coroutines, in headless mode messages go to a stream instead of the window.
+
+    Headless mode without output only saves the history, without input it sends nothing.
+    """
+    message_bus = MessageBus()
+    sending_queue = BoundedQueue.from_limit('sending', queue_limits['sending'])
+    status_updates_queue = BoundedQueue.from_limit('status', queue_limits['status'])
+    liveness = LivenessMonitor()
+    healthcheck = Healthcheck(healthcheck_idle, healthcheck_min_timeout, healthcheck_max_timeout)
+    spool = OutgoingSpool(spool_path)
+    if metrics:
+        metrics.watch_queue(sending_queue)
+        metrics.watch_queue(status_updates_queue)
+        metrics.add_reader('minechat_queue_depth', lambda: len(spool.pending()), queue='spool')
+    history_pager = None
+    try:
+        async with create_task_group() as tg:
+            if headless_mode:
+                if headless_output is not None:
+                    messages_queue = message_bus.subscribe('messages', queue_limits['messages'])
+                    if metrics:
+                        metrics.watch_queue(messages_queue)
+                    await tg.spawn(headless.print_messages, messages_queue, headless_output, metrics)
+                if headless_input is not None:
+                    await tg.spawn(headless.read_outgoing_messages, sending_queue, headless_input)
+                await tg.spawn(headless.log_status_updates, status_updates_queue, account_name)
+            else:
+                # Tk is loaded only when the window is needed
+                import gui
+                messages_queue = message_bus.subscribe('messages', queue_limits['messages'])
+                if metrics:
+                    metrics.watch_queue(messages_queue)
+                history_pager = HistoryPager(history_path)
+                await tg.spawn(gui.draw,
+                               messages_queue,
+                               sending_queue,
+                               status_updates_queue,
+                               render_lines_per_frame,
+                               scrollback_lines,
+                               history_pager,
+                               history_restore_lines,
+                               tk_idle_interval,
+                               metrics,
+                               )
+                await restore_history(
+                    path=history_path,
+                    message_bus=message_bus,
+                    lines_count=history_restore_lines,
+                    history_pager=history_pager,
+                )
+            # subscribed after restoring, so restored messages are not saved twice
+            history_queue = message_bus.subscribe('history', queue_limits['history'])
+            if metrics:
+                metrics.watch_queue(history_queue)
+            await tg.spawn(save_history,
+                           history_path,
+                           history_queue,
+                           history_flush_interval,
+                           history_rotate_size,
+                           history_rotate_daily,
+                           history_compression,
+                           metrics,
+                           history_pager,
+                           )
+            await tg.spawn(spool_outgoing_messages,
+                           sending_queue,
+                           spool,
+                           )
+            await tg.spawn(handle_connection,
+                           reader_host,
+                           reader_port,
+                           writer_host,
+                           writer_port,
+                           access_token,
+                           message_bus,
+                           spool,
+                           status_updates_queue,
+                           liveness,
+                           reconnect_min_delay,
+                           reconnect_max_delay,
+                           read_timeout,
+                           healthcheck,
+                           socket_options,
+                           message_filter,
+                           None,
+                           metrics,
+                           )
+    finally:
+        spool.close()
+        if message_filter.dropped:
+            prefix = f'{account_name}: ' if account_name else ''
+            logging.info(f'{prefix}{message_filter.dropped} messages filtered out: {message_filter.format_hits()}')
+
+
+async def run_account(account: Account, chat_settings: Dict[str, Any]) -> None:
+    """Runs a headless client of one account, its failure does not stop other accounts."""
+    metrics = chat_settings['metrics']
+    try:
+        await run_chat_internals(**{
+            **chat_settings,
+            'reader_host': account.read_host,
+            'reader_port': account.read_port,
+            'writer_host': account.write_host,
+            'writer_port': account.write_port,
+            'access_token': account.token,
+            'history_path': account.history_path,
+            'spool_path': account.spool_path,
+            # every account counts its own filter hits
+            'message_filter': copy.deepcopy(chat_settings['message_filter']),
+            'headless_mode': True,
+            'headless_output': account.output,
+            'headless_input': account.input,
+            'account_name': account.name,
+            'metrics': metrics.child(account=account.name) if metrics else None,
+        })
+    except MinechatException as e:
+        logging.error(f'{account.name}: stopped, {e.title}. {e.message}')
+    except asyncio.CancelledError:
+        # it is an Exception before Python 3.8, the whole service is being stopped
+        raise
+    except Exception:
+        logging.exception(f'{account.name}: stopped by an unexpected error')
+
+
+async def run_accounts(accounts: List[Account], chat_settings: Dict[str, Any]) -> None:
+    """Serves many accounts in one event loop, each of them has its own queues and files."""
     async with create_task_group() as tg:
-        await tg.spawn(gui.draw,
-                       messages_queue,
-                       sending_queue,
-                       status_updates_queue,
-                       )
-        await restore_history(
-            path=history_path,
-            messages_queue=messages_queue,
-        )
-        await tg.spawn(save_history,
-                       history_path,
-                       history_queue,
-                       )
-        await tg.spawn(handle_connection,
-                       reader_host,
-                       reader_port,
-                       writer_host,
-                       writer_port,
-                       access_token,
-                       messages_queue,
-                       sending_queue,
-                       history_queue,
-                       status_updates_queue,
-                       watchdog_queue,
-                       )
+        for account in accounts:
+            await tg.spawn(run_account, account, chat_settings)
+
+
+def get_chat_settings(settings: argparse.Namespace) -> Dict[str, Any]:
+    """Arguments of `run_chat_internals` taken from the settings."""
+    return dict(
+        reader_host=settings.read_host,
+        reader_port=settings.read_port,
+        writer_host=settings.write_host,
+        writer_port=settings.write_port,
+        access_token=settings.token,
+        history_path=settings.history_path,
+        history_restore_lines=settings.history_restore_lines,
+        history_flush_interval=settings.history_flush_interval,
+        history_rotate_size=settings.history_rotate_size,
+        history_rotate_daily=settings.history_rotate_daily,
+        history_compression=settings.history_compression,
+        queue_limits={
+            'messages': settings.messages_queue,
+            'sending': settings.sending_queue,
+            'status': settings.status_queue,
+            'history': settings.history_queue,
+        },
+        render_lines_per_frame=settings.render_lines_per_frame,
+        scrollback_lines=settings.scrollback_lines,
+        tk_idle_interval=settings.tk_idle_interval,
+        reconnect_min_delay=settings.reconnect_min_delay,
+        reconnect_max_delay=settings.reconnect_max_delay,
+        read_timeout=settings.read_timeout,
+        spool_path=settings.spool_path,
+        healthcheck_idle=settings.healthcheck_idle,
+        healthcheck_min_timeout=settings.healthcheck_min_timeout,
+        healthcheck_max_timeout=settings.healthcheck_max_timeout,
+        socket_options=SocketOptions(
+            nodelay=settings.tcp_nodelay,
+            keepalive=settings.tcp_keepalive,
+            keepidle=settings.tcp_keepidle,
+            keepintvl=settings.tcp_keepintvl,
+            keepcnt=settings.tcp_keepcnt,
+            user_timeout=settings.tcp_user_timeout,
+            rcvbuf=settings.socket_rcvbuf,
+            sndbuf=settings.socket_sndbuf,
+        ),
+        message_filter=MessageFilter(
+            block_nicknames=settings.block_nicknames,
+            allow_nicknames=settings.allow_nicknames,
+            block_patterns=settings.block_patterns,
+            block_keywords=settings.block_keywords,
+        ),
+        headless_mode=settings.headless,
+        headless_output=settings.headless_output,
+        headless_input=settings.headless_input,
+        metrics=Metrics() if settings.metrics_port or settings.metrics_dump_path else None,
+    )
+
+
+async def run_with_metrics(chat: Awaitable[None], metrics: Optional[Metrics], settings: argparse.Namespace) -> None:
+    """Runs the chat together with the metrics endpoint and the dump, when metrics are enabled."""
+    if not metrics:
+        await chat
+        return
+    async with create_task_group() as tg:
+        if settings.metrics_port:
+            await tg.spawn(serve_metrics, metrics, settings.metrics_host, settings.metrics_port)
+        if settings.metrics_dump_path:
+            await tg.spawn(dump_metrics, metrics, settings.metrics_dump_path, settings.metrics_dump_interval)
+        await chat
+        await tg.cancel_scope.cancel()
+
+
+def show_error(error: MinechatException, headless_mode: bool) -> None:
+    """Shows an error in a message box, or prints it when there is no window."""
+    if not headless_mode:
+        try:
+            from tkinter import TclError, messagebox
+            messagebox.showinfo(title=error.title, message=error.message)
+            return
+        except (ImportError, TclError):
+            pass
+    print(f'{error.title}. {error.message}', file=sys.stderr)
 
 
 def run_chat() -> None:
     """Entry point to initialize and start the application."""
+    headless_mode = False
     try:
         total_settings = read_settings()
+        headless_mode = total_settings.headless or bool(total_settings.accounts)
         logger_dict_config = get_logging_settings(total_settings.loglevel)
         logging.config.dictConfig(logger_dict_config)
 
-        asyncio.run(run_chat_internals(
-            reader_host=total_settings.read_host,
-            reader_port=total_settings.read_port,
-            writer_host=total_settings.write_host,
-            writer_port=total_settings.write_port,
-            access_token=total_settings.token,
-            history_path=total_settings.history_path,
-        ))
+        chat_settings = get_chat_settings(total_settings)
+        if total_settings.accounts:
+            chat = run_accounts(load_accounts(total_settings.accounts, total_settings), chat_settings)
+        else:
+            chat = run_chat_internals(**chat_settings)
+        asyncio.run(run_with_metrics(chat, chat_settings['metrics'], total_settings))
     except MinechatException as e:
-        messagebox.showinfo(title=e.title, message=e.message)
+        show_error(e, headless_mode)
     except (KeyboardInterrupt, TkAppClosed):
         pass
 
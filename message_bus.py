@@ -0,0 +1,216 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from datetime import datetime
+from typing import Deque, Iterable, List, Optional, Tuple
+
+from queues import OverflowPolicy, QueueLimit, parse_queue_limit
+
+HISTORY_TIME_FORMAT = '%d.%m.%y %H:%M'
+# a history line starts with `[31.12.20 23:59] ` followed by a message
+HISTORY_TIME_END = len('[31.12.20 23:59')
+HISTORY_PREFIX_LENGTH = len('[31.12.20 23:59] ')
+# a subscription can only make its reader wait or skip the oldest unread messages
+SUBSCRIPTION_POLICIES = (OverflowPolicy.BLOCK, OverflowPolicy.DROP_OLDEST)
+
+
+def parse_history_timestamp(line: str) -> Optional[datetime]:
+    """Extracts time from a history line like `[31.12.20 23:59] Nick: text`."""
+    if not line.startswith('['):
+        return None
+    try:
+        return datetime.strptime(line[1:HISTORY_TIME_END], HISTORY_TIME_FORMAT)
+    except ValueError:
+        return None
+
+
+def split_history_line(line: str) -> Tuple[Optional[datetime], str]:
+    """Splits a history line into its time and a message, a line without time is a message as is."""
+    created_at = parse_history_timestamp(line)
+    if created_at is None:
+        return None, line
+    return created_at, line[HISTORY_PREFIX_LENGTH:]
+
+
+def split_message(message: str) -> Tuple[str, str]:
+    """Splits a chat message into a nickname and a text."""
+    nickname, separator, body = message.partition(': ')
+    if not separator:
+        return '', message
+    return nickname, body
+
+
+class Message:
+    """
+    Chat message parsed once when it is received and shared by all consumers.
+
+    `seq` is assigned by the bus, `received_at` is a unix time.
+    Restored messages come from the history and are shown with their time.
+    """
+
+    __slots__ = ('seq', 'received_at', 'nickname', 'body', 'restored')
+
+    def __init__(
+            self,
+            nickname: str,
+            body: str,
+            received_at: Optional[float] = None,
+            seq: int = 0,
+            restored: bool = False,
+    ) -> None:
+        self.seq = seq
+        self.received_at = time.time() if received_at is None else received_at
+        self.nickname = nickname
+        self.body = body
+        self.restored = restored
+
+    @classmethod
+    def parse(cls, line: str, received_at: Optional[float] = None) -> 'Message':
+        nickname, body = split_message(line)
+        return cls(nickname, body, received_at)
+
+    @classmethod
+    def from_history_line(cls, line: str) -> 'Message':
+        """Parses a line like `[31.12.20 23:59] Nick: text`, a line without time is kept as is."""
+        created_at, message = split_history_line(line)
+        if created_at is None:
+            return cls('', line)
+        nickname, body = split_message(message)
+        return cls(nickname, body, created_at.timestamp(), restored=True)
+
+    @property
+    def text(self) -> str:
+        return f'{self.nickname}: {self.body}' if self.nickname else self.body
+
+    def history_line(self) -> str:
+        return f'[{datetime.fromtimestamp(self.received_at).strftime(HISTORY_TIME_FORMAT)}] {self.text}'
+
+    def __str__(self) -> str:
+        return self.history_line() if self.restored else self.text
+
+    def __repr__(self) -> str:
+        return f'Message(seq={self.seq}, text={self.text!r})'
+
+
+def parse_subscription_limit(value: str) -> QueueLimit:
+    """Parses `SIZE:POLICY` of a bus subscription, the policy is block or drop_oldest."""
+    return parse_queue_limit(value, SUBSCRIPTION_POLICIES)
+
+
+class Subscription:
+    """
+    Reader of a message bus with its own cursor, it has the interface of asyncio.Queue for consumers.
+
+    `maxsize` limits how far the reader may lag behind. With the block policy publishing waits
+    for the reader, with the drop_oldest policy the oldest unread messages are skipped.
+    """
+
+    def __init__(self, bus: 'MessageBus', name: str, maxsize: int, policy: OverflowPolicy) -> None:
+        self.name = name
+        self.maxsize = maxsize
+        self.policy = policy
+        self.dropped = 0
+        self.cursor = bus.next_seq
+        self._bus = bus
+        self._has_messages = asyncio.Event()
+
+    def qsize(self) -> int:
+        return self._bus.next_seq - self.cursor
+
+    def empty(self) -> bool:
+        return self.cursor == self._bus.next_seq
+
+    def full(self) -> bool:
+        return bool(self.maxsize) and self.qsize() >= self.maxsize
+
+    def get_nowait(self) -> Message:
+        if self.empty():
+            raise asyncio.QueueEmpty
+        message = self._bus.message_at(self.cursor)
+        self.cursor += 1
+        self._bus.consumed(self)
+        return message
+
+    async def get(self) -> Message:
+        while self.empty():
+            self._has_messages.clear()
+            await self._has_messages.wait()
+        return self.get_nowait()
+
+    def _published(self) -> None:
+        if self.maxsize and self.qsize() > self.maxsize and self.policy is OverflowPolicy.DROP_OLDEST:
+            self.cursor += 1
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                logging.warning(f'Subscriber {self.name} lags behind, {self.dropped} messages skipped')
+        self._has_messages.set()
+
+    def close(self) -> None:
+        self._bus.unsubscribe(self)
+
+
+class MessageBus:
+    """
+    Fan-out of received messages: every message is stored once and read by all subscribers.
+
+    Messages are kept until the slowest subscriber has read them.
+    A subscriber sees only messages published after it has subscribed.
+    """
+
+    def __init__(self) -> None:
+        self.next_seq = 1
+        self._first_seq = 1
+        self._messages: Deque[Message] = deque()
+        self._subscriptions: List[Subscription] = []
+        self._has_space = asyncio.Event()
+
+    def subscribe(self, name: str, limit: QueueLimit = QueueLimit(0, OverflowPolicy.BLOCK)) -> Subscription:
+        if limit.policy not in SUBSCRIPTION_POLICIES:
+            raise ValueError(f'Subscription {name} does not support {limit.policy} policy')
+        subscription = Subscription(self, name, limit.maxsize, limit.policy)
+        self._subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self._subscriptions.remove(subscription)
+        self._trim()
+
+    def message_at(self, seq: int) -> Message:
+        return self._messages[seq - self._first_seq]
+
+    def consumed(self, subscription: Subscription) -> None:
+        if subscription.cursor - 1 == self._first_seq:
+            self._trim()
+        if subscription.policy is OverflowPolicy.BLOCK:
+            self._has_space.set()
+
+    def _trim(self) -> None:
+        oldest_cursor = min((subscription.cursor for subscription in self._subscriptions), default=self.next_seq)
+        while self._first_seq < oldest_cursor:
+            self._messages.popleft()
+            self._first_seq += 1
+
+    def _blocked(self) -> bool:
+        return any(
+            subscription.policy is OverflowPolicy.BLOCK and subscription.full()
+            for subscription in self._subscriptions
+        )
+
+    def publish_nowait(self, messages: Iterable[Message]) -> None:
+        """Publishes messages without waiting for blocking subscribers, their limits are exceeded."""
+        for message in messages:
+            message.seq = self.next_seq
+            self.next_seq += 1
+            self._messages.append(message)
+            for subscription in self._subscriptions:
+                subscription._published()
+        self._trim()
+
+    async def publish(self, messages: Iterable[Message]) -> None:
+        """Publishes messages, waits while any subscriber with the block policy is full."""
+        for message in messages:
+            while self._blocked():
+                self._has_space.clear()
+                await self._has_space.wait()
+            self.publish_nowait((message,))
@@ -0,0 +1,266 @@
+"""
+Counters and histograms of the chat client, exported as Prometheus text or JSON.
+
+Hot paths update plain attributes of a `Metrics` object and only when metrics are enabled,
+a disabled client passes `None` instead and pays for a single check per batch.
+Queue depths and reconnect counts are not updated at all, they are read at export time.
+"""
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+from asyncio.streams import StreamReader, StreamWriter
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from exceptions import MinechatException
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# name: (type, help), the order is kept in the export
+DESCRIPTIONS = {
+    'minechat_messages_received_total': ('counter', 'Messages read from the chat, before filtering'),
+    'minechat_messages_sent_total': ('counter', 'Messages written to the chat'),
+    'minechat_bytes_received_total': ('counter', 'Bytes read from the chat'),
+    'minechat_bytes_sent_total': ('counter', 'Bytes written to the chat, including pings'),
+    'minechat_queue_depth': ('gauge', 'Items waiting in a queue'),
+    'minechat_queue_dropped_total': ('counter', 'Items dropped by a queue overflow policy'),
+    'minechat_history_write_seconds': ('histogram', 'Time to write a batch of messages into the history'),
+    'minechat_render_lag_seconds': ('histogram', 'Time from receiving a message to showing it'),
+    'minechat_reconnects_total': ('counter', 'Connection failures of a channel'),
+    'minechat_healthcheck_rtt_seconds': ('histogram', 'Round trip time of lines sent over the write channel'),
+}
+
+
+class Counter:
+    __slots__ = ('value',)
+
+    def __init__(self) -> None:
+        self.value = 0
+
+    def inc(self, amount: int = 1) -> None:
+        self.value += amount
+
+
+class Histogram:
+    """Counts observed values in buckets with fixed upper bounds, like a Prometheus histogram."""
+
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds: Sequence[float] = LATENCY_BUCKETS) -> None:
+        self.bounds = tuple(sorted(bounds))
+        self.counts = [0] * (len(self.bounds) + 1)  # the last bucket has no upper bound
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self) -> List[Tuple[str, int]]:
+        total = 0
+        buckets = []
+        for bound, count in zip(self.bounds + (float('inf'),), self.counts):
+            total += count
+            buckets.append(('+Inf' if bound == float('inf') else f'{bound:g}', total))
+        return buckets
+
+
+class Sample(NamedTuple):
+    name: str
+    labels: Dict[str, str]
+    value: Any  # a number or a Histogram
+
+
+class Metrics:
+    """
+    Metrics of one client, `labels` are added to all of them.
+
+    Clients of several accounts share one export through child metrics,
+    metrics with children export only them.
+    """
+
+    def __init__(self, labels: Optional[Dict[str, str]] = None) -> None:
+        self.labels = labels or {}
+        self.messages_received = Counter()
+        self.messages_sent = Counter()
+        self.bytes_received = Counter()
+        self.bytes_sent = Counter()
+        self.history_write_seconds = Histogram()
+        self.render_lag_seconds = Histogram()
+        self.healthcheck_rtt_seconds = Histogram()
+        self.children: List['Metrics'] = []
+        self._readers: List[Tuple[str, Dict[str, str], Callable[[], float]]] = []
+
+    def child(self, **labels: str) -> 'Metrics':
+        metrics = Metrics({**self.labels, **labels})
+        self.children.append(metrics)
+        return metrics
+
+    def add_reader(self, name: str, read: Callable[[], float], **labels: str) -> None:
+        """Registers a value which is read only when metrics are exported."""
+        self._readers.append((name, labels, read))
+
+    def messages_shown(self, messages: Iterable[Any]) -> None:
+        """Observes render lag of received messages, restored ones have been received long ago."""
+        shown_at = time.time()
+        for message in messages:
+            if not message.restored:
+                self.render_lag_seconds.observe(shown_at - message.received_at)
+
+    def watch_queue(self, queue: Any) -> None:
+        """Exports depth and drops of anything with `name`, `qsize()` and `dropped`, e.g. a queue or a subscription."""
+        self.add_reader('minechat_queue_depth', queue.qsize, queue=queue.name)
+        self.add_reader('minechat_queue_dropped_total', lambda: queue.dropped, queue=queue.name)
+
+    def collect(self) -> Iterator[Sample]:
+        if self.children:
+            for child in self.children:
+                yield from child.collect()
+            return
+        yield Sample('minechat_messages_received_total', self.labels, self.messages_received.value)
+        yield Sample('minechat_messages_sent_total', self.labels, self.messages_sent.value)
+        yield Sample('minechat_bytes_received_total', self.labels, self.bytes_received.value)
+        yield Sample('minechat_bytes_sent_total', self.labels, self.bytes_sent.value)
+        yield Sample('minechat_history_write_seconds', self.labels, self.history_write_seconds)
+        yield Sample('minechat_render_lag_seconds', self.labels, self.render_lag_seconds)
+        yield Sample('minechat_healthcheck_rtt_seconds', self.labels, self.healthcheck_rtt_seconds)
+        for name, labels, read in self._readers:
+            yield Sample(name, {**self.labels, **labels}, read())
+
+
+def group_samples(metrics: Metrics) -> Dict[str, List[Sample]]:
+    """Groups samples by metric name in the order of `DESCRIPTIONS`, a metric without samples is skipped."""
+    grouped: Dict[str, List[Sample]] = {name: [] for name in DESCRIPTIONS}
+    for sample in metrics.collect():
+        grouped[sample.name].append(sample)
+    return {name: samples for name, samples in grouped.items() if samples}
+
+
+def format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    escaped = (
+        (key, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in sorted(labels.items())
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+def format_value(value: float) -> str:
+    """Sample value with every digit, `:g` would hide small increases of values above a million."""
+    if isinstance(value, int):
+        return str(int(value))
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+def format_prometheus(metrics: Metrics) -> str:
+    """Formats metrics in the Prometheus text exposition format."""
+    lines = []
+    for name, samples in group_samples(metrics).items():
+        metric_type, description = DESCRIPTIONS[name]
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        for sample in samples:
+            if isinstance(sample.value, Histogram):
+                for bound, count in sample.value.cumulative_counts():
+                    lines.append(f'{name}_bucket{format_labels({**sample.labels, "le": bound})} {count}')
+                lines.append(f'{name}_sum{format_labels(sample.labels)} {format_value(sample.value.sum)}')
+                lines.append(f'{name}_count{format_labels(sample.labels)} {sample.value.count}')
+            else:
+                lines.append(f'{name}{format_labels(sample.labels)} {format_value(sample.value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def format_json(metrics: Metrics) -> Dict[str, Any]:
+    """Metrics as a JSON object, histograms have cumulative bucket counts like in Prometheus."""
+    formatted: Dict[str, Any] = {'time': time.time()}
+    for name, samples in group_samples(metrics).items():
+        values = []
+        for sample in samples:
+            if isinstance(sample.value, Histogram):
+                values.append({
+                    'labels': sample.labels,
+                    'count': sample.value.count,
+                    'sum': sample.value.sum,
+                    'buckets': dict(sample.value.cumulative_counts()),
+                })
+            else:
+                values.append({'labels': sample.labels, 'value': sample.value})
+        formatted[name] = values
+    return formatted
+
+
+async def handle_metrics_request(metrics: Metrics, reader: StreamReader, writer: StreamWriter) -> None:
+    """Answers `GET /metrics` with Prometheus text, anything else gets 404."""
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # headers are not needed, but they are read so the client does not get a reset
+        while (await asyncio.wait_for(reader.readline(), timeout=5)).strip():
+            pass
+        method, path, *_ = request_line.decode('latin-1').split() + ['', '']
+        if method == 'GET' and path.split('?')[0] in ('/', '/metrics'):
+            status, body = '200 OK', format_prometheus(metrics).encode('utf-8')
+        else:
+            status, body = '404 Not Found', b'Not found\n'
+        writer.write(
+            f'HTTP/1.0 {status}\r\n'
+            f'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            f'Connection: close\r\n\r\n'.encode('latin-1') + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_metrics(metrics: Metrics, host: str, port: int) -> None:
+    """Serves metrics over HTTP until cancelled."""
+    try:
+        server = await asyncio.start_server(
+            lambda reader, writer: handle_metrics_request(metrics, reader, writer),
+            host,
+            port,
+        )
+    except OSError as e:
+        raise MinechatException(
+            title='Не удаётся открыть порт',
+            message=f'Не могу принимать запросы метрик на {host}:{port}: {e.strerror}.',
+        )
+    logging.info(f'Metrics are served on http://{host}:{port}/metrics')
+    try:
+        await asyncio.Event().wait()
+    finally:
+        server.close()
+
+
+def write_metrics(path: str, metrics: Metrics) -> None:
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, mode='w', encoding='utf-8') as f:
+        json.dump(format_json(metrics), f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+async def dump_metrics(metrics: Metrics, path: str, interval: float) -> None:
+    """Replaces a JSON file with current metrics every `interval` seconds and once more when cancelled."""
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                write_metrics(path, metrics)
+            except OSError:
+                logging.exception(f'Can not write metrics to {path}')
+    finally:
+        try:
+            write_metrics(path, metrics)
+        except OSError:
+            pass
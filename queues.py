@@ -0,0 +1,96 @@
+import argparse
+import asyncio
+import logging
+from enum import Enum
+from typing import Any, Callable, NamedTuple, Sequence
+
+
+class OverflowPolicy(Enum):
+    BLOCK = 'block'
+    DROP_OLDEST = 'drop_oldest'
+    DROP_NEWEST = 'drop_newest'
+    COALESCE = 'coalesce'
+
+    def __str__(self):
+        return str(self.value)
+
+
+class QueueLimit(NamedTuple):
+    maxsize: int
+    policy: OverflowPolicy
+
+
+def parse_queue_limit(value: str, policies: Sequence[OverflowPolicy] = tuple(OverflowPolicy)) -> QueueLimit:
+    """Parses queue settings written as `SIZE:POLICY`, e.g. `1000:drop_oldest`, accepts only `policies`."""
+    size, _, policy = value.partition(':')
+    try:
+        limit = QueueLimit(int(size), OverflowPolicy(policy or OverflowPolicy.BLOCK.value))
+        if limit.policy not in policies:
+            raise ValueError
+        return limit
+    except ValueError:
+        names = ', '.join(str(policy) for policy in policies)
+        raise argparse.ArgumentTypeError(f'Expected SIZE:POLICY where POLICY is one of {names}, got {value}')
+
+
+class BoundedQueue(asyncio.Queue):
+    """
+    asyncio.Queue which applies an overflow policy when it is full.
+
+    block - `put` waits for a free slot, `put_nowait` raises QueueFull.
+    drop_oldest - the oldest item is removed to free a slot.
+    drop_newest - the new item is discarded.
+    coalesce - the new item replaces the newest queued item with the same key
+    (the item type by default), the oldest item is dropped if there is no such item.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            maxsize: int = 0,
+            policy: OverflowPolicy = OverflowPolicy.BLOCK,
+            coalesce_key: Callable[[Any], Any] = type,
+    ) -> None:
+        super().__init__(maxsize)
+        self.name = name
+        self.policy = policy
+        self.dropped = 0
+        self._coalesce_key = coalesce_key
+
+    @classmethod
+    def from_limit(cls, name: str, limit: QueueLimit) -> 'BoundedQueue':
+        return cls(name, limit.maxsize, limit.policy)
+
+    def _count_drop(self) -> None:
+        self.dropped += 1
+        if self.dropped == 1 or self.dropped % 1000 == 0:
+            logging.warning(f'Queue {self.name} is full, {self.dropped} items dropped by {self.policy} policy')
+
+    def _coalesce(self, item: Any) -> bool:
+        key = self._coalesce_key(item)
+        queued_items = self._queue  # type: ignore
+        for position in range(len(queued_items) - 1, -1, -1):
+            if self._coalesce_key(queued_items[position]) == key:
+                queued_items[position] = item
+                return True
+        return False
+
+    def put_nowait(self, item: Any) -> None:
+        if not self.full() or self.policy is OverflowPolicy.BLOCK:
+            super().put_nowait(item)
+            return
+        self._count_drop()
+        if self.policy is OverflowPolicy.DROP_NEWEST:
+            return
+        if self.policy is OverflowPolicy.COALESCE and self._coalesce(item):
+            return
+        self.get_nowait()
+        self.task_done()
+        super().put_nowait(item)
+
+    async def put(self, item: Any) -> None:
+        if self.policy is OverflowPolicy.BLOCK:
+            await super().put(item)
+        else:
+            self.put_nowait(item)
+
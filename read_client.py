@@ -1,18 +1,25 @@
 import asyncio
+import time
+from typing import Optional
 
-from common_tools import connect, read_line_from_chat
-from gui import ReadConnectionStateChanged
+from common_tools import ChatLineParser, SocketOptions, connect, read_lines_from_chat
+from filters import MessageFilter
+from liveness import READ_CHANNEL, LivenessMonitor
+from message_bus import Message, MessageBus
+from metrics import Metrics
+from states import ReadConnectionStateChanged
 
 
 async def read_messages(
         host: str,
         port: int,
         status_update_queue: asyncio.Queue,
-        messages_queue: asyncio.Queue,
-        history_queue: asyncio.Queue,
-        watchdog_queue: asyncio.Queue,
+        message_bus: MessageBus,
+        liveness: LivenessMonitor,
         timeout: float = 1,
-        filter_bot_messages: bool = False,
+        message_filter: Optional[MessageFilter] = None,
+        socket_options: Optional[SocketOptions] = None,
+        metrics: Optional[Metrics] = None,
 ) -> None:
     """Establish connection and read messages from a chat."""
     async with connect(
@@ -21,16 +28,19 @@ async def read_messages(
         status_update_queue=status_update_queue,
         gui_state_class=ReadConnectionStateChanged,
         timeout=timeout,
+        socket_options=socket_options,
     ) as (reader, writer):
+        parser = ChatLineParser()
         while True:
-            new_message = await read_line_from_chat(reader)
-            if not new_message:
-                # Got an empty message. Usually it happens because of connection problems.
+            lines = await read_lines_from_chat(reader, parser, metrics=metrics)
+            liveness.touch(READ_CHANNEL)
+            # Empty lines are skipped, the end of connection raises ConnectionError instead.
+            received_at = time.time()
+            new_messages = [Message.parse(line, received_at) for line in lines if line]
+            if metrics:
+                metrics.messages_received.inc(len(new_messages))
+            if message_filter:
+                new_messages = message_filter.apply(new_messages)
+            if not new_messages:
                 continue
-            if filter_bot_messages:
-                name, _ = new_message.split(':', maxsplit=2)
-                if name in ('Vlad', 'Eva'):
-                    continue
-            await watchdog_queue.put('New message in chat')
-            await messages_queue.put(new_message)
-            await history_queue.put(new_message)
+            await message_bus.publish(new_messages)
@@ -7,8 +7,9 @@ from anyio import create_task_group
 
 import defaults
 from common_tools import connect
-from exceptions import MinechatException
-from gui import TkAppClosed, update_tk, SendingConnectionStateChanged
+from exceptions import MinechatException, TkAppClosed
+from gui import update_tk
+from states import SendingConnectionStateChanged
 from write_client import register
 
 
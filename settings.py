@@ -6,20 +6,96 @@ import configargparse
 
 import defaults
 from exceptions import MinechatException
+from filters import parse_pattern
+from history_rotation import COMPRESSIONS
+from message_bus import parse_subscription_limit
+from queues import parse_queue_limit
+
+
+def parse_bool(value: str) -> bool:
+    """Converts yes/no, true/false, on/off and 1/0 into a boolean."""
+    if value.lower() in ('yes', 'true', 'on', '1'):
+        return True
+    if value.lower() in ('no', 'false', 'off', '0'):
+        return False
+    raise argparse.ArgumentTypeError(f'Expected yes or no, got {value}')
+
+
+def parse_non_negative_int(value: str) -> int:
+    """Converts a whole number which is zero or more."""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'Expected a whole number, got {value}')
+    if number < 0:
+        raise argparse.ArgumentTypeError(f'Expected zero or more, got {value}')
+    return number
+
+
+def parse_positive_int(value: str) -> int:
+    """Converts a whole number which is one or more."""
+    number = parse_non_negative_int(value)
+    if not number:
+        raise argparse.ArgumentTypeError(f'Expected one or more, got {value}')
+    return number
 
 
 def create_parser() -> argparse.ArgumentParser:
     """Creates a parser to process command line arguments."""
     parser = configargparse.ArgParser('Minechat chat client', default_config_files=['minechat.conf'])
     parser.add_argument('--loglevel', type=str, choices=defaults.POSSIBLE_LOGLEVELS, help='Logging level', required=False, env_var='MINECHAT_LOGLEVEL')
+    parser.add_argument('--render-lines-per-frame', metavar='COUNT', type=int, default=defaults.RENDER_LINES_PER_FRAME, help='How many messages the chat window draws at once', env_var='MINECHAT_RENDER_LINES_PER_FRAME')
+    parser.add_argument('--scrollback-lines', metavar='COUNT', type=int, default=defaults.SCROLLBACK_LINES, help='How many messages the chat window keeps, older ones are loaded from history on scroll', env_var='MINECHAT_SCROLLBACK_LINES')
+    parser.add_argument('--tk-idle-interval', metavar='SECONDS', type=float, default=defaults.TK_IDLE_INTERVAL, help='Longest pause between checks of window events when nothing happens', env_var='MINECHAT_TK_IDLE_INTERVAL')
+    group_headless = parser.add_argument_group('Headless mode without a window')
+    group_headless.add_argument('--headless', action='store_true', default=defaults.HEADLESS, help='Run without a window, e.g. on a server', env_var='MINECHAT_HEADLESS')
+    group_headless.add_argument('--headless-output', metavar='FILEPATH', type=str, default=defaults.HEADLESS_OUTPUT, help='Where to write received messages, - means standard output', env_var='MINECHAT_HEADLESS_OUTPUT')
+    group_headless.add_argument('--headless-input', metavar='FILEPATH', type=str, default=defaults.HEADLESS_INPUT, help='Where to read messages to send, a FIFO or a file, - means standard input', env_var='MINECHAT_HEADLESS_INPUT')
+    group_headless.add_argument('--accounts', metavar='FILEPATH', type=str, default=None, help='JSON list of accounts to serve at once without a window, the token is not needed then', env_var='MINECHAT_ACCOUNTS')
+    group_metrics = parser.add_argument_group('Metrics, disabled unless a port or a dump path is set')
+    group_metrics.add_argument('--metrics-host', type=str, default=defaults.METRICS_HOST, help='Address of the metrics endpoint', env_var='MINECHAT_METRICS_HOST')
+    group_metrics.add_argument('--metrics-port', metavar='PORT', type=int, default=defaults.METRICS_PORT, help='Serve metrics in Prometheus text format on this port, 0 disables the endpoint', env_var='MINECHAT_METRICS_PORT')
+    group_metrics.add_argument('--metrics-dump-path', metavar='FILEPATH', type=str, default=defaults.METRICS_DUMP_PATH, help='JSON file which is regularly replaced with current metrics', env_var='MINECHAT_METRICS_DUMP_PATH')
+    group_metrics.add_argument('--metrics-dump-interval', metavar='SECONDS', type=float, default=defaults.METRICS_DUMP_INTERVAL, help='How often metrics are dumped', env_var='MINECHAT_METRICS_DUMP_INTERVAL')
     group_reader = parser.add_argument_group('Chat reader settings')
     group_reader.add_argument('--read-host', type=str, help='Chat address', env_var='MINECHAT_READ_HOST')
     group_reader.add_argument('--read-port', type=int, help='Chat port', env_var='MINECHAT_READ_PORT')
+    group_reader.add_argument('--read-timeout', metavar='SECONDS', type=float, default=defaults.READ_TIMEOUT, help='Reconnect if chat is silent for so long, 0 disables the check', env_var='MINECHAT_READ_TIMEOUT')
     group_reader.add_argument('--history-path', metavar='FILEPATH', type=str, help='Path to a history file', env_var='MINECHAT_HISTORY_PATH')
+    group_reader.add_argument('--history-restore-lines', metavar='COUNT', type=int, default=defaults.HISTORY_RESTORE_LINES, help='How many last messages to show on start', env_var='MINECHAT_HISTORY_RESTORE_LINES')
+    group_reader.add_argument('--history-flush-interval', metavar='SECONDS', type=float, default=defaults.HISTORY_FLUSH_INTERVAL, help='How long to collect messages before writing them into the history file', env_var='MINECHAT_HISTORY_FLUSH_INTERVAL')
+    group_reader.add_argument('--history-rotate-size', metavar='BYTES', type=int, default=defaults.HISTORY_ROTATE_SIZE, help='Start a new history segment when the file grows bigger, 0 disables rotation by size', env_var='MINECHAT_HISTORY_ROTATE_SIZE')
+    group_reader.add_argument('--history-rotate-daily', action='store_true', default=defaults.HISTORY_ROTATE_DAILY, help='Start a new history segment every day', env_var='MINECHAT_HISTORY_ROTATE_DAILY')
+    group_reader.add_argument('--history-compression', type=str, choices=COMPRESSIONS, default=defaults.HISTORY_COMPRESSION, help='How to compress closed history segments', env_var='MINECHAT_HISTORY_COMPRESSION')
+    parser.add_argument('--reconnect-min-delay', metavar='SECONDS', type=float, default=defaults.RECONNECT_MIN_DELAY, help='Delay before the first reconnect attempt', env_var='MINECHAT_RECONNECT_MIN_DELAY')
+    parser.add_argument('--reconnect-max-delay', metavar='SECONDS', type=float, default=defaults.RECONNECT_MAX_DELAY, help='Longest delay between reconnect attempts', env_var='MINECHAT_RECONNECT_MAX_DELAY')
+    group_filter = parser.add_argument_group('Message filter, lists are written as [first, second] in the config file')
+    group_filter.add_argument('--block-nicknames', metavar='NICKNAME', nargs='*', default=defaults.BLOCK_NICKNAMES, help='Hide messages of these users', env_var='MINECHAT_BLOCK_NICKNAMES')
+    group_filter.add_argument('--allow-nicknames', metavar='NICKNAME', nargs='*', default=defaults.ALLOW_NICKNAMES, help='Show only messages of these users, an empty list shows everybody', env_var='MINECHAT_ALLOW_NICKNAMES')
+    group_filter.add_argument('--block-patterns', metavar='REGEX', nargs='*', type=parse_pattern, default=defaults.BLOCK_PATTERNS, help='Hide messages matching any of these regular expressions', env_var='MINECHAT_BLOCK_PATTERNS')
+    group_filter.add_argument('--block-keywords', metavar='WORD', nargs='*', default=defaults.BLOCK_KEYWORDS, help='Hide messages containing any of these words', env_var='MINECHAT_BLOCK_KEYWORDS')
+    group_queues = parser.add_argument_group('Queue limits, SIZE:POLICY where POLICY is block, drop_oldest, drop_newest or coalesce')
+    group_queues.add_argument('--messages-queue', metavar='SIZE:POLICY', type=parse_subscription_limit, default=defaults.MESSAGES_QUEUE, help='Messages waiting to be shown, policy is block or drop_oldest', env_var='MINECHAT_MESSAGES_QUEUE')
+    group_queues.add_argument('--sending-queue', metavar='SIZE:POLICY', type=parse_queue_limit, default=defaults.SENDING_QUEUE, help='Messages waiting to be sent', env_var='MINECHAT_SENDING_QUEUE')
+    group_queues.add_argument('--status-queue', metavar='SIZE:POLICY', type=parse_queue_limit, default=defaults.STATUS_QUEUE, help='Connection status updates', env_var='MINECHAT_STATUS_QUEUE')
+    group_queues.add_argument('--history-queue', metavar='SIZE:POLICY', type=parse_subscription_limit, default=defaults.HISTORY_QUEUE, help='Messages waiting to be saved, policy is block or drop_oldest', env_var='MINECHAT_HISTORY_QUEUE')
     group_writer = parser.add_argument_group('Chat sender settings')
     group_writer.add_argument('--write-host', type=str, help='Chat write address', env_var='MINECHAT_WRITE_HOST')
     group_writer.add_argument('--write-port', type=int, help='Chat write port', env_var='MINECHAT_WRITE_PORT')
     group_writer.add_argument('--token', type=str, help='Authentication token', env_var='MINECHAT_TOKEN')
+    group_writer.add_argument('--spool-path', metavar='FILEPATH', type=str, default=defaults.SPOOL_PATH, help='Path to a file with messages which are not sent yet', env_var='MINECHAT_SPOOL_PATH')
+    group_writer.add_argument('--healthcheck-idle', metavar='SECONDS', type=float, default=defaults.HEALTHCHECK_IDLE, help='Ping the server after so many seconds without traffic', env_var='MINECHAT_HEALTHCHECK_IDLE')
+    group_writer.add_argument('--healthcheck-min-timeout', metavar='SECONDS', type=float, default=defaults.HEALTHCHECK_MIN_TIMEOUT, help='Shortest wait for a server reply, the timeout follows measured round trip time', env_var='MINECHAT_HEALTHCHECK_MIN_TIMEOUT')
+    group_writer.add_argument('--healthcheck-max-timeout', metavar='SECONDS', type=float, default=defaults.HEALTHCHECK_MAX_TIMEOUT, help='Longest wait for a server reply', env_var='MINECHAT_HEALTHCHECK_MAX_TIMEOUT')
+    group_socket = parser.add_argument_group('Socket settings of both connections')
+    group_socket.add_argument('--tcp-nodelay', metavar='BOOL', type=parse_bool, default=defaults.TCP_NODELAY, help='Send small packets without delay', env_var='MINECHAT_TCP_NODELAY')
+    group_socket.add_argument('--tcp-keepalive', metavar='BOOL', type=parse_bool, default=defaults.TCP_KEEPALIVE, help='Let the kernel check that the server is alive', env_var='MINECHAT_TCP_KEEPALIVE')
+    group_socket.add_argument('--tcp-keepidle', metavar='SECONDS', type=parse_non_negative_int, default=defaults.TCP_KEEPIDLE, help='Idle time before the first keepalive probe', env_var='MINECHAT_TCP_KEEPIDLE')
+    group_socket.add_argument('--tcp-keepintvl', metavar='SECONDS', type=parse_non_negative_int, default=defaults.TCP_KEEPINTVL, help='Interval between keepalive probes', env_var='MINECHAT_TCP_KEEPINTVL')
+    group_socket.add_argument('--tcp-keepcnt', metavar='COUNT', type=parse_non_negative_int, default=defaults.TCP_KEEPCNT, help='Unanswered keepalive probes before the connection is dropped', env_var='MINECHAT_TCP_KEEPCNT')
+    group_socket.add_argument('--tcp-user-timeout', metavar='MILLISECONDS', type=parse_non_negative_int, default=defaults.TCP_USER_TIMEOUT, help='Drop the connection if sent data is not acknowledged for so long, 0 keeps system default', env_var='MINECHAT_TCP_USER_TIMEOUT')
+    group_socket.add_argument('--socket-rcvbuf', metavar='BYTES', type=parse_non_negative_int, default=defaults.SOCKET_RCVBUF, help='Receive buffer size, 0 keeps system default', env_var='MINECHAT_SOCKET_RCVBUF')
+    group_socket.add_argument('--socket-sndbuf', metavar='BYTES', type=parse_non_negative_int, default=defaults.SOCKET_SNDBUF, help='Send buffer size, 0 keeps system default', env_var='MINECHAT_SOCKET_SNDBUF')
     return parser
 
 
@@ -50,7 +126,7 @@ def read_settings(
         parser = create_parser()
     settings = parser.parse_args(args=cmd_params)
     settings.token = settings.token or read_token_from_file(defaults.TOKEN_PATH)
-    if not settings.token:
+    if not settings.token and not settings.accounts:
         raise MinechatException(
             title='Не задан токен',
             message='Зарегистрируйтесь через python register.py или передайте токен в приложение.',
@@ -0,0 +1,146 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from exceptions import MinechatException
+
+# the journal is compacted when everything has been sent and it is bigger than this
+COMPACT_SIZE = 64 * 1024
+
+
+class OutgoingSpool:
+    """
+    Append-only journal of outgoing messages.
+
+    A message is recorded before it is sent and acknowledged after it has been written
+    to the server, so unsent messages survive reconnects, restarts and crashes.
+    One record per line: `M <seq> <json text>` for a message and `A <seq>` for an acknowledgement.
+    Records are written and synced by a writer thread, so the event loop never waits for the disk.
+    Records which arrive while the thread syncs are written together with a single sync.
+    Must be created inside a running event loop.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._pending: Dict[int, str] = OrderedDict()
+        self._next_seq = 1
+        self._has_pending = asyncio.Event()
+        # records to write, None stands for truncation of the journal
+        self._queue: List[Optional[str]] = []
+        self._queue_lock = threading.Lock()
+        self._writing = False
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._load()
+        try:
+            self._file = open(path, mode='a', encoding='utf-8')
+        except (PermissionError, IsADirectoryError):
+            raise MinechatException(
+                title='Не удаётся открыть файл',
+                message=f'Не могу открыть файл {path} для неотправленных сообщений.',
+            )
+        self._size = self._file.tell()
+        if self._pending:
+            self._has_pending.set()
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, mode='r', encoding='utf-8') as f:
+                for line in f:
+                    kind, _, rest = line.rstrip('\n').partition(' ')
+                    seq_text, _, payload = rest.partition(' ')
+                    try:
+                        seq = int(seq_text)
+                        if kind == 'M':
+                            self._pending[seq] = json.loads(payload)
+                        elif kind == 'A':
+                            self._pending.pop(seq, None)
+                    except ValueError:
+                        # the last record could be cut by a crash
+                        continue
+                    self._next_seq = max(self._next_seq, seq + 1)
+        except FileNotFoundError:
+            pass
+
+    def _enqueue(self, item: Optional[str]) -> None:
+        with self._queue_lock:
+            self._queue.append(item)
+            if self._writing:
+                # the writer thread picks the item up after the current sync
+                return
+            self._writing = True
+        self._executor.submit(self._write_queued)
+
+    def _write_queued(self) -> None:
+        """Writes queued records in order until the queue is empty, runs in the writer thread."""
+        while True:
+            with self._queue_lock:
+                if not self._queue:
+                    self._writing = False
+                    return
+                items, self._queue = self._queue, []
+            try:
+                for item in items:
+                    if item is None:
+                        self._file.flush()
+                        self._file.truncate(0)
+                        self._file.seek(0)
+                    else:
+                        self._file.write(item)
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            except OSError:
+                logging.exception(f'Can not write outgoing messages to {self.path}')
+
+    def _write_records(self, records: str) -> None:
+        self._size += len(records)
+        self._enqueue(records)
+
+    def append(self, message: str) -> int:
+        """Records a message to send and returns its sequence number."""
+        seq = self._next_seq
+        self._next_seq += 1
+        self._write_records(f'M {seq} {json.dumps(message, ensure_ascii=False)}\n')
+        self._pending[seq] = message
+        self._has_pending.set()
+        return seq
+
+    def ack(self, seqs: Iterable[int]) -> None:
+        """Marks messages as sent, they will never be sent again."""
+        seqs = [seq for seq in seqs if seq in self._pending]
+        if not seqs:
+            return
+        self._write_records(''.join(f'A {seq}\n' for seq in seqs))
+        for seq in seqs:
+            del self._pending[seq]
+        if not self._pending:
+            self._has_pending.clear()
+            if self._size > COMPACT_SIZE:
+                self._size = 0
+                self._enqueue(None)
+
+    def pending(self) -> List[Tuple[int, str]]:
+        """Messages which have not been sent yet, in order they have been written."""
+        return list(self._pending.items())
+
+    async def wait_pending(self) -> None:
+        await self._has_pending.wait()
+
+    def close(self) -> None:
+        """Waits until queued records are written and closes the journal."""
+        self._executor.shutdown(wait=True)
+        self._file.close()
+
+
+async def spool_outgoing_messages(
+        sending_queue: asyncio.Queue,
+        spool: OutgoingSpool,
+) -> None:
+    """Moves messages typed by user into the spool, so they are kept until sent."""
+    while True:
+        message = await sending_queue.get()
+        spool.append(message)
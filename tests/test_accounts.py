@@ -0,0 +1,59 @@
+import argparse
+import json
+
+import pytest
+
+from accounts import Account, load_accounts
+from exceptions import MinechatException
+
+COMMON_SETTINGS = argparse.Namespace(
+    read_host='minechat.dvmn.org',
+    read_port=5000,
+    write_host='minechat.dvmn.org',
+    write_port=5050,
+)
+
+
+def write_accounts(tmp_path, entries):
+    path = tmp_path / 'accounts.json'
+    path.write_text(json.dumps(entries), encoding='utf-8')
+    return str(path)
+
+
+def test_accounts_get_common_servers_and_own_files(tmp_path):
+    path = write_accounts(tmp_path, [
+        {'name': 'steve', 'token': 'a', 'output': 'steve.log'},
+        {'name': 'alex', 'token': 'b', 'read_host': 'localhost', 'read_port': '6000', 'history_path': 'alex.txt'},
+    ])
+    assert load_accounts(path, COMMON_SETTINGS) == [
+        Account('steve', 'a', 'minechat.dvmn.org', 5000, 'minechat.dvmn.org', 5050, 'steve.history', 'steve.spool', 'steve.log'),
+        Account('alex', 'b', 'localhost', 6000, 'minechat.dvmn.org', 5050, 'alex.txt', 'alex.spool'),
+    ]
+
+
+@pytest.mark.parametrize('entries', [
+    [],
+    {'name': 'steve', 'token': 'a'},
+    [{'name': 'steve'}],
+    [{'name': 'steve', 'token': 'a', 'read_port': 'port'}],
+    [{'name': 'steve', 'token': 'a'}, {'name': 'alex', 'token': 'b', 'history_path': 'steve.history'}],
+    [{'name': 'steve', 'token': 'a', 'input': '-'}, {'name': 'alex', 'token': 'b', 'input': '-'}],
+    [{'name': 'steve', 'token': 'a', 'output': 'chat.log'}, {'name': 'alex', 'token': 'b', 'output': 'chat.log'}],
+    [{'name': '../steve', 'token': 'a'}],
+    [{'name': 'bots/steve', 'token': 'a', 'history_path': 'steve.history'}],
+])
+def test_wrong_accounts(tmp_path, entries):
+    with pytest.raises(MinechatException):
+        load_accounts(write_accounts(tmp_path, entries), COMMON_SETTINGS)
+
+
+def test_missing_accounts_file(tmp_path):
+    with pytest.raises(MinechatException):
+        load_accounts(str(tmp_path / 'missing.json'), COMMON_SETTINGS)
+
+
+def test_name_with_separator_needs_explicit_files(tmp_path):
+    path = write_accounts(tmp_path, [
+        {'name': 'bots/steve', 'token': 'a', 'history_path': 'steve.history', 'spool_path': 'steve.spool'},
+    ])
+    assert load_accounts(path, COMMON_SETTINGS)[0].history_path == 'steve.history'
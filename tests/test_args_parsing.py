@@ -3,11 +3,50 @@ import pytest
 @pytest.mark.parametrize('arg_name, arg_value', [
     ('read-host', 'localhost'),
     ('read-port', '5050'),
+    ('read-timeout', '30'),
+    ('reconnect-min-delay', '1'),
+    ('reconnect-max-delay', '60'),
     ('history-path', '/tmp/bad.txt'),
+    ('history-restore-lines', '50'),
+    ('history-flush-interval', '0.1'),
+    ('history-rotate-size', '1048576'),
+    ('history-rotate-daily', ''),
+    ('history-compression', 'none'),
     ('write-host', 'localhost'),
     ('write-port', '5060'),
     ('token', '123-321'),
+    ('spool-path', '/tmp/minechat.spool'),
+    ('healthcheck-idle', '3'),
+    ('healthcheck-min-timeout', '0.5'),
+    ('healthcheck-max-timeout', '5'),
+    ('tcp-nodelay', 'no'),
+    ('tcp-keepalive', 'yes'),
+    ('tcp-keepidle', '60'),
+    ('tcp-keepintvl', '5'),
+    ('tcp-keepcnt', '4'),
+    ('tcp-user-timeout', '20000'),
+    ('socket-rcvbuf', '262144'),
+    ('socket-sndbuf', '65536'),
     ('loglevel', 'DEBUG'),
+    ('render-lines-per-frame', '50'),
+    ('scrollback-lines', '500'),
+    ('tk-idle-interval', '0.1'),
+    ('messages-queue', '500:drop_oldest'),
+    ('sending-queue', '10:block'),
+    ('status-queue', '10:coalesce'),
+    ('history-queue', '100:drop_oldest'),
+    ('block-nicknames', 'Bot'),
+    ('allow-nicknames', 'Friend'),
+    ('block-patterns', r'https?://'),
+    ('block-keywords', 'spam'),
+    ('headless', ''),
+    ('headless-output', '/tmp/minechat.log'),
+    ('headless-input', '/tmp/minechat.fifo'),
+    ('accounts', '/tmp/accounts.json'),
+    ('metrics-host', '0.0.0.0'),
+    ('metrics-port', '9150'),
+    ('metrics-dump-path', '/tmp/minechat.metrics.json'),
+    ('metrics-dump-interval', '30'),
 ])
 def test_command_line_arg_names(arg_parser, arg_name, arg_value):
     """Check if every command line argument is accepted."""
@@ -33,3 +72,31 @@ def test_errors_with_wrong_ports(arg_parser, int_param_name, capsys):
         arg_parser.parse_args([f'--{int_param_name}=non-int'])
     out, err = capsys.readouterr()
     assert 'invalid int value' in err
+
+
+def test_bool_socket_options(arg_parser):
+    settings = arg_parser.parse_args(['--tcp-nodelay=no', '--tcp-keepalive=yes'])
+    assert settings.tcp_nodelay is False
+    assert settings.tcp_keepalive is True
+
+
+def test_filter_lists(arg_parser):
+    settings = arg_parser.parse_args(['--block-nicknames', 'Vlad', 'Eva', '--allow-nicknames'])
+    assert settings.block_nicknames == ['Vlad', 'Eva']
+    assert settings.allow_nicknames == []
+
+
+def test_wrong_filter_pattern(arg_parser, capsys):
+    with pytest.raises(SystemExit):
+        arg_parser.parse_args(['--block-patterns', '(unclosed'])
+    out, err = capsys.readouterr()
+    assert 'Wrong regular expression' in err
+
+
+@pytest.mark.parametrize('queue_name', ['messages-queue', 'history-queue'])
+@pytest.mark.parametrize('policy', ['drop_newest', 'coalesce'])
+def test_shared_message_queues_reject_unsupported_policies(arg_parser, queue_name, policy, capsys):
+    with pytest.raises(SystemExit):
+        arg_parser.parse_args([f'--{queue_name}=10:{policy}'])
+    out, err = capsys.readouterr()
+    assert 'block, drop_oldest' in err
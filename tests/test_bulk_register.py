@@ -0,0 +1,121 @@
+import asyncio
+import json
+
+import pytest
+
+import bulk_register
+from bulk_register import (
+    Registration,
+    create_bulk_register_parser,
+    format_registrations,
+    read_nicknames,
+    register_nicknames,
+)
+
+
+class FakeRegistrationServer:
+    """Registers everybody, but drops the first attempt of nicknames starting with `flaky`."""
+
+    def __init__(self):
+        self.connections = 0
+        self.max_connections = 0
+        self.attempts = {}
+        self.order = []
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        self.max_connections = max(self.max_connections, self.connections)
+        try:
+            writer.write(b'Hello %username%! Enter your personal hash or leave it empty to create new account.\n')
+            await reader.readline()
+            writer.write(b'Enter preferred nickname below:\n')
+            nickname = (await reader.readline()).decode().strip()
+            self.attempts[nickname] = self.attempts.get(nickname, 0) + 1
+            self.order.append(nickname)
+            await asyncio.sleep(0.01)
+            if nickname.startswith('flaky') and self.attempts[nickname] == 1:
+                return
+            writer.write(json.dumps({'nickname': f'{nickname}_1', 'account_hash': f'hash-{nickname}'}).encode() + b'\n')
+            await writer.drain()
+        finally:
+            self.connections -= 1
+            writer.close()
+
+
+def run_registration(nicknames, concurrency, retries):
+    async def scenario():
+        fake_server = FakeRegistrationServer()
+        server = await asyncio.start_server(fake_server.handle, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            registrations = await register_nicknames('127.0.0.1', port, nicknames, concurrency, retries, timeout=1)
+        finally:
+            server.close()
+            await server.wait_closed()
+        return registrations, fake_server
+
+    return asyncio.run(scenario())
+
+
+def test_concurrency_is_limited():
+    nicknames = [f'bot{number}' for number in range(12)]
+    registrations, server = run_registration(nicknames, concurrency=3, retries=0)
+    assert [registration.token for registration in registrations] == [f'hash-{nickname}' for nickname in nicknames]
+    assert server.max_connections <= 3
+
+
+def test_failed_attempt_is_retried():
+    registrations, server = run_registration(['flaky', 'flaky2'], concurrency=2, retries=1)
+    assert [registration.token for registration in registrations] == ['hash-flaky', 'hash-flaky2']
+    assert server.attempts == {'flaky': 2, 'flaky2': 2}
+
+
+def test_retry_delay_does_not_hold_a_connection_slot():
+    registrations, server = run_registration(['flaky', 'bot'], concurrency=1, retries=1)
+    assert [registration.token for registration in registrations] == ['hash-flaky', 'hash-bot']
+    assert server.order == ['flaky', 'bot', 'flaky']
+
+
+def test_unexpected_error_is_recorded(monkeypatch):
+    register_nickname = bulk_register.register_nickname
+
+    async def broken_for_alex(host, port, nickname, *args):
+        if nickname == 'alex':
+            raise RuntimeError('boom')
+        return await register_nickname(host, port, nickname, *args)
+
+    monkeypatch.setattr(bulk_register, 'register_nickname', broken_for_alex)
+    registrations, _ = run_registration(['alex', 'steve'], concurrency=2, retries=0)
+    assert registrations[0].token is None
+    assert 'boom' in registrations[0].error
+    assert registrations[1].token == 'hash-steve'
+
+
+def test_error_after_last_retry():
+    [registration], _ = run_registration(['flaky'], concurrency=1, retries=0)
+    assert registration.token is None
+    assert registration.error
+
+
+def test_read_nicknames(tmp_path):
+    path = tmp_path / 'nicknames.txt'
+    path.write_text('steve\n\n# bots\nalex\n steve \n', encoding='utf-8')
+    assert read_nicknames(str(path)) == ['steve', 'alex']
+
+
+def test_output_skips_failed_registrations():
+    registrations = [Registration('steve', 'a', 'steve_1'), Registration('alex', error='timeout')]
+    assert json.loads(format_registrations(registrations, 'json')) == [{'name': 'steve', 'nickname': 'steve_1', 'token': 'a'}]
+    assert format_registrations(registrations, 'csv') == 'nickname,server_nickname,token\nsteve,steve_1,a\n'
+
+
+@pytest.mark.parametrize('option', ['--concurrency=0', '--retries=-1'])
+def test_wrong_limits_are_rejected(option):
+    with pytest.raises(SystemExit):
+        create_bulk_register_parser().parse_args(['nicknames.txt', option])
+
+
+def test_no_attempts_is_a_failure():
+    [registration], _ = run_registration(['steve'], concurrency=1, retries=-1)
+    assert registration.token is None
+    assert registration.error
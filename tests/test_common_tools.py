@@ -0,0 +1,153 @@
+import asyncio
+import socket
+from asyncio.streams import StreamWriter
+from typing import cast
+
+import pytest
+
+from common_tools import (
+    ChatLineParser,
+    CoalescingWriter,
+    SocketOptions,
+    apply_socket_options,
+    read_line_from_chat,
+    read_lines_from_chat,
+    sanitize_message,
+)
+from exceptions import MinechatException
+
+
+def test_sanitize_message():
+    assert sanitize_message(' first\nsecond\r\n') == 'first second\n'
+
+
+def test_read_line_until_eof():
+    async def scenario():
+        reader = asyncio.StreamReader()
+        reader.feed_data('Привет\n'.encode('utf-8'))
+        reader.feed_eof()
+        first_line = await read_line_from_chat(reader)
+        with pytest.raises(ConnectionError):
+            await read_line_from_chat(reader)
+        return first_line
+
+    assert asyncio.run(scenario()) == 'Привет'
+
+
+def test_parser_keeps_incomplete_line():
+    parser = ChatLineParser()
+    assert parser.feed('Привет\nВто'.encode('utf-8')[:-1]) == ['Привет']
+    assert parser.feed('Второе\n\nтре'.encode('utf-8')[5:]) == ['Второе', '']
+    assert parser.feed(b'\xd1\x82\xd1\x8c\xd0\xb5\n') == ['третье']
+
+
+def test_parser_replaces_invalid_utf8():
+    parser = ChatLineParser()
+    assert parser.feed(b'bad \xff byte\ngood\n') == ['bad \ufffd byte', 'good']
+    assert parser.decode_errors == 1
+
+
+def test_parser_cuts_too_long_line():
+    parser = ChatLineParser(max_line_size=8)
+    assert parser.feed(b'0123') == []
+    assert parser.feed(b'456789') == ['0123456789']
+    assert parser.feed(b'\n') == ['']
+
+
+def test_read_lines_until_eof():
+    async def scenario():
+        reader = asyncio.StreamReader()
+        reader.feed_data(b'first\nsecond\nthi')
+        reader.feed_eof()
+        parser = ChatLineParser()
+        lines = await read_lines_from_chat(reader, parser)
+        with pytest.raises(ConnectionError):
+            await read_lines_from_chat(reader, parser)
+        return lines
+
+    assert asyncio.run(scenario()) == ['first', 'second']
+
+
+class FakeWriter:
+    def __init__(self, drain_error=None):
+        self.writes = []
+        self.drains = 0
+        self.drain_error = drain_error
+
+    def is_closing(self):
+        return False
+
+    def write(self, data):
+        self.writes.append(data)
+
+    async def drain(self):
+        self.drains += 1
+        await asyncio.sleep(0)
+        if self.drain_error:
+            raise self.drain_error
+
+
+def coalescing_writer(writer: FakeWriter) -> CoalescingWriter:
+    return CoalescingWriter(cast(StreamWriter, writer))
+
+
+def test_lines_of_one_tick_are_written_at_once():
+    async def scenario():
+        writer = FakeWriter()
+        chat_writer = coalescing_writer(writer)
+
+        async def send(message):
+            chat_writer.write_line(message)
+            chat_writer.write_line('')
+            await chat_writer.flush()
+
+        await asyncio.gather(send('first'), send('second'))
+        chat_writer.write_raw(b'\n')
+        await chat_writer.flush()
+        return writer
+
+    writer = asyncio.run(scenario())
+    assert writer.writes == [b'first\n\nsecond\n\n', b'\n']
+    assert writer.drains == 2
+
+
+def test_failed_drain_fails_every_flush_of_the_batch():
+    async def scenario():
+        chat_writer = coalescing_writer(FakeWriter(ConnectionResetError()))
+
+        async def send(message):
+            chat_writer.write_line(message)
+            try:
+                await chat_writer.flush()
+            except ConnectionError:
+                return 'failed'
+            return 'sent'
+
+        return await asyncio.gather(send('ping'), send('user message'))
+
+    assert asyncio.run(scenario()) == ['failed', 'failed']
+
+
+def test_apply_socket_options():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        apply_socket_options(sock, SocketOptions(keepidle=42, keepcnt=5))
+        assert sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+        assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE)
+        if hasattr(socket, 'TCP_KEEPIDLE'):
+            assert sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE) == 42
+        if hasattr(socket, 'TCP_KEEPCNT'):
+            assert sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT) == 5
+
+
+def test_refused_socket_option_names_the_setting():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        with pytest.raises(MinechatException) as error:
+            apply_socket_options(sock, SocketOptions(keepidle=-1))
+    assert error.value.message is not None
+    assert '--tcp-keepidle' in error.value.message
+
+
+def test_apply_socket_options_disabled():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        apply_socket_options(sock, SocketOptions(nodelay=False, keepalive=False))
+        assert not sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE)
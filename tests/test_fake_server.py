@@ -0,0 +1,126 @@
+import asyncio
+
+import pytest
+
+from exceptions import InvalidToken
+from fake_server import MESSAGE_SENT, FakeChatServer, format_load_message, generate_load, parse_load_message
+from liveness import Healthcheck, LivenessMonitor
+from write_client import authenticate, register
+
+
+def run_with_server(scenario, tokens=None):
+    async def run():
+        async with FakeChatServer(tokens=tokens) as server:
+            return await scenario(server)
+
+    return asyncio.run(run())
+
+
+def test_posted_message_is_broadcast():
+    async def scenario(server):
+        chat_reader, chat_reader_writer = await asyncio.open_connection(server.host, server.read_port)
+        while not server.readers:
+            await asyncio.sleep(0.01)
+        reader, writer = await asyncio.open_connection(server.host, server.write_port)
+        account_info = await authenticate('secret', reader, writer, LivenessMonitor())
+        await reader.readline()  # welcome
+        writer.write(b'hello\n\n\n')
+        replies = [await reader.readline(), await reader.readline()]
+        line = await chat_reader.readline()
+        writer.close()
+        chat_reader_writer.close()
+        return account_info, replies, line
+
+    account_info, replies, line = run_with_server(scenario, tokens={'secret': 'Steve'})
+    assert account_info == {'nickname': 'Steve', 'account_hash': 'secret'}
+    # the second empty line is a ping, it is answered too
+    assert replies == [MESSAGE_SENT, MESSAGE_SENT]
+    assert line == b'Steve: hello\n'
+
+
+def test_registered_token_is_accepted():
+    async def scenario(server):
+        reader, writer = await asyncio.open_connection(server.host, server.write_port)
+        registered = await register(reader, writer, 'Alex')
+        writer.close()
+        reader, writer = await asyncio.open_connection(server.host, server.write_port)
+        account_info = await authenticate(registered['account_hash'], reader, writer, LivenessMonitor())
+        writer.close()
+        return account_info
+
+    assert run_with_server(scenario)['nickname'] == 'Alex'
+
+
+def test_authentication_seeds_round_trip_time():
+    async def scenario(server):
+        healthcheck = Healthcheck(min_timeout=0.5, max_timeout=10)
+        # a line left unanswered by a dead connection
+        healthcheck.line_sent()
+        assert healthcheck.waiting_since is not None
+        healthcheck.waiting_since -= 5
+        healthcheck.reset()
+        reader, writer = await asyncio.open_connection(server.host, server.write_port)
+        await authenticate('secret', reader, writer, LivenessMonitor(), healthcheck)
+        writer.close()
+        return healthcheck
+
+    healthcheck = run_with_server(scenario, tokens={'secret': 'Steve'})
+    assert healthcheck.srtt is not None and healthcheck.srtt < 1
+    assert healthcheck.timeout() == 0.5
+    assert healthcheck.is_overdue() is False
+
+
+def test_invalid_utf8_greeting_does_not_break_authentication():
+    async def handle(reader, writer):
+        writer.write(b'\xff\xfe hello\n')
+        await reader.readline()
+        writer.write(b'{"nickname": "Steve", "account_hash": "secret"}\n')
+        await writer.drain()
+        writer.close()
+
+    async def scenario():
+        server = await asyncio.start_server(handle, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        try:
+            return await authenticate('secret', reader, writer, LivenessMonitor())
+        finally:
+            writer.close()
+            server.close()
+            await server.wait_closed()
+
+    assert asyncio.run(scenario())['nickname'] == 'Steve'
+
+
+def test_unknown_token_is_rejected():
+    async def scenario(server):
+        reader, writer = await asyncio.open_connection(server.host, server.write_port)
+        try:
+            await authenticate('unknown', reader, writer, LivenessMonitor())
+        finally:
+            writer.close()
+
+    with pytest.raises(InvalidToken):
+        run_with_server(scenario)
+
+
+def test_generated_load_carries_send_time():
+    async def scenario(server):
+        chat_reader, chat_reader_writer = await asyncio.open_connection(server.host, server.read_port)
+        while not server.readers:
+            await asyncio.sleep(0.01)
+        sent = await generate_load(server, rate=500, duration=0.1, nicknames=['Bot'])
+        lines = [(await chat_reader.readline()).decode() for _ in range(sent)]
+        chat_reader_writer.close()
+        return sent, lines
+
+    sent, lines = run_with_server(scenario)
+    assert sent >= 40
+    parsed = [parse_load_message(line) for line in lines]
+    assert [message[0] for message in parsed if message is not None] == list(range(sent))
+    assert all(line.startswith('Bot: load ') for line in lines)
+
+
+def test_load_message_format():
+    assert parse_load_message(f'[01.01.20 10:00] Bot: {format_load_message(7, 1.5, padding=3)}') == (7, 1.5)
+    assert parse_load_message('Bot: hello') is None
@@ -0,0 +1,123 @@
+import argparse
+import asyncio
+
+import pytest
+
+from fault_proxy import Fault, FaultProxy, FaultStep, parse_fault_step, run_schedule
+
+
+async def echo(reader, writer):
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        writer.write(line)
+        await writer.drain()
+    writer.close()
+
+
+def run_with_proxy(scenario):
+    async def run():
+        server = await asyncio.start_server(echo, '127.0.0.1', 0)
+        try:
+            async with FaultProxy('127.0.0.1', server.sockets[0].getsockname()[1]) as proxy:
+                return await scenario(proxy)
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    return asyncio.run(run())
+
+
+async def read_line(reader, timeout=1.0):
+    return await asyncio.wait_for(reader.readline(), timeout)
+
+
+def test_data_is_forwarded():
+    async def scenario(proxy):
+        reader, writer = await asyncio.open_connection(proxy.host, proxy.port)
+        writer.write(b'ping\n')
+        line = await read_line(reader)
+        writer.close()
+        return line
+
+    assert run_with_proxy(scenario) == b'ping\n'
+
+
+def test_drop_closes_connections():
+    async def scenario(proxy):
+        reader, writer = await asyncio.open_connection(proxy.host, proxy.port)
+        proxy.set_fault(Fault.DROP)
+        old_connection_line = await read_line(reader)
+        reader, writer = await asyncio.open_connection(proxy.host, proxy.port)
+        new_connection_line = await read_line(reader)
+        writer.close()
+        return old_connection_line, new_connection_line
+
+    assert run_with_proxy(scenario) == (b'', b'')
+
+
+def test_stall_holds_data_until_cleared():
+    async def scenario(proxy):
+        reader, writer = await asyncio.open_connection(proxy.host, proxy.port)
+        proxy.set_fault(Fault.STALL)
+        writer.write(b'ping\n')
+        with pytest.raises(asyncio.TimeoutError):
+            await read_line(reader, timeout=0.2)
+        proxy.clear_fault()
+        line = await read_line(reader)
+        writer.close()
+        return line
+
+    assert run_with_proxy(scenario) == b'ping\n'
+
+
+def test_half_close_ends_data_to_client_only():
+    async def scenario(proxy):
+        reader, writer = await asyncio.open_connection(proxy.host, proxy.port)
+        proxy.set_fault(Fault.HALF_CLOSE)
+        line = await read_line(reader)
+        writer.write(b'still sent\n')
+        for _ in range(100):
+            if proxy.forwarded_bytes:
+                break
+            await asyncio.sleep(0.01)
+        writer.close()
+        return line, proxy.forwarded_bytes
+
+    line, forwarded_bytes = run_with_proxy(scenario)
+    assert line == b''
+    assert forwarded_bytes >= len(b'still sent\n')
+
+
+def test_schedule_breaks_named_proxy_only():
+    class FakeProxy:
+        def __init__(self):
+            self.faults = []
+
+        def set_fault(self, fault):
+            self.faults.append(fault)
+
+        def clear_fault(self):
+            self.faults.append(Fault.NONE)
+
+    proxies = {'read': FakeProxy(), 'write': FakeProxy()}
+    steps = [FaultStep(0.02, Fault.DROP, 0.01, 'write'), FaultStep(0, Fault.STALL, 0.01)]
+    applied = asyncio.run(run_schedule(proxies, steps))
+    assert [fault.step.fault for fault in applied] == [Fault.STALL, Fault.DROP]
+    assert all(fault.ended_at > fault.started_at for fault in applied)
+    assert proxies['read'].faults == [Fault.STALL, Fault.NONE]
+    assert proxies['write'].faults == [Fault.STALL, Fault.NONE, Fault.DROP, Fault.NONE]
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('5:stall:10', FaultStep(5, Fault.STALL, 10)),
+    ('1.5:read:half_close:2', FaultStep(1.5, Fault.HALF_CLOSE, 2, 'read')),
+])
+def test_parse_fault_step(value, expected):
+    assert parse_fault_step(value) == expected
+
+
+def test_parse_unknown_fault():
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_fault_step('5:explode:10')
@@ -0,0 +1,38 @@
+from filters import MessageFilter
+from message_bus import Message
+
+
+def apply(message_filter, lines):
+    return [message.text for message in message_filter.apply(Message.parse(line) for line in lines)]
+
+
+def test_blocked_nicknames_ignore_case():
+    message_filter = MessageFilter(block_nicknames=['Vlad', 'Eva'])
+    messages = ['vlad: hi', 'Eva: a: b', 'Anna: hello', 'Server message']
+    assert apply(message_filter, messages) == ['Anna: hello', 'Server message']
+    assert message_filter.hits == {'nickname:vlad': 1, 'nickname:eva': 1}
+
+
+def test_allowlist_keeps_messages_without_nickname():
+    message_filter = MessageFilter(allow_nicknames=['Anna'])
+    assert apply(message_filter, ['Anna: hello', 'Bob: hi', 'Server message']) == ['Anna: hello', 'Server message']
+    assert message_filter.hits == {'allowlist': 1}
+
+
+def test_patterns_and_keywords_count_own_hits():
+    message_filter = MessageFilter(block_patterns=[r'https?://'], block_keywords=['buy'])
+    messages = [
+        'Bob: see http://spam',
+        'Bob: BUY now',
+        'Bob: buyer is here',
+        'Bob: buy http://spam',
+    ]
+    assert apply(message_filter, messages) == ['Bob: buyer is here']
+    assert message_filter.hits == {'pattern:https?://': 1, 'keyword:buy': 2}
+    assert message_filter.dropped == 3
+
+
+def test_empty_filter():
+    message_filter = MessageFilter()
+    assert not message_filter
+    assert apply(message_filter, ['Bob: hi']) == ['Bob: hi']
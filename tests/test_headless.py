@@ -0,0 +1,59 @@
+import asyncio
+import contextlib
+import os
+from datetime import datetime
+
+from headless import print_messages, read_outgoing_messages
+from message_bus import Message, MessageBus
+
+
+def test_print_messages_to_file(tmp_path):
+    path = str(tmp_path / 'chat.log')
+
+    async def scenario():
+        bus = MessageBus()
+        subscription = bus.subscribe('messages')
+        received_at = datetime(2020, 1, 1, 10, 0).timestamp()
+        bus.publish_nowait([Message('Steve', 'hi', received_at), Message('', 'Server message', received_at)])
+        task = asyncio.ensure_future(print_messages(subscription, path))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    assert open(path, encoding='utf-8').read() == '[01.01.20 10:00] Steve: hi\n[01.01.20 10:00] Server message\n'
+
+
+def test_read_outgoing_messages_from_file(tmp_path):
+    path = tmp_path / 'outgoing.txt'
+    path.write_text('first\n\n  second  \n', encoding='utf-8')
+
+    async def scenario():
+        queue: 'asyncio.Queue[str]' = asyncio.Queue()
+        await read_outgoing_messages(queue, str(path))
+        return [queue.get_nowait() for _ in range(queue.qsize())]
+
+    assert asyncio.run(scenario()) == ['first', 'second']
+
+
+def test_read_outgoing_messages_from_fifo(tmp_path):
+    path = str(tmp_path / 'minechat.fifo')
+    os.mkfifo(path)
+
+    async def scenario():
+        queue: 'asyncio.Queue[str]' = asyncio.Queue()
+        task = asyncio.ensure_future(read_outgoing_messages(queue, path))
+        await asyncio.sleep(0.01)
+        with open(path, 'w', encoding='utf-8') as fifo:
+            fifo.write('hello\n')
+        message = await asyncio.wait_for(queue.get(), timeout=1)
+        # the FIFO stays open after the writer has gone
+        await asyncio.sleep(0.01)
+        assert not task.done()
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+        return message
+
+    assert asyncio.run(scenario()) == 'hello'
@@ -0,0 +1,227 @@
+import asyncio
+import contextlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import List
+
+import pytest
+
+import history_client
+from history_client import (
+    HistoryPager,
+    HistoryPosition,
+    read_history_before,
+    read_history_tail,
+    restore_history,
+    save_history,
+)
+from history_rotation import HistoryFile, compress_segment, open_segment, read_manifest, segment_path, write_manifest
+from message_bus import Message, MessageBus
+
+
+@pytest.fixture()
+def history_file(tmp_path):
+    path = tmp_path / 'minechat.history'
+    path.write_text(''.join(f'[01.01.20 10:00] user: message {i}\n' for i in range(10)), encoding='utf-8')
+    yield str(path)
+
+
+def test_tail_returns_last_lines(history_file):
+    lines, offset = read_history_tail(history_file, 3)
+    assert lines == [f'[01.01.20 10:00] user: message {i}' for i in (7, 8, 9)]
+    with open(history_file, 'rb') as f:
+        f.seek(offset)
+        assert f.readline().decode().strip() == lines[0]
+
+
+def test_tail_pages_back_to_the_start(history_file):
+    restored: List[str] = []
+    lines, offset = read_history_tail(history_file, 4)
+    while lines:
+        restored = lines + restored
+        lines, offset = read_history_tail(history_file, 4, offset)
+    assert offset == 0
+    assert restored == [f'[01.01.20 10:00] user: message {i}' for i in range(10)]
+
+
+def test_tail_with_small_blocks(history_file, monkeypatch):
+    monkeypatch.setattr(history_client, 'READ_BLOCK_SIZE', 7)
+    lines, _ = read_history_tail(history_file, 2)
+    assert lines == ['[01.01.20 10:00] user: message 8', '[01.01.20 10:00] user: message 9']
+
+
+def test_tail_of_missing_file(tmp_path):
+    assert read_history_tail(str(tmp_path / 'missing.history'), 10) == ([], 0)
+
+
+def run_save_history(path, messages, flush_interval, run_for=0.05):
+    async def scenario():
+        bus = MessageBus()
+        subscription = bus.subscribe('history')
+        bus.publish_nowait(Message.parse(message) for message in messages)
+        task = asyncio.ensure_future(save_history(path, subscription, flush_interval))
+        await asyncio.sleep(run_for)
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+    asyncio.run(scenario())
+
+
+def test_save_history_writes_batch(tmp_path):
+    path = str(tmp_path / 'minechat.history')
+    run_save_history(path, ['user: one', 'user: two', 'user: three'], flush_interval=0)
+    lines = open(path, encoding='utf-8').read().splitlines()
+    assert [line.split('] ', maxsplit=1)[1] for line in lines] == ['user: one', 'user: two', 'user: three']
+
+
+def test_save_history_uses_receive_time(tmp_path):
+    path = str(tmp_path / 'minechat.history')
+
+    async def scenario():
+        bus = MessageBus()
+        subscription = bus.subscribe('history')
+        bus.publish_nowait([Message('user', 'old', datetime(2020, 1, 1, 10, 0).timestamp())])
+        task = asyncio.ensure_future(save_history(path, subscription, flush_interval=0))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+    asyncio.run(scenario())
+    assert open(path, encoding='utf-8').read() == '[01.01.20 10:00] user: old\n'
+
+
+def test_restore_history_publishes_messages(history_file):
+    async def scenario():
+        bus = MessageBus()
+        subscription = bus.subscribe('messages')
+        await restore_history(history_file, bus, lines_count=2)
+        return [subscription.get_nowait() for _ in range(subscription.qsize())]
+
+    messages = asyncio.run(scenario())
+    assert [str(message) for message in messages] == ['[01.01.20 10:00] user: message 8', '[01.01.20 10:00] user: message 9']
+    assert [message.nickname for message in messages] == ['user', 'user']
+
+
+def test_save_history_flushes_on_shutdown(tmp_path):
+    path = str(tmp_path / 'minechat.history')
+    run_save_history(path, ['user: one', 'user: two'], flush_interval=60)
+    assert len(open(path, encoding='utf-8').read().splitlines()) == 2
+
+
+def test_save_history_writes_queued_chunk_on_cancel(tmp_path, monkeypatch):
+    path = str(tmp_path / 'minechat.history')
+
+    def busy_executor(max_workers):
+        """Keeps the thread busy, so a chunk is queued but not started when the task is cancelled."""
+        executor = ThreadPoolExecutor(max_workers)
+        submit = executor.submit
+
+        def submit_after_pause(fn, *args, **kwargs):
+            if getattr(fn, '__name__', '') == 'write':
+                submit(time.sleep, 0.2)
+            return submit(fn, *args, **kwargs)
+
+        monkeypatch.setattr(executor, 'submit', submit_after_pause)
+        return executor
+
+    monkeypatch.setattr(history_client, 'ThreadPoolExecutor', busy_executor)
+    run_save_history(path, ['user: one', 'user: two'], flush_interval=0)
+    assert len(open(path, encoding='utf-8').read().splitlines()) == 2
+
+
+def test_rotated_history_is_restored_across_segments(tmp_path):
+    path = str(tmp_path / 'minechat.history')
+    history_file = HistoryFile(path, rotate_size=100)
+    for i in range(10):
+        history_file.write(f'[01.01.20 10:00] user: message {i}\n', 1, datetime(2020, 1, 1, 10, 0))
+    history_file.close()
+    for segment in read_manifest(path):
+        compress_segment(path, segment['number'])
+
+    segments = read_manifest(path)
+    assert len(segments) > 1
+    assert sum(segment['lines'] for segment in segments) < 10
+    lines, position = read_history_before(path, 10)
+    assert lines == [f'[01.01.20 10:00] user: message {i}' for i in range(10)]
+    assert read_history_before(path, 10, position) == ([], position)
+
+
+def test_rotation_interrupted_after_manifest_is_finished(tmp_path):
+    path = str(tmp_path / 'minechat.history')
+    history_file = HistoryFile(path, rotate_size=100)
+    for i in range(10):
+        history_file.write(f'[01.01.20 10:00] user: message {i}\n', 1, datetime(2020, 1, 1, 10, 0))
+    history_file.close()
+    # a crash after the manifest has got the active file as a new segment, but before the rename
+    segments = read_manifest(path)
+    segments.append({'number': segments[-1]['number'] + 1, 'first': None, 'last': None, 'lines': 1})
+    write_manifest(path, segments)
+
+    async def restore():
+        return await restore_history(path, MessageBus(), lines_count=10)
+
+    position = asyncio.run(restore())
+    assert read_history_before(path, 10) == ([f'[01.01.20 10:00] user: message {i}' for i in range(10)], position)
+    assert HistoryFile(path).segment == segments[-1]['number'] + 1
+
+
+def test_segment_compressed_while_opened_is_read(tmp_path, monkeypatch):
+    path = str(tmp_path / 'minechat.history')
+    with open(segment_path(path, 1), 'w', encoding='utf-8') as f:
+        f.write('[01.01.20 10:00] user: packed\n')
+    compress_segment(path, 1)
+    isfile = os.path.isfile
+    checked = []
+
+    def compressed_later(checked_path):
+        # the first check runs before the compressor has replaced the raw file
+        checked.append(checked_path)
+        return len(checked) > 1 and isfile(checked_path)
+
+    monkeypatch.setattr(os.path, 'isfile', compressed_later)
+    segment = open_segment(path, 1)
+    assert segment is not None
+    with segment:
+        assert segment.read() == b'[01.01.20 10:00] user: packed\n'
+
+
+def test_pager_returns_trimmed_lines_first(history_file):
+    async def scenario():
+        _, position = read_history_tail(history_file, 4)
+        pager = HistoryPager(history_file, HistoryPosition(1, position))
+        # the panel has shown messages 6..9 and dropped 6 and 7
+        pager.skip(2)
+        first_page = await pager.load_older(3)
+        second_page = await pager.load_older(3)
+        return first_page, second_page
+
+    first_page, second_page = asyncio.run(scenario())
+    assert [line[-1] for line in first_page] == ['5', '6', '7']
+    assert [line[-1] for line in second_page] == ['2', '3', '4']
+
+
+def test_pager_finds_top_message_by_seq(history_file):
+    async def scenario():
+        bus = MessageBus()
+        pager = HistoryPager(history_file)
+        # messages 8 and 9 are restored with seqs 1 and 2
+        await restore_history(history_file, bus, lines_count=2, history_pager=pager)
+        subscription = bus.subscribe('history')
+        task = asyncio.ensure_future(save_history(history_file, subscription, 0, history_pager=pager))
+        not_written_page = await pager.load_older(3, top_seq=3)
+        # the panel may skip live messages, the history still has them
+        bus.publish_nowait(Message('user', f'live {i}') for i in range(4))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+        page_before_live = await pager.load_older(3, top_seq=5)
+        page_before_restored = await pager.load_older(3, top_seq=2)
+        return not_written_page, page_before_live, page_before_restored
+
+    not_written_page, page_before_live, page_before_restored = asyncio.run(scenario())
+    assert not_written_page == []
+    assert [line.split('] ')[1] for line in page_before_live] == ['user: message 9', 'user: live 0', 'user: live 1']
+    assert [line[-1] for line in page_before_restored] == ['6', '7', '8']
@@ -0,0 +1,38 @@
+from datetime import datetime
+
+import pytest
+
+from history_index import HistoryIndex
+from message_bus import Message
+
+
+@pytest.fixture()
+def history_index(tmp_path):
+    index = HistoryIndex(str(tmp_path / 'minechat.history'))
+    first_day = datetime(2020, 4, 1, 10, 0).timestamp()
+    index.add_messages([
+        Message('Steve', 'found a Diamond!', first_day),
+        Message('Alex', 'diamond pickaxe', first_day),
+        Message('Steve', 'hello', first_day),
+    ])
+    index.add_messages([Message('Steve', 'diamonds everywhere', datetime(2020, 4, 2, 10, 0).timestamp())])
+    yield index
+    index.close()
+
+
+def test_search_by_user_and_word(history_index):
+    found = history_index.search(user='steve', text='diamond')
+    assert [str(message) for message in found] == ['[01.04.20 10:00] Steve: found a Diamond!']
+
+
+def test_search_since(history_index):
+    found = history_index.search(user='Steve', since=datetime(2020, 4, 2))
+    assert [message.body for message in found] == ['diamonds everywhere']
+
+
+def test_index_history_lines(history_index):
+    history_index.clear()
+    history_index.add_history_lines(['[03.04.20 12:30] Alex: new diamond', 'broken line'])
+    found = history_index.search(text='diamond')
+    assert found[0].created_at == datetime(2020, 4, 3, 12, 30)
+    assert len(found) == 1
@@ -0,0 +1,27 @@
+import subprocess
+import sys
+
+CORE_MODULES = [
+    'common_tools',
+    'read_client',
+    'write_client',
+    'watchdog',
+    'history_client',
+    'message_bus',
+    'spool',
+    'headless',
+    'settings',
+    'main',
+]
+
+
+def test_core_does_not_load_tk():
+    code = f'import sys, {", ".join(CORE_MODULES)}; print(sorted(m for m in sys.modules if "tkinter" in m))'
+    result = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, universal_newlines=True, check=True)
+    assert result.stdout.strip() == '[]'
+
+
+def test_read_path_does_not_load_history_storage():
+    code = 'import sys, read_client; print(sorted(m for m in ("gzip", "sqlite3") if m in sys.modules))'
+    result = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, universal_newlines=True, check=True)
+    assert result.stdout.strip() == '[]'
@@ -0,0 +1,47 @@
+import time
+
+from liveness import Healthcheck, LivenessMonitor
+
+
+def test_idle_time_of_the_freshest_channel():
+    liveness = LivenessMonitor()
+    liveness.last_seen['read'] = time.monotonic() - 10
+    liveness.touch('write')
+    assert liveness.idle_time(['read', 'write']) < 1
+    assert liveness.idle_time(['read']) >= 10
+
+
+def test_idle_time_is_counted_from_start_of_watching():
+    liveness = LivenessMonitor()
+    assert liveness.idle_time(['read'], since=time.monotonic()) < 1
+
+
+def test_report_counts_events_since_previous_report():
+    liveness = LivenessMonitor()
+    for _ in range(3):
+        liveness.touch('read')
+    assert liveness.report()['read']['events'] == 3
+    liveness.touch('read')
+    report = liveness.report()
+    assert report['read']['events'] == 4
+    assert report['read']['rate'] > 0
+
+
+def test_healthcheck_timeout_follows_rtt():
+    healthcheck = Healthcheck(min_timeout=0.5, max_timeout=10)
+    assert healthcheck.timeout() == 10
+    for _ in range(20):
+        healthcheck.line_sent()
+        healthcheck.reply_received()
+    assert healthcheck.timeout() == 0.5
+    assert healthcheck.is_overdue() is False
+
+
+def test_healthcheck_unanswered_line_is_overdue():
+    healthcheck = Healthcheck(min_timeout=0.5, max_timeout=1)
+    healthcheck.line_sent()
+    assert healthcheck.waiting_since is not None
+    healthcheck.waiting_since -= 2
+    assert healthcheck.is_overdue() is True
+    healthcheck.reset()
+    assert healthcheck.is_overdue() is False
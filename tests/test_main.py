@@ -0,0 +1,69 @@
+import asyncio
+import contextlib
+
+import main
+from accounts import Account
+from fake_server import FakeChatServer
+from filters import MessageFilter
+from main import get_chat_settings, run_chat_internals
+from settings import read_settings
+
+
+def test_headless_client_posts_and_receives(tmp_path, arg_parser):
+    output_path = tmp_path / 'chat.log'
+    history_path = tmp_path / 'minechat.history'
+    input_path = tmp_path / 'outgoing.txt'
+    input_path.write_text('hello\n', encoding='utf-8')
+
+    async def scenario():
+        async with FakeChatServer(tokens={'secret': 'Steve'}) as server:
+            settings = read_settings(arg_parser, cmd_params=[
+                '--headless',
+                f'--headless-output={output_path}',
+                f'--headless-input={input_path}',
+                f'--history-path={history_path}',
+                f'--spool-path={tmp_path / "minechat.spool"}',
+                '--token=secret',
+                f'--read-host={server.host}',
+                f'--read-port={server.read_port}',
+                f'--write-host={server.host}',
+                f'--write-port={server.write_port}',
+            ])
+            task = asyncio.ensure_future(run_chat_internals(**get_chat_settings(settings)))
+            try:
+                for _ in range(100):
+                    await asyncio.sleep(0.05)
+                    if task.done():
+                        break
+                    # the message is shown and saved
+                    with contextlib.suppress(FileNotFoundError):
+                        if all('Steve: hello' in path.read_text(encoding='utf-8') for path in (output_path, history_path)):
+                            break
+            finally:
+                task.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await task
+
+    asyncio.run(scenario())
+    assert output_path.read_text(encoding='utf-8').endswith('Steve: hello\n')
+    assert history_path.read_text(encoding='utf-8').endswith('Steve: hello\n')
+
+
+def test_failed_account_does_not_stop_others(monkeypatch, caplog):
+    finished = []
+
+    async def run_chat_internals(**chat_settings):
+        if chat_settings['account_name'] == 'broken':
+            raise RuntimeError('broken account')
+        await asyncio.sleep(0.01)
+        finished.append(chat_settings['account_name'])
+
+    monkeypatch.setattr(main, 'run_chat_internals', run_chat_internals)
+    accounts = [
+        Account(name, name, 'localhost', 5000, 'localhost', 5050, f'{name}.history', f'{name}.spool')
+        for name in ('broken', 'working')
+    ]
+    chat_settings = {'metrics': None, 'message_filter': MessageFilter()}
+    asyncio.run(main.run_accounts(accounts, chat_settings))
+    assert finished == ['working']
+    assert 'broken: stopped by an unexpected error' in caplog.text
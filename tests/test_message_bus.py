@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+from message_bus import Message, MessageBus
+from queues import OverflowPolicy, QueueLimit
+
+
+def test_subscription_rejects_unsupported_policy():
+    with pytest.raises(ValueError):
+        MessageBus().subscribe('messages', QueueLimit(10, OverflowPolicy.COALESCE))
+
+
+def test_parse_message():
+    message = Message.parse('Steve: hi: there', received_at=1.0)
+    assert (message.nickname, message.body, message.received_at) == ('Steve', 'hi: there', 1.0)
+    assert str(message) == 'Steve: hi: there'
+    assert Message.parse('Server message').nickname == ''
+
+
+def test_restored_message_keeps_time():
+    message = Message.from_history_line('[31.12.20 23:59] Steve: hi')
+    assert (message.nickname, message.body, message.restored) == ('Steve', 'hi', True)
+    assert str(message) == '[31.12.20 23:59] Steve: hi'
+    assert str(Message.from_history_line('broken line')) == 'broken line'
+
+
+def test_every_subscriber_gets_same_messages():
+    bus = MessageBus()
+    first = bus.subscribe('first')
+    bus.publish_nowait([Message.parse('a: 1')])
+    second = bus.subscribe('second')
+    bus.publish_nowait([Message.parse('a: 2'), Message.parse('a: 3')])
+
+    first_messages = [first.get_nowait() for _ in range(first.qsize())]
+    second_messages = [second.get_nowait() for _ in range(second.qsize())]
+    assert [message.seq for message in first_messages] == [1, 2, 3]
+    assert second_messages == first_messages[1:]
+    with pytest.raises(asyncio.QueueEmpty):
+        first.get_nowait()
+    assert len(bus._messages) == 0
+
+
+def test_lagging_subscriber_skips_oldest():
+    bus = MessageBus()
+    slow = bus.subscribe('slow', QueueLimit(2, OverflowPolicy.DROP_OLDEST))
+    bus.publish_nowait(Message.parse(f'a: {i}') for i in range(5))
+    assert [slow.get_nowait().body for _ in range(slow.qsize())] == ['3', '4']
+    assert slow.dropped == 3
+
+
+def test_blocking_subscriber_holds_publisher():
+    async def scenario():
+        bus = MessageBus()
+        subscription = bus.subscribe('history', QueueLimit(1, OverflowPolicy.BLOCK))
+        publishing = asyncio.ensure_future(bus.publish([Message.parse('a: 1'), Message.parse('a: 2')]))
+        await asyncio.sleep(0)
+        assert not publishing.done()
+        first = await subscription.get()
+        await publishing
+        second = await subscription.get()
+        return [first.body, second.body]
+
+    assert asyncio.run(scenario()) == ['1', '2']
+
+
+def test_get_waits_for_publish():
+    async def scenario():
+        bus = MessageBus()
+        subscription = bus.subscribe('messages')
+        getting = asyncio.ensure_future(subscription.get())
+        await asyncio.sleep(0)
+        bus.publish_nowait([Message.parse('a: 1')])
+        return (await getting).body
+
+    assert asyncio.run(scenario()) == '1'
@@ -0,0 +1,136 @@
+import asyncio
+import contextlib
+import json
+from typing import Any
+
+from fake_server import FakeChatServer
+from liveness import LivenessMonitor
+from message_bus import Message, MessageBus
+from metrics import Histogram, Metrics, dump_metrics, format_json, format_prometheus, handle_metrics_request
+from queues import BoundedQueue
+from read_client import read_messages
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram([0.1, 1])
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value)
+    assert histogram.cumulative_counts() == [('0.1', 2), ('1', 3), ('+Inf', 4)]
+    assert histogram.count == 4
+    assert histogram.sum == 3.65
+
+
+def test_prometheus_format():
+    metrics = Metrics()
+    metrics.messages_received.inc(3)
+    metrics.healthcheck_rtt_seconds.observe(0.02)
+    text = format_prometheus(metrics)
+    assert '# TYPE minechat_messages_received_total counter\nminechat_messages_received_total 3\n' in text
+    assert 'minechat_healthcheck_rtt_seconds_bucket{le="0.025"} 1\n' in text
+    assert 'minechat_healthcheck_rtt_seconds_bucket{le="0.01"} 0\n' in text
+    assert 'minechat_healthcheck_rtt_seconds_count 1\n' in text
+
+
+def test_large_counter_keeps_every_digit():
+    metrics = Metrics()
+    metrics.bytes_received.inc(12345678)
+    metrics.healthcheck_rtt_seconds.observe(1234567.25)
+    assert 'minechat_bytes_received_total 12345678\n' in format_prometheus(metrics)
+    metrics.bytes_received.inc(40)
+    text = format_prometheus(metrics)
+    assert 'minechat_bytes_received_total 12345718\n' in text
+    assert 'minechat_healthcheck_rtt_seconds_sum 1234567.25\n' in text
+
+
+def test_queues_are_read_at_export():
+    metrics = Metrics()
+    queue = BoundedQueue('sending', 10)
+    metrics.watch_queue(queue)
+    queue.put_nowait('hello')
+    assert 'minechat_queue_depth{queue="sending"} 1\n' in format_prometheus(metrics)
+
+
+def test_children_have_labels():
+    metrics = Metrics()
+    metrics.child(account='steve').messages_sent.inc()
+    metrics.child(account='alex')
+    text = format_prometheus(metrics)
+    # a metric is described once and the parent has no samples of its own
+    assert text.count('# TYPE minechat_messages_sent_total counter') == 1
+    assert 'minechat_messages_sent_total{account="steve"} 1\n' in text
+    assert 'minechat_messages_sent_total{account="alex"} 0\n' in text
+    assert 'minechat_messages_sent_total 0' not in text
+
+
+def test_render_lag_skips_restored_messages():
+    metrics = Metrics()
+    metrics.messages_shown([Message('Steve', 'hi'), Message('Steve', 'old', 0, restored=True)])
+    assert metrics.render_lag_seconds.count == 1
+
+
+def test_http_endpoint():
+    metrics = Metrics()
+    metrics.bytes_received.inc(42)
+
+    async def request(path):
+        server = await asyncio.start_server(
+            lambda reader, writer: handle_metrics_request(metrics, reader, writer),
+            '127.0.0.1',
+            0,
+        )
+        reader, writer = await asyncio.open_connection('127.0.0.1', server.sockets[0].getsockname()[1])
+        writer.write(f'GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n'.encode())
+        response = await reader.read()
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        return response.decode()
+
+    response = asyncio.run(request('/metrics'))
+    assert response.startswith('HTTP/1.0 200 OK\r\n')
+    assert 'minechat_bytes_received_total 42\n' in response
+    assert asyncio.run(request('/favicon.ico')).startswith('HTTP/1.0 404')
+
+
+def test_dump_is_written_when_cancelled(tmp_path):
+    path = str(tmp_path / 'metrics.json')
+    metrics = Metrics()
+    metrics.messages_sent.inc(2)
+
+    async def scenario():
+        task = asyncio.ensure_future(dump_metrics(metrics, path, interval=60))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    with open(path, encoding='utf-8') as f:
+        dumped = json.load(f)
+    assert dumped['minechat_messages_sent_total'] == [{'labels': {}, 'value': 2}]
+    assert dumped == {**format_json(metrics), 'time': dumped['time']}
+
+
+def test_received_messages_and_bytes_are_counted():
+    metrics = Metrics()
+
+    async def scenario():
+        async with FakeChatServer() as server:
+            bus = MessageBus()
+            subscription = bus.subscribe('messages')
+            status_queue: 'asyncio.Queue[Any]' = asyncio.Queue()
+            task = asyncio.ensure_future(read_messages(
+                server.host, server.read_port, status_queue, bus, LivenessMonitor(), 1, None, None, metrics,
+            ))
+            while not server.readers:
+                await asyncio.sleep(0.01)
+            await server.broadcast(['Steve: hi', 'Alex: hello'])
+            for _ in range(2):
+                await asyncio.wait_for(subscription.get(), 1)
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+
+    asyncio.run(scenario())
+    assert metrics.messages_received.value == 2
+    assert metrics.bytes_received.value == len(b'Steve: hi\nAlex: hello\n')
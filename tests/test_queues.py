@@ -0,0 +1,51 @@
+import argparse
+import asyncio
+
+import pytest
+
+from queues import BoundedQueue, OverflowPolicy, QueueLimit, parse_queue_limit
+
+
+def fill(queue, items):
+    for item in items:
+        queue.put_nowait(item)
+    return [queue.get_nowait() for _ in range(queue.qsize())]
+
+
+def test_drop_oldest():
+    queue = BoundedQueue('test', 2, OverflowPolicy.DROP_OLDEST)
+    assert fill(queue, [1, 2, 3, 4]) == [3, 4]
+    assert queue.dropped == 2
+
+
+def test_drop_newest():
+    queue = BoundedQueue('test', 2, OverflowPolicy.DROP_NEWEST)
+    assert fill(queue, [1, 2, 3, 4]) == [1, 2]
+    assert queue.dropped == 2
+
+
+def test_coalesce_replaces_item_of_the_same_type():
+    queue = BoundedQueue('test', 2, OverflowPolicy.COALESCE)
+    assert fill(queue, [1, 'a', 2, 'b']) == [2, 'b']
+    assert queue.dropped == 2
+
+
+def test_block_raises_on_put_nowait():
+    queue = BoundedQueue('test', 1, OverflowPolicy.BLOCK)
+    queue.put_nowait(1)
+    with pytest.raises(asyncio.QueueFull):
+        queue.put_nowait(2)
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('10:drop_oldest', QueueLimit(10, OverflowPolicy.DROP_OLDEST)),
+    ('5', QueueLimit(5, OverflowPolicy.BLOCK)),
+])
+def test_parse_queue_limit(value, expected):
+    assert parse_queue_limit(value) == expected
+
+
+def test_parse_wrong_queue_limit():
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_queue_limit('10:forget')
+
@@ -1,3 +1,5 @@
+import pytest
+
 from settings import read_settings
 
 def test_parse_args_has_called(mocker):
@@ -17,12 +19,63 @@ def test_settings_key_names(arg_parser):
     settings = read_settings(arg_parser, cmd_params=[])
 
     assert set(settings.__dict__.keys()) == {
+        'accounts',
+        'allow_nicknames',
+        'block_keywords',
+        'block_nicknames',
+        'block_patterns',
+        'headless',
+        'headless_input',
+        'headless_output',
+        'healthcheck_idle',
+        'healthcheck_max_timeout',
+        'healthcheck_min_timeout',
+        'history_compression',
+        'history_flush_interval',
         'history_path',
+        'history_queue',
+        'history_restore_lines',
+        'history_rotate_daily',
+        'history_rotate_size',
         'loglevel',
+        'messages_queue',
+        'metrics_dump_interval',
+        'metrics_dump_path',
+        'metrics_host',
+        'metrics_port',
         'read_host',
         'read_port',
+        'read_timeout',
+        'reconnect_max_delay',
+        'reconnect_min_delay',
+        'render_lines_per_frame',
+        'scrollback_lines',
+        'sending_queue',
+        'socket_rcvbuf',
+        'socket_sndbuf',
+        'spool_path',
+        'status_queue',
+        'tcp_keepalive',
+        'tcp_keepcnt',
+        'tcp_keepidle',
+        'tcp_keepintvl',
+        'tcp_nodelay',
+        'tcp_user_timeout',
+        'tk_idle_interval',
         'token',
         'write_host',
         'write_port',
     }
 
+
+
+def test_token_is_not_needed_for_accounts(monkeypatch, arg_parser):
+    monkeypatch.delenv('MINECHAT_TOKEN', raising=False)
+    monkeypatch.setattr('settings.read_token_from_file', lambda path: None)
+    settings = read_settings(arg_parser, cmd_params=['--accounts=accounts.json'])
+    assert settings.token is None
+
+
+def test_negative_socket_option_is_rejected(arg_parser):
+    with pytest.raises(SystemExit):
+        read_settings(arg_parser, cmd_params=['--tcp-keepidle=-1'])
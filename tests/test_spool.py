@@ -0,0 +1,70 @@
+import asyncio
+import os
+import threading
+
+import spool as spool_module
+from spool import OutgoingSpool
+
+
+def open_spool(path):
+    async def create():
+        return OutgoingSpool(path)
+    return asyncio.run(create())
+
+
+def test_unsent_messages_survive_restart(tmp_path):
+    path = str(tmp_path / 'minechat.spool')
+    spool = open_spool(path)
+    first = spool.append('Привет')
+    spool.append('second line')
+    spool.ack([first])
+    spool.close()
+
+    restored = open_spool(path)
+    assert [message for _, message in restored.pending()] == ['second line']
+    assert restored.append('third') > first
+
+
+def test_acknowledged_message_is_not_sent_twice(tmp_path):
+    spool = open_spool(str(tmp_path / 'minechat.spool'))
+    seq = spool.append('hello')
+    spool.ack([seq])
+    spool.ack([seq])
+    assert spool.pending() == []
+
+
+def test_cut_record_is_ignored(tmp_path):
+    path = tmp_path / 'minechat.spool'
+    path.write_text('M 1 "hello"\nM 2 "unfini', encoding='utf-8')
+    spool = open_spool(str(path))
+    assert spool.pending() == [(1, 'hello')]
+
+
+def test_records_are_synced_outside_the_caller_thread(tmp_path, monkeypatch):
+    path = str(tmp_path / 'minechat.spool')
+    synced_in = []
+    fsync = os.fsync
+
+    def record_fsync(fd):
+        synced_in.append(threading.get_ident())
+        fsync(fd)
+
+    monkeypatch.setattr(os, 'fsync', record_fsync)
+    spool = open_spool(path)
+    for i in range(10):
+        spool.ack([spool.append(f'message {i}')])
+    spool.append('unsent')
+    spool.close()
+    assert synced_in and threading.get_ident() not in synced_in
+    assert [message for _, message in open_spool(path).pending()] == ['unsent']
+
+
+def test_compaction_keeps_later_messages(tmp_path, monkeypatch):
+    monkeypatch.setattr(spool_module, 'COMPACT_SIZE', 10)
+    path = str(tmp_path / 'minechat.spool')
+    spool = open_spool(path)
+    spool.ack([spool.append('long enough to compact the journal')])
+    spool.append('after compaction')
+    spool.close()
+    with open(path, encoding='utf-8') as f:
+        assert f.read() == 'M 2 "after compaction"\n'
@@ -0,0 +1,28 @@
+from watchdog import Backoff, ReconnectStats
+
+
+def test_backoff_grows_up_to_the_limit():
+    backoff = Backoff(initial_delay=1, max_delay=5, jitter=0)
+    assert [backoff.next_delay() for _ in range(5)] == [1, 2, 4, 5, 5]
+    backoff.reset()
+    assert backoff.next_delay() == 1
+
+
+def test_backoff_jitter_shortens_delay():
+    backoff = Backoff(initial_delay=10, max_delay=10, jitter=0.5)
+    delays = [backoff.next_delay() for _ in range(100)]
+    assert all(5 <= delay <= 10 for delay in delays)
+    assert len(set(delays)) > 1
+
+
+def test_reconnect_stats_measure_outage():
+    stats = ReconnectStats()
+    stats.record_attempt()
+    assert stats.record_recovery() is None
+    stats.record_failure()
+    stats.record_attempt()
+    stats.record_failure()
+    stats.record_attempt()
+    recovery_time = stats.record_recovery()
+    assert recovery_time is not None and recovery_time >= 0
+    assert (stats.failures, stats.attempts, stats.recoveries) == (2, 2, 1)
@@ -1,81 +1,238 @@
 import asyncio
 import logging
+import random
 import socket
+import time
+from functools import partial
+from typing import Any, Callable, Coroutine, Dict, Optional, Sequence
 
-import async_timeout
 from anyio import create_task_group
 from anyio.exceptions import ExceptionGroup
 
+from common_tools import SocketOptions
+from filters import MessageFilter
+from liveness import READ_CHANNEL, WRITE_CHANNEL, Healthcheck, LivenessMonitor, format_report
+from message_bus import MessageBus
+from metrics import Metrics
 from read_client import read_messages
+from spool import OutgoingSpool
 from write_client import send_messages
 
 watchdog_logger = logging.getLogger('watchdog')
 
+
+class Backoff:
+    """
+    Exponential reconnect delays with jitter and an upper limit.
+
+    Jitter shortens every delay by a random part of up to `jitter` of its length,
+    so clients which have lost connection at the same moment do not reconnect all at once.
+    """
+
+    def __init__(
+            self,
+            initial_delay: float = 0.5,
+            max_delay: float = 30.0,
+            factor: float = 2.0,
+            jitter: float = 0.5,
+    ) -> None:
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.factor = factor
+        self.jitter = jitter
+        self.attempt = 0
+
+    def next_delay(self) -> float:
+        delay = min(self.max_delay, self.initial_delay * self.factor ** self.attempt)
+        self.attempt += 1
+        return delay * (1 - self.jitter * random.random())
+
+    def reset(self) -> None:
+        self.attempt = 0
+
+
+class ReconnectStats:
+    """Reconnect attempts of a channel and time it took to recover from outages."""
+
+    def __init__(self) -> None:
+        self.failures = 0
+        self.attempts = 0
+        self.outage_attempts = 0
+        self.recoveries = 0
+        self.outage_started_at: Optional[float] = None
+        self.last_recovery_time: Optional[float] = None
+        self.total_recovery_time = 0.0
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.outage_started_at is None:
+            self.outage_started_at = time.monotonic()
+            self.outage_attempts = 0
+
+    def record_attempt(self) -> None:
+        if self.outage_started_at is not None:
+            self.attempts += 1
+            self.outage_attempts += 1
+
+    def record_recovery(self) -> Optional[float]:
+        """Returns time to recover if the channel has been down."""
+        if self.outage_started_at is None:
+            return None
+        self.last_recovery_time = time.monotonic() - self.outage_started_at
+        self.total_recovery_time += self.last_recovery_time
+        self.recoveries += 1
+        self.outage_started_at = None
+        return self.last_recovery_time
+
+
 async def watch_for_connection(
-        watchdog_queue: asyncio.Queue,
+        liveness: LivenessMonitor,
         timeout: float = 2,
+        check_interval: float = 0.5,
+        channels: Sequence[str] = (READ_CHANNEL, WRITE_CHANNEL),
+        on_alive: Optional[Callable[[], None]] = None,
+        is_overdue: Optional[Callable[[], bool]] = None,
 ):
-    """Raises exception if it seems that connection is down."""
+    """
+    Raises exception if it seems that connection is down.
+
+    Connection is down when the channels are silent for `timeout` seconds
+    or when `is_overdue` says that an expected reply has not arrived in time.
+    `on_alive` is called once when the channels show the first sign of life after the start.
+    Zero timeout disables the check but still reports the first sign of life.
+    """
+    started_at = time.monotonic()
     while True:
-        try:
-            async with async_timeout.timeout(timeout) as cm:
-                event = await watchdog_queue.get()
-        except asyncio.TimeoutError:
-            watchdog_logger.info(f'{timeout} s timeout is elapsed.')
+        await asyncio.sleep(check_interval)
+        if on_alive and liveness.idle_time(channels) < time.monotonic() - started_at:
+            on_alive()
+            on_alive = None
+        report = liveness.report()
+        if timeout and liveness.idle_time(channels, since=started_at) > timeout:
+            watchdog_logger.info(f'{timeout} s timeout is elapsed. {format_report(report)}')
             raise ConnectionError
-        else:
-            watchdog_logger.info(f'Connection is alive. {event}')
+        if is_overdue and is_overdue():
+            watchdog_logger.info(f'Server has not replied in time. {format_report(report)}')
+            raise ConnectionError
+        watchdog_logger.debug(f'Connection is alive. {format_report(report)}')
 
 
-async def handle_connection(
-        reader_host: str,
-        reader_port: int,
-        writer_host: str,
-        writer_port: int,
-        access_token: str,
-        messages_queue: asyncio.Queue,
-        sending_queue: asyncio.Queue,
-        history_queue: asyncio.Queue,
-        status_update_queue: asyncio.Queue,
-        watchdog_queue: asyncio.Queue,
-        reconnect_delay: float = 1.0,
+async def supervise_channel(
+        channel: str,
+        run_channel: Callable[[], Coroutine[Any, Any, None]],
+        liveness: LivenessMonitor,
+        timeout: float,
+        backoff: Backoff,
+        stats: ReconnectStats,
+        stable_time: float = 10.0,
+        is_overdue: Optional[Callable[[], bool]] = None,
+        check_interval: float = 0.5,
 ) -> None:
-    """Manages all the connections."""
+    """
+    Keeps a single channel connected, reconnecting with backoff after connection errors.
+
+    Backoff starts over when the previous connection has lived longer than `stable_time` seconds.
+    """
+    def on_alive() -> None:
+        recovery_time = stats.record_recovery()
+        if recovery_time is not None:
+            watchdog_logger.info(f'{channel} channel recovered in {recovery_time:.1f} s after {stats.outage_attempts} attempts.')
+
     while True:
+        connected_at = time.monotonic()
+        stats.record_attempt()
         try:
             try:
                 async with create_task_group() as tg:
-                    await tg.spawn(read_messages,
-                                   reader_host,
-                                   reader_port,
-                                   status_update_queue,
-                                   messages_queue,
-                                   history_queue,
-                                   watchdog_queue,
-                                   1,
-                                   True,
-                                   )
-                    await tg.spawn(send_messages,
-                                   writer_host,
-                                   writer_port,
-                                   access_token,
-                                   status_update_queue,
-                                   sending_queue,
-                                   watchdog_queue,
-                                   )
-                    await tg.spawn(watch_for_connection,
-                                   watchdog_queue,
-                                   2,
-                                   )
-            except (socket.gaierror, UnicodeDecodeError):
+                    await tg.spawn(run_channel)
+                    await tg.spawn(watch_for_connection, liveness, timeout, check_interval, (channel,), on_alive, is_overdue)
+            except (socket.gaierror, TimeoutError):
+                # TimeoutError is raised when kernel keepalive or user timeout gives up on the peer
                 raise ConnectionError
             except ExceptionGroup as multi_e:
                 for error in multi_e.exceptions:
-                    if isinstance(error, (socket.gaierror, ConnectionError)):
+                    if isinstance(error, (socket.gaierror, TimeoutError, ConnectionError)):
                         raise ConnectionError
                 raise
         except ConnectionError:
-            watchdog_logger.info(f'Connection error, reconnect in {reconnect_delay} sec.')
-            await asyncio.sleep(reconnect_delay)
+            stats.record_failure()
+            if time.monotonic() - connected_at > stable_time:
+                backoff.reset()
+            delay = backoff.next_delay()
+            watchdog_logger.info(f'{channel} channel connection error, reconnect in {delay:.1f} sec.')
+            await asyncio.sleep(delay)
         else:
             return
+
+
+async def handle_connection(
+        reader_host: str,
+        reader_port: int,
+        writer_host: str,
+        writer_port: int,
+        access_token: str,
+        message_bus: MessageBus,
+        spool: OutgoingSpool,
+        status_update_queue: asyncio.Queue,
+        liveness: LivenessMonitor,
+        reconnect_min_delay: float = 0.5,
+        reconnect_max_delay: float = 30.0,
+        read_timeout: float = 0,
+        healthcheck: Optional[Healthcheck] = None,
+        socket_options: Optional[SocketOptions] = None,
+        message_filter: Optional[MessageFilter] = None,
+        reconnect_stats: Optional[Dict[str, ReconnectStats]] = None,
+        metrics: Optional[Metrics] = None,
+) -> None:
+    """Manages read and write connections, each of them is reconnected independently."""
+    if healthcheck is None:
+        healthcheck = Healthcheck()
+    if reconnect_stats is None:
+        reconnect_stats = {}
+    for channel in (READ_CHANNEL, WRITE_CHANNEL):
+        stats = reconnect_stats.setdefault(channel, ReconnectStats())
+        if metrics:
+            metrics.add_reader('minechat_reconnects_total', partial(getattr, stats, 'failures'), channel=channel)
+
+    async with create_task_group() as tg:
+        await tg.spawn(supervise_channel,
+                       READ_CHANNEL,
+                       partial(read_messages,
+                               reader_host,
+                               reader_port,
+                               status_update_queue,
+                               message_bus,
+                               liveness,
+                               1,
+                               message_filter,
+                               socket_options,
+                               metrics,
+                               ),
+                       liveness,
+                       read_timeout,
+                       Backoff(reconnect_min_delay, reconnect_max_delay),
+                       reconnect_stats[READ_CHANNEL],
+                       )
+        await tg.spawn(supervise_channel,
+                       WRITE_CHANNEL,
+                       partial(send_messages,
+                               writer_host,
+                               writer_port,
+                               access_token,
+                               status_update_queue,
+                               spool,
+                               liveness,
+                               healthcheck,
+                               socket_options,
+                               metrics,
+                               ),
+                       liveness,
+                       # pings keep the channel busy, silence means that they are not sent at all
+                       healthcheck.idle_interval + healthcheck.max_timeout,
+                       Backoff(reconnect_min_delay, reconnect_max_delay),
+                       reconnect_stats[WRITE_CHANNEL],
+                       10.0,
+                       healthcheck.is_overdue,
+                       # a dead link is found in idle interval plus reply timeout plus one check
+                       0.25,
+                       )
@@ -2,26 +2,34 @@ import asyncio
 import json
 import logging
 from asyncio.streams import StreamReader, StreamWriter
-from typing import Dict
+from typing import Dict, Optional
 
 from anyio import create_task_group
 
-import gui
-from common_tools import connect, write_line_to_chat, read_line_from_chat
+from common_tools import CoalescingWriter, SocketOptions, check_eof, connect, read_line_from_chat, write_line_to_chat
 from exceptions import InvalidToken, UnknownError, MinechatException
+from liveness import WRITE_CHANNEL, Healthcheck, LivenessMonitor
+from metrics import Metrics
+from spool import OutgoingSpool
+from states import NicknameReceived, SendingConnectionStateChanged
 
 
 async def authenticate(
         access_token: str,
         reader: StreamReader,
         writer: StreamWriter,
-        watchdog_queue: asyncio.Queue
+        liveness: LivenessMonitor,
+        healthcheck: Optional[Healthcheck] = None,
 ) -> Dict[str, str]:
-    """Authenticate user by token."""
+    """Authenticate user by token, the round trip of the token gives the first RTT sample."""
     await read_line_from_chat(reader)
-    await watchdog_queue.put('Greetings before authentication')
+    liveness.touch(WRITE_CHANNEL)
+    if healthcheck:
+        healthcheck.line_sent()
     await write_line_to_chat(writer, access_token)
     response = await read_line_from_chat(reader)
+    if healthcheck:
+        healthcheck.reply_received()
     try:
         account_info = json.loads(response)
     except json.JSONDecodeError:
@@ -29,7 +37,7 @@ async def authenticate(
     else:
         if account_info is None:
             raise InvalidToken('Неверный токен', 'Проверьте токен, сервер его не узнал')
-        await watchdog_queue.put('Authenticated')
+        liveness.touch(WRITE_CHANNEL)
         return account_info
 
 
@@ -37,8 +45,8 @@ async def register(
         reader: StreamReader,
         writer: StreamWriter,
         nickname: str,
-) -> None:
-    """New user registration."""
+) -> Dict[str, str]:
+    """New user registration, returns account info with the token."""
     await read_line_from_chat(reader)
     await write_line_to_chat(writer, '')  # say 'we don't have a token'
     await read_line_from_chat(reader)  # ask_for_nickname
@@ -54,44 +62,60 @@ async def register(
 
 
 async def send_user_messages(
-        writer: StreamWriter,
-        messages_queue: asyncio.Queue,
-        watchdog_queue: asyncio.Queue
+        chat_writer: CoalescingWriter,
+        spool: OutgoingSpool,
+        healthcheck: Healthcheck,
+        metrics: Optional[Metrics] = None,
 ) -> None:
-    """Reads messages from queue and send them to server."""
+    """Sends messages from the spool to server and acknowledges them once they are written."""
     while True:
-        message = await messages_queue.get()
-        logging.debug(f'Пользователь написал {message}')
-        await write_line_to_chat(writer, message)
-        # message doesn't appear in the chat if only one `\n` used
-        await write_line_to_chat(writer, '')
-        await watchdog_queue.put('Message has been sent')
+        await spool.wait_pending()
+        pending = spool.pending()
+        for _, message in pending:
+            logging.debug(f'Пользователь написал {message}')
+            chat_writer.write_line(message)
+            # message doesn't appear in the chat if only one `\n` used
+            chat_writer.write_line('')
+        # marked before the flush as the reply can arrive while the data is being drained
+        healthcheck.line_sent()
+        await chat_writer.flush()
+        spool.ack(seq for seq, _ in pending)
+        if metrics:
+            metrics.messages_sent.inc(len(pending))
 
 
 async def send_healthcheck_messages(
-        writer: StreamWriter,
-        interval: float = 1,
+        chat_writer: CoalescingWriter,
+        liveness: LivenessMonitor,
+        healthcheck: Healthcheck,
 ) -> None:
-    """Send healthcheck messages (pings) to the server."""
+    """Send healthcheck messages (pings) to the server when there is no other traffic."""
     while True:
-        writer.write(b'\n')
-        await writer.drain()
-        await asyncio.sleep(interval)
+        idle_time = liveness.idle_time([WRITE_CHANNEL])
+        if idle_time < healthcheck.idle_interval:
+            await asyncio.sleep(healthcheck.idle_interval - idle_time)
+            continue
+        chat_writer.write_raw(b'\n')
+        healthcheck.line_sent()
+        await chat_writer.flush()
+        # the reply resets idle time, next ping is sent after it
+        await asyncio.sleep(healthcheck.idle_interval)
 
 
 async def read_healthcheck_messages(
         reader: StreamReader,
-        watchdog_queue: asyncio.Queue,
+        liveness: LivenessMonitor,
+        healthcheck: Healthcheck,
+        metrics: Optional[Metrics] = None,
 ) -> None:
-    """Reads server responses to healthcheck messages."""
+    """Reads server responses to healthcheck messages and user messages."""
     while True:
         new_line = await reader.readline()
-        # note - readline() returns an empty string hundreds times per second then connection to server breaks.
-        # sleep here is to prevent eventloop blocking and 100% cpu load.
-        if new_line == b'':
-            await asyncio.sleep(0)
-            continue
-        await watchdog_queue.put('Healthcheck message')
+        check_eof(new_line)
+        liveness.touch(WRITE_CHANNEL)
+        rtt = healthcheck.reply_received()
+        if metrics and rtt is not None:
+            metrics.healthcheck_rtt_seconds.observe(rtt)
 
 
 async def send_messages(
@@ -99,25 +123,33 @@ async def send_messages(
         port: int,
         access_token: str,
         status_update_queue: asyncio.Queue,
-        sending_queue: asyncio.Queue,
-        watchdog_queue: asyncio.Queue,
+        spool: OutgoingSpool,
+        liveness: LivenessMonitor,
+        healthcheck: Healthcheck,
+        socket_options: Optional[SocketOptions] = None,
+        metrics: Optional[Metrics] = None,
 ) -> None:
-    """Send messages to minechat."""
+    """Send messages to minechat, messages left in the spool are sent right after authentication."""
+    # a line unanswered by the previous connection must not time out or measure this one
+    healthcheck.reset()
     async with connect(
         host=host,
         port=port,
         status_update_queue=status_update_queue,
-        gui_state_class=gui.SendingConnectionStateChanged,
+        gui_state_class=SendingConnectionStateChanged,
         timeout=1,
+        socket_options=socket_options,
     ) as (reader, writer):
         account_info = await authenticate(
             access_token,
             reader,
             writer,
-            watchdog_queue,
+            liveness,
+            healthcheck,
         )
-        await status_update_queue.put(gui.NicknameReceived(account_info['nickname']))
+        await status_update_queue.put(NicknameReceived(account_info['nickname']))
+        chat_writer = CoalescingWriter(writer, metrics)
         async with create_task_group() as tg:
-            await tg.spawn(send_user_messages, writer, sending_queue, watchdog_queue)
-            await tg.spawn(send_healthcheck_messages, writer, 1)
-            await tg.spawn(read_healthcheck_messages, reader, watchdog_queue)
+            await tg.spawn(send_user_messages, chat_writer, spool, healthcheck, metrics)
+            await tg.spawn(send_healthcheck_messages, chat_writer, liveness, healthcheck)
+            await tg.spawn(read_healthcheck_messages, reader, liveness, healthcheck, metrics)